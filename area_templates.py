@@ -0,0 +1,109 @@
+"""
+Area-of-effect templates on the battle grid: sphere, cone, line and cube.
+
+An "aoe" spell may describe its area; without one it is a 20-ft sphere (or uses the legacy
+"radius" key):
+    "area": {"shape": "cone", "size": 15}
+    "area": {"shape": "sphere", "size": 10, "origin": "self"}
+    "area": {"shape": "sphere", "size": 20, "friendly_fire": false}
+
+  - size is the sphere's radius, the cone's or line's length and the cube's side, in feet,
+  - origin "self" starts the area at the caster (who is never caught in it), "point" places it
+    on a square within the spell's "range" (default 60 ft). Cones, lines and cubes default to
+    "self", spheres to "point",
+  - friendly_fire (default true) catches the caster's allies too.
+
+A template is resolved to a mask: the set of (dx, dy) square offsets it covers from its
+origin square. Masks depend only on shape, size and orientation (directions are snapped to
+one of 16 compass points), so they are computed once and reused for every origin - a
+sustained aura or a spell cast every turn pays only for the creatures it looks up.
+"""
+
+import math
+from functools import lru_cache
+
+from battle_grid import SQUARE_FEET
+
+SHAPES = ("sphere", "cone", "line", "cube")
+ORIENTATIONS = 16  # Compass points that cone, line and cube directions are snapped to
+DEFAULT_AREA = {"shape": "sphere", "size": 20}
+DEFAULT_SPELL_RANGE = 60  # Feet from the caster to a "point" origin
+
+
+class AreaMask:
+    """The squares a template covers, as offsets from its origin square."""
+    __slots__ = ("offsets", "extent")
+
+    def __init__(self, offsets):
+        self.offsets = frozenset(offsets)
+        # Furthest covered square in feet: creatures beyond it are never looked at
+        self.extent = max((max(abs(dx), abs(dy)) for dx, dy in self.offsets), default=0) * SQUARE_FEET
+
+    def __contains__(self, offset):
+        return offset in self.offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+
+def area_of(spell):
+    """A spell's area description with the defaults filled in; raises ValueError for unknown shapes."""
+    area = spell.get("area")
+    if area is None:
+        area = {"shape": "sphere", "size": spell["radius"]} if spell.get("radius") else DEFAULT_AREA
+    shape = area.get("shape", "sphere")
+    if shape not in SHAPES:
+        raise ValueError(f"{spell.get('name')}: unknown area shape {shape!r} (expected one of {', '.join(SHAPES)}).")
+    return {
+        "shape": shape,
+        "size": area.get("size", DEFAULT_AREA["size"]),
+        "origin": area.get("origin", "point" if shape == "sphere" else "self"),
+        "friendly_fire": area.get("friendly_fire", True),
+    }
+
+
+def orientation(direction):
+    """Snap a direction vector (dx, dy) to a compass point index, or None for no direction."""
+    if direction is None or tuple(direction) == (0, 0):
+        return None
+    angle = math.atan2(direction[1], direction[0])
+    return round(angle / (2 * math.pi / ORIENTATIONS)) % ORIENTATIONS
+
+
+@lru_cache(maxsize=512)
+def area_mask(shape, size, facing=None):
+    """
+    The mask of a template with its origin square at (0, 0). `facing` is an orientation()
+    index; cones and lines need one, cubes use it to extend away from the caster and are
+    centred on the origin without it.
+    """
+    length = size // SQUARE_FEET
+    if shape == "sphere":
+        limit = (length + 0.5) ** 2
+        return AreaMask((dx, dy) for dx in range(-length, length + 1) for dy in range(-length, length + 1)
+                        if dx * dx + dy * dy <= limit)
+
+    if shape == "cube" and facing is None:
+        low = -(length // 2)
+        return AreaMask((dx, dy) for dx in range(low, low + length) for dy in range(low, low + length))
+
+    if facing is None:
+        raise ValueError(f"A {shape} needs a direction.")
+    angle = facing * 2 * math.pi / ORIENTATIONS
+    ux, uy = math.cos(angle), math.sin(angle)
+    offsets = []
+    for dx in range(-length - 1, length + 2):
+        for dy in range(-length - 1, length + 2):
+            forward = dx * ux + dy * uy
+            lateral = abs(dy * ux - dx * uy)
+            if shape == "cone":
+                # A 5e cone is as wide as it is far from its point
+                covered = 0 < forward <= length + 0.5 and lateral <= forward / 2 + 0.5
+            elif shape == "line":
+                covered = 0 < forward <= length + 0.5 and lateral <= 0.5
+            else:
+                # A cube pushed out in front of the caster
+                covered = 0.5 < forward <= length + 0.5 and lateral <= length / 2
+            if covered and (dx, dy) != (0, 0):
+                offsets.append((dx, dy))
+    return AreaMask(offsets)
@@ -0,0 +1,197 @@
+"""
+Grid positions and a uniform spatial hash for the battle map.
+
+Characters may carry a `position`: an (x, y) square on a grid of 5-ft squares. Distances
+follow the 5e grid rule: every square, diagonal or not, is 5 ft (Chebyshev distance).
+Characters without a position are "theatre of the mind": they are in range of everyone.
+
+The engine keeps every positioned combatant in a SpatialHash: the map is cut into cells
+of CELL_SQUARES x CELL_SQUARES squares and each cell holds the characters standing in it,
+so a neighbourhood query only looks at the few cells overlapping it instead of every pair
+of characters on the map. Moving a character only touches its old and new cells.
+"""
+
+SQUARE_FEET = 5  # One grid square
+CELL_SQUARES = 8  # Spatial hash cell width in squares (40 ft): a typical reach/range check spans 1-4 cells
+MELEE_REACH = 5  # Feet, unless the weapon has a "reach"
+DEFAULT_RANGE = (80, 320)  # Normal/long range in feet for ranged and magic weapons without a "range"
+
+
+def as_position(value):
+    """A position as an (x, y) tuple of ints, or None; accepts lists from JSON."""
+    if value is None:
+        return None
+    x, y = value
+    return (int(x), int(y))
+
+
+def grid_distance(a, b):
+    """Distance in feet between two squares (diagonals count as 5 ft)."""
+    return max(abs(a[0] - b[0]), abs(a[1] - b[1])) * SQUARE_FEET
+
+
+def weapon_reach(weapon):
+    """
+    How far (in feet) a weapon can hit: its "reach" for melee weapons, the long end of its
+    "range" ([normal, long] or a single number) for ranged and magic weapons.
+    """
+    if weapon is None or weapon.get("type", "melee") == "melee":
+        return (weapon or {}).get("reach", MELEE_REACH)
+    weapon_range = weapon.get("range", DEFAULT_RANGE)
+    if isinstance(weapon_range, (list, tuple)):
+        return weapon_range[-1]
+    return weapon_range
+
+
+class SpatialHash:
+    """
+    Uniform grid of buckets over the battle map. Items are bucketed by the cell their square
+    falls in; buckets keep insertion order so queries are deterministic.
+    """
+
+    def __init__(self, cell_squares=CELL_SQUARES):
+        self.cell_squares = cell_squares
+        self.cells = {}  # (cell x, cell y) -> {item: position}
+        self.positions = {}  # item -> position
+        self.bounds = None  # (min cell x, min cell y, max cell x, max cell y) ever occupied, bounds nearest()
+        self.occupants = {}  # position -> {item: None}, for exact-square lookups
+        self.version = 0  # Bumped whenever occupancy changes, so path caches know when to forget
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, item):
+        return item in self.positions
+
+    def cell_of(self, position):
+        return (position[0] // self.cell_squares, position[1] // self.cell_squares)
+
+    def insert(self, item, position):
+        if item in self.positions:
+            self.move(item, position)
+            return
+        self.positions[item] = position
+        self._bucket(self.cell_of(position))[item] = position
+        self.occupants.setdefault(position, {})[item] = None
+        self.version += 1
+
+    def touch(self):
+        """Record an occupancy change that moved nothing, e.g. a creature falling."""
+        self.version += 1
+
+    def _vacate(self, item, position):
+        square = self.occupants[position]
+        del square[item]
+        if not square:
+            del self.occupants[position]
+
+    def _bucket(self, cell):
+        bucket = self.cells.get(cell)
+        if bucket is None:
+            bucket = self.cells[cell] = {}
+            if self.bounds is None:
+                self.bounds = (cell[0], cell[1], cell[0], cell[1])
+            else:
+                low_x, low_y, high_x, high_y = self.bounds
+                self.bounds = (min(low_x, cell[0]), min(low_y, cell[1]), max(high_x, cell[0]), max(high_y, cell[1]))
+        return bucket
+
+    def remove(self, item):
+        position = self.positions.pop(item, None)
+        if position is None:
+            return
+        cell = self.cell_of(position)
+        bucket = self.cells[cell]
+        del bucket[item]
+        if not bucket:
+            del self.cells[cell]
+        self._vacate(item, position)
+        self.version += 1
+
+    def move(self, item, position):
+        """Update an item's position, touching only the old and new buckets."""
+        old = self.positions.get(item)
+        if old is None:
+            self.insert(item, position)
+            return
+        if old == position:
+            return
+        old_cell, new_cell = self.cell_of(old), self.cell_of(position)
+        self.positions[item] = position
+        self._vacate(item, old)
+        self.occupants.setdefault(position, {})[item] = None
+        self.version += 1
+        if old_cell == new_cell:
+            self.cells[old_cell][item] = position
+            return
+        bucket = self.cells[old_cell]
+        del bucket[item]
+        if not bucket:
+            del self.cells[old_cell]
+        self._bucket(new_cell)[item] = position
+
+    def at(self, position):
+        """Items standing on a square."""
+        return list(self.occupants.get(position, ()))
+
+    def within(self, position, feet, predicate=None):
+        """Items within `feet` of a square (grid distance), optionally filtered by predicate."""
+        radius = feet // SQUARE_FEET
+        x, y = position
+        low_x, low_y = self.cell_of((x - radius, y - radius))
+        high_x, high_y = self.cell_of((x + radius, y + radius))
+        found = []
+        for cell_x in range(low_x, high_x + 1):
+            for cell_y in range(low_y, high_y + 1):
+                bucket = self.cells.get((cell_x, cell_y))
+                if not bucket:
+                    continue
+                for item, square in bucket.items():
+                    if max(abs(square[0] - x), abs(square[1] - y)) <= radius and (predicate is None or predicate(item)):
+                        found.append(item)
+        return found
+
+    def nearest(self, position, predicate=None, max_feet=None):
+        """
+        The closest item to a square that satisfies predicate, or None. Searches rings of
+        cells outwards and stops once no unvisited cell can hold anything closer.
+        """
+        if not self.positions:
+            return None
+        x, y = position
+        center_x, center_y = self.cell_of(position)
+        low_x, low_y, high_x, high_y = self.bounds
+        max_ring = max(abs(center_x - low_x), abs(center_x - high_x), abs(center_y - low_y), abs(center_y - high_y))
+        limit = None if max_feet is None else max_feet // SQUARE_FEET
+        best, best_distance = None, None
+        for ring in range(max_ring + 1):
+            # Any square in this ring of cells is at least (ring - 1) * cell_squares + 1 squares away
+            if best_distance is not None and (ring - 1) * self.cell_squares >= best_distance:
+                break
+            if limit is not None and (ring - 1) * self.cell_squares >= limit:
+                break
+            for cell in self._ring(center_x, center_y, ring):
+                bucket = self.cells.get(cell)
+                if not bucket:
+                    continue
+                for item, square in bucket.items():
+                    distance = max(abs(square[0] - x), abs(square[1] - y))
+                    if limit is not None and distance > limit:
+                        continue
+                    if best_distance is not None and distance >= best_distance:
+                        continue
+                    if predicate is None or predicate(item):
+                        best, best_distance = item, distance
+        return best
+
+    @staticmethod
+    def _ring(center_x, center_y, ring):
+        if ring == 0:
+            yield (center_x, center_y)
+            return
+        for offset in range(-ring, ring + 1):
+            yield (center_x + offset, center_y - ring)
+            yield (center_x + offset, center_y + ring)
+        for offset in range(-ring + 1, ring):
+            yield (center_x - ring, center_y + offset)
+            yield (center_x + ring, center_y + offset)
@@ -1,12 +1,59 @@
-import requests
+"""
+D&D 5e character and lore sheet generation through the Venice AI chat completions API.
+
+Run without arguments for the interactive generator. Batch mode generates many characters
+at once (see generate_batch):
+
+    python3 character_generator.py --batch party.json --concurrency 8 --rate 5
+    python3 character_generator.py --batch party.json --mock   # against mock_llm_server.py, offline
+
+where party.json is a list of [name, description] pairs. Batch requests run concurrently
+over a pool of keep-alive connections, limited to `concurrency` in flight and `rate`
+requests per second (a token bucket allowing bursts of `burst`). Failed requests (timeouts,
+dropped connections, HTTP 429 and 5xx) are retried with exponential backoff. A character's
+lore sheet does not wait for its character: both requests are queued at once, so the two
+halves of every pair are pipelined.
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import http.client
+import io
 import json
 import os
+import random
 import re
-from dotenv import load_dotenv
+import threading
+import time
+from urllib.parse import urlsplit
+
+try:
+    from dotenv import load_dotenv
+except ImportError:  # python-dotenv only reads a .env file; the key may be set in the environment already
+    load_dotenv = None
 
 # Load environment variables for API key
-load_dotenv()
+if load_dotenv is not None:
+    load_dotenv()
 VENICE_API_KEY = os.getenv("VENICE_API_KEY")
+API_URL = "https://api.venice.ai/api/v1/chat/completions"
+REQUEST_TIMEOUT = 60.0  # Seconds before a single generation request is abandoned
+
+# Batch generation settings (see generate_batch)
+BATCH_DEFAULTS = {
+    "endpoint": API_URL,
+    "api_key": None,  # None = VENICE_API_KEY
+    "concurrency": 8,  # Requests in flight at once, one pooled connection each
+    "rate": 5.0,  # Requests started per second, on average
+    "burst": 10,  # Requests that may start at once after a quiet spell
+    "retries": 4,  # Attempts after the first before a request is given up
+    "backoff": 0.5,  # Seconds before the first retry, doubled for every further one
+    "max_backoff": 8.0,
+    "timeout": REQUEST_TIMEOUT,
+}
+RETRY_STATUSES = (429, 500, 502, 503, 504)
 
 def load_game_state_template():
     """Load the game state template specification from gs_template.md"""
@@ -16,11 +63,8 @@ def load_game_state_template():
     except Exception as e:
         raise Exception(f"Failed to load game state template from gs_template.md: {str(e)}")
 
-def generate_character(name, description):
-    """Generate a character using Venice AI API based on user description"""
-    url = "https://api.venice.ai/api/v1/chat/completions"
-    template_spec = load_game_state_template()
-    
+def character_payload(name, description, template_spec):
+    """The chat completions request body asking for one character."""
     system_prompt = "You are an AI assistant tasked with generating D&D 5e characters. Always return strictly formatted JSON objects with no additional text."
     user_prompt = (
         f"Generate a D&D 5e character named '{name}' based on the following description: '{description}'. "
@@ -42,42 +86,50 @@ def generate_character(name, description):
         },
         "parallel_tool_calls": True
     }
-    headers = {
-        "Authorization": f"Bearer {VENICE_API_KEY}",
+    return payload
+
+def parse_character(data):
+    """The character dict of a chat completions reply, or None (the reason is printed)."""
+    if "choices" in data and data["choices"]:
+        content = data["choices"][0]["message"]["content"]
+        # Clean the response by removing markdown code block markers
+        content = re.sub(r'```json|```', '', content).strip()
+        try:
+            response_data = json.loads(content)
+            # Extract the first character from the 'players' array if it exists
+            if "players" in response_data and response_data["players"]:
+                return response_data["players"][0]
+            else:
+                print("Error: Response does not contain a 'players' array with character data.")
+                return None
+        except json.JSONDecodeError:
+            print("Error: Response is not valid JSON. Raw response:")
+            print(content)
+            return None
+    else:
+        print("No valid choices in API response.")
+        return None
+
+def request_headers(api_key=None):
+    return {
+        "Authorization": f"Bearer {api_key or VENICE_API_KEY}",
         "Content-Type": "application/json"
     }
-    
+
+def generate_character(name, description):
+    """Generate a character using Venice AI API based on user description"""
+    import requests
+    payload = character_payload(name, description, load_game_state_template())
     try:
-        response = requests.post(url, json=payload, headers=headers)
+        response = requests.post(API_URL, json=payload, headers=request_headers(), timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
-        data = response.json()
-        if "choices" in data and data["choices"]:
-            content = data["choices"][0]["message"]["content"]
-            # Clean the response by removing markdown code block markers
-            content = re.sub(r'```json|```', '', content).strip()
-            try:
-                response_data = json.loads(content)
-                # Extract the first character from the 'players' array if it exists
-                if "players" in response_data and response_data["players"]:
-                    return response_data["players"][0]
-                else:
-                    print("Error: Response does not contain a 'players' array with character data.")
-                    return None
-            except json.JSONDecodeError:
-                print("Error: Response is not valid JSON. Raw response:")
-                print(content)
-                return None
-        else:
-            print("No valid choices in API response.")
-            return None
+        return parse_character(response.json())
     except requests.exceptions.RequestException as e:
         print(f"API Error: {e}. Response: {getattr(e.response, 'text', 'No response')}")
         return None
 
-def generate_lore_sheet(name, description):
-    """Generate a lore sheet for the character using Venice AI API"""
-    url = "https://api.venice.ai/api/v1/chat/completions"
-    
+def lore_payload(name, description):
+    """The chat completions request body asking for one lore sheet."""
     system_prompt = "You are an AI assistant tasked with generating lore sheets for D&D 5e characters. Return a concise backstory and personality description."
     user_prompt = (
         f"Generate a basic lore sheet for a D&D 5e character named '{name}' with the following description: '{description}'. "
@@ -97,21 +149,24 @@ def generate_lore_sheet(name, description):
         },
         "parallel_tool_calls": True
     }
-    headers = {
-        "Authorization": f"Bearer {VENICE_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
+    return payload
+
+def parse_lore_sheet(data):
+    """The lore text of a chat completions reply, or None."""
+    if "choices" in data and data["choices"]:
+        content = data["choices"][0]["message"]["content"]
+        return content
+    else:
+        print("No valid choices in lore sheet API response.")
+        return None
+
+def generate_lore_sheet(name, description):
+    """Generate a lore sheet for the character using Venice AI API"""
+    import requests
     try:
-        response = requests.post(url, json=payload, headers=headers)
+        response = requests.post(API_URL, json=lore_payload(name, description), headers=request_headers(), timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
-        data = response.json()
-        if "choices" in data and data["choices"]:
-            content = data["choices"][0]["message"]["content"]
-            return content
-        else:
-            print("No valid choices in lore sheet API response.")
-            return None
+        return parse_lore_sheet(response.json())
     except requests.exceptions.RequestException as e:
         print(f"API Error for lore sheet: {e}. Response: {getattr(e.response, 'text', 'No response')}")
         return None
@@ -144,8 +199,220 @@ def save_lore_sheet(name, lore_content):
         print("No valid lore data to save.")
         return None
 
+class RequestFailed(Exception):
+    """A generation request that failed; `retryable` if sending it again may succeed."""
+
+    def __init__(self, message, retryable, retry_after=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average and up to `burst` at once (rate 0 = unlimited)."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class BatchGenerator:
+    """
+    Sends the character and lore requests of a batch concurrently, over one keep-alive
+    connection per worker thread, within the concurrency and rate limits of its config
+    (see BATCH_DEFAULTS), retrying failed requests with exponential backoff.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        url = urlsplit(config["endpoint"])
+        self.host, self.port, self.path = url.hostname, url.port, url.path or "/"
+        self.https = url.scheme == "https"
+        self.headers = request_headers(config["api_key"])
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self._connections = threading.local()  # One keep-alive connection per executor thread
+        self._opened = []
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=config["concurrency"],
+                                                               thread_name_prefix="character-generator-http")
+
+    def _post(self, payload):
+        """Blocking POST on this thread's keep-alive connection; raises RequestFailed."""
+        connection = getattr(self._connections, "connection", None)
+        if connection is None:
+            connection_class = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            connection = connection_class(self.host, self.port, timeout=self.config["timeout"])
+            self._connections.connection = connection
+            self._opened.append(connection)
+        try:
+            connection.request("POST", self.path, json.dumps(payload).encode(), self.headers)
+            response = connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException) as error:  # Timeouts, refused or dropped connections
+            connection.close()
+            self._connections.connection = None
+            raise RequestFailed(f"{type(error).__name__}: {error}", retryable=True) from None
+        if response.status != 200:
+            retry_after = response.getheader("Retry-After")
+            raise RequestFailed(f"HTTP {response.status}: {data[:200]!r}", retryable=response.status in RETRY_STATUSES,
+                                retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None)
+        try:
+            return json.loads(data)
+        except json.JSONDecodeError:
+            raise RequestFailed(f"Reply is not JSON: {data[:200]!r}", retryable=True) from None
+
+    def backoff(self, attempt, error):
+        """Seconds to wait before retry `attempt` (1, 2, ...): the server's Retry-After, else jittered exponential."""
+        if error.retry_after is not None:
+            return min(error.retry_after, self.config["max_backoff"])
+        delay = min(self.config["max_backoff"], self.config["backoff"] * 2 ** (attempt - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def request(self, payload):
+        """The reply to one request, retried up to config["retries"] times; raises RequestFailed."""
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.config["retries"] + 1):
+            if attempt:
+                self.retries += 1
+            async with self._in_flight:
+                await self._bucket.acquire()
+                self.requests += 1
+                try:
+                    return await loop.run_in_executor(self._executor, self._post, payload)
+                except RequestFailed as error:
+                    failure = error
+            if not failure.retryable or attempt == self.config["retries"]:
+                self.failures += 1
+                raise failure
+            await asyncio.sleep(self.backoff(attempt + 1, failure))
+
+    async def generate(self, name, description, template_spec):
+        """Character and lore sheet of one name/description pair, requested at the same time."""
+        result = {"name": name, "description": description, "character": None, "lore": None, "errors": []}
+        replies = await asyncio.gather(self.request(character_payload(name, description, template_spec)),
+                                       self.request(lore_payload(name, description)), return_exceptions=True)
+        for kind, parse, reply in zip(("character", "lore"), (parse_character, parse_lore_sheet), replies):
+            if isinstance(reply, Exception):
+                result["errors"].append(f"{kind}: {reply}")
+                continue
+            with contextlib.redirect_stdout(io.StringIO()) as printed:  # The parsers print why a reply is unusable
+                result[kind] = parse(reply)
+            if result[kind] is None:
+                result["errors"].append(f"{kind}: {printed.getvalue().strip() or 'empty reply'}")
+        return result
+
+    async def run(self, pairs, template_spec):
+        self._in_flight = asyncio.Semaphore(self.config["concurrency"])
+        self._bucket = TokenBucket(self.config["rate"], self.config["burst"])
+        return await asyncio.gather(*(self.generate(name, description, template_spec) for name, description in pairs))
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        for connection in self._opened:
+            connection.close()
+
+
+def generate_batch(pairs, template_spec=None, save=False, **config):
+    """
+    Generate a character and lore sheet for every (name, description) pair concurrently.
+    Keyword arguments override BATCH_DEFAULTS. Returns (results, stats): one result dict per
+    pair, in order ({"name", "description", "character", "lore", "errors"}, where character or
+    lore is None if it failed), and request statistics. With save=True, successful characters
+    and lore sheets are saved to /players.
+    """
+    unknown = set(config) - set(BATCH_DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown batch generation settings: {', '.join(sorted(unknown))}")
+    config = dict(BATCH_DEFAULTS, **config)
+    if template_spec is None:
+        template_spec = load_game_state_template()
+
+    generator = BatchGenerator(config)
+    started = time.perf_counter()
+    try:
+        results = asyncio.run(generator.run(list(pairs), template_spec))
+    finally:
+        generator.close()
+    seconds = time.perf_counter() - started
+
+    if save:
+        for result in results:
+            if result["character"]:
+                save_character(result["character"])
+            if result["lore"]:
+                save_lore_sheet(result["name"], result["lore"])
+    completed = sum(1 for result in results if not result["errors"])
+    stats = {
+        "pairs": len(results),
+        "completed": completed,
+        "requests": generator.requests,
+        "retries": generator.retries,
+        "failures": generator.failures,
+        "seconds": seconds,
+        "characters_per_second": completed / seconds if seconds else 0.0,
+    }
+    return results, stats
+
+def run_batch(args):
+    """Command-line batch mode: generate the pairs listed in a JSON file and report throughput."""
+    with open(args.batch, "r") as file:
+        pairs = [(name, description) for name, description in json.load(file)]
+    config = {"concurrency": args.concurrency, "rate": args.rate}
+    server = None
+    if args.mock:
+        from mock_llm_server import start_mock_server
+        server = start_mock_server(latency=args.mock_latency)
+        config["endpoint"] = server.url
+    try:
+        template_spec = load_game_state_template()
+    except Exception as e:
+        if server is None:
+            print(f"Error: {e}")
+            return
+        template_spec = "(the mock server ignores the specification)"
+
+    print(f"Generating {len(pairs)} characters, {args.concurrency} requests at a time...")
+    try:
+        results, stats = generate_batch(pairs, template_spec, save=not args.mock, **config)
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+    for result in results:
+        if result["errors"]:
+            print(f"{result['name']}: failed ({'; '.join(result['errors'])})")
+    print(f"{stats['completed']}/{stats['pairs']} characters in {stats['seconds']:.2f}s "
+          f"({stats['characters_per_second']:.1f}/s), {stats['requests']} requests, "
+          f"{stats['retries']} retries, {stats['failures']} failed")
+
 def main():
     """Main loop for command-line character generation"""
+    parser = argparse.ArgumentParser(description="Generate D&D 5e characters and lore sheets.")
+    parser.add_argument("--batch", help="JSON file of [name, description] pairs to generate at once")
+    parser.add_argument("--concurrency", type=int, default=BATCH_DEFAULTS["concurrency"], help="Requests in flight at once")
+    parser.add_argument("--rate", type=float, default=BATCH_DEFAULTS["rate"], help="Requests per second (0 = unlimited)")
+    parser.add_argument("--mock", action="store_true", help="Generate against a local mock_llm_server, nothing is saved")
+    parser.add_argument("--mock-latency", type=float, default=0.5, help="Seconds the mock server takes per request")
+    args = parser.parse_args()
+    if args.batch:
+        run_batch(args)
+        return
+
     print("Welcome to the D&D 5e Character Generator!")
     print("Type 'exit' at any time to quit.")
     
@@ -0,0 +1,331 @@
+"""
+SQLite-backed repository of characters and encounters.
+
+players/ keeps one JSON file per character and scenarios are loose game_state_*.json files,
+so finding "every level 3 wizard tagged undead" means scanning a directory and parsing each
+file. A CharacterRepository keeps the same entries (game_state "players"/"npcs" dicts) in a
+local SQLite database instead, indexed by class, level and tags:
+
+    repository = CharacterRepository("characters.db")
+    repository.import_files()  # players/*.json and game_state*.json, once
+    repository.save_characters(generated_npcs, role="npc", tags=["undead"])
+    state = repository.build_encounter(party={"role": "player"},
+                                       enemies={"class_type": "wizard", "tags": ["undead"], "limit": 4})
+    players, npcs = load_characters_from_dict(state)
+
+A character is identified by its name and role: a player and an NPC may share a name, and
+name lookups take an optional role to tell them apart.
+
+Entries are validated against the game_state schema before they are stored. Bulk saves and
+loads each run in a single transaction, and the entries of a query come back as one JSON
+array decoded in one go. Connections are pooled and shared between threads; a file database
+runs in WAL mode so readers do not wait for a writer.
+"""
+
+import glob
+import json
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from game_state_loader import GameStateError, build_character, build_roster, validate_entry
+from monster_templates import SpecInterner
+
+POOL_SIZE = 4  # Connections kept open per repository
+ROLES = ("player", "npc")
+SECTION_OF_ROLE = {"player": "players", "npc": "npcs"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS characters (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    role TEXT NOT NULL,
+    class_type TEXT NOT NULL,
+    level INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    UNIQUE (name, role)
+);
+CREATE INDEX IF NOT EXISTS characters_by_class ON characters (class_type, level);
+CREATE INDEX IF NOT EXISTS characters_by_level ON characters (level);
+CREATE INDEX IF NOT EXISTS characters_by_role ON characters (role, class_type);
+CREATE TABLE IF NOT EXISTS character_tags (
+    tag TEXT NOT NULL,
+    character_id INTEGER NOT NULL REFERENCES characters (id) ON DELETE CASCADE,
+    PRIMARY KEY (tag, character_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS character_tags_by_character ON character_tags (character_id);
+CREATE TABLE IF NOT EXISTS encounters (
+    name TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+"""
+
+
+class ConnectionPool:
+    """Up to `size` SQLite connections handed out one thread at a time and reused."""
+
+    def __init__(self, database, size=POOL_SIZE, uri=False):
+        self.database = database
+        self.size = size
+        self.uri = uri
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.database, uri=self.uri, check_same_thread=False)
+        connection.execute("PRAGMA foreign_keys = ON")
+        if not self.uri:
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+        return connection
+
+    @contextmanager
+    def connection(self):
+        """A connection for the duration of the block; waits for one if all are in use."""
+        try:
+            connection = self.idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                connection = self._connect() if self.created < self.size else None
+                if connection is not None:
+                    self.created += 1
+            if connection is None:
+                connection = self.idle.get()
+        try:
+            yield connection
+        finally:
+            self.idle.put(connection)
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def _level_of(entry):
+    level = entry.get("level", 1)
+    if type(level) is not int or level < 1:
+        raise GameStateError(f"{entry.get('name', '?')}.level", f"expected a positive integer, got {level!r}.")
+    return level
+
+
+class CharacterRepository:
+    """Characters and encounters in a SQLite database; database=":memory:" keeps them in memory."""
+
+    def __init__(self, database="characters.db", pool_size=POOL_SIZE):
+        if database == ":memory:":
+            # A shared-cache URI so every pooled connection sees the same in-memory database
+            self.pool = ConnectionPool(f"file:character_repository_{id(self)}?mode=memory&cache=shared",
+                                       pool_size, uri=True)
+            self._keepalive = self.pool._connect()
+        else:
+            self.pool = ConnectionPool(database, pool_size)
+            self._keepalive = None
+        with self.transaction() as connection:
+            connection.executescript(SCHEMA)
+
+    @contextmanager
+    def transaction(self):
+        """A pooled connection inside one transaction, committed at the end of the block (rolled back on error)."""
+        with self.pool.connection() as connection:
+            with connection:
+                yield connection
+
+    def close(self):
+        self.pool.close()
+        if self._keepalive is not None:
+            self._keepalive.close()
+
+    # --- Characters ---
+
+    def save_characters(self, entries, role="npc", tags=()):
+        """
+        Validate and store game_state entries in one transaction, replacing any character of
+        the same name and role. Each entry is tagged with `tags` plus its own "tags" list, if any.
+        Returns the number of characters saved.
+        """
+        if role not in ROLES:
+            raise ValueError(f"Unknown role {role!r} (expected one of {', '.join(ROLES)}).")
+        section = SECTION_OF_ROLE[role]
+        rows, entry_tags = [], []
+        for index, entry in enumerate(entries):
+            validate_entry(entry, f"{section}[{index}]", section)
+            rows.append((entry["name"], role, entry["class_type"].lower(), _level_of(entry), json.dumps(entry)))
+            entry_tags.append((entry["name"], set(tags) | set(entry.get("tags") or ())))
+        with self.transaction() as connection:
+            connection.executemany(
+                "INSERT INTO characters (name, role, class_type, level, data) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (name, role) DO UPDATE SET class_type = excluded.class_type, "
+                "level = excluded.level, data = excluded.data", rows)
+            self._tag(connection, role, entry_tags)
+        return len(rows)
+
+    def save_character(self, entry, role="player", tags=()):
+        self.save_characters([entry], role, tags)
+
+    def _tag(self, connection, role, entry_tags, replace=True):
+        ids = dict(connection.execute("SELECT name, id FROM characters "
+                                      "WHERE role = ? AND name IN (SELECT value FROM json_each(?))",
+                                      (role, json.dumps([name for name, _ in entry_tags]))))
+        if replace:
+            connection.executemany("DELETE FROM character_tags WHERE character_id = ?",
+                                   [(ids[name],) for name, _ in entry_tags])
+        connection.executemany("INSERT OR IGNORE INTO character_tags (tag, character_id) VALUES (?, ?)",
+                               [(tag, ids[name]) for name, tags in entry_tags for tag in tags])
+
+    def _query(self, class_type=None, level=None, min_level=None, max_level=None, tags=(), role=None,
+               names=None, limit=None):
+        clauses, parameters = [], []
+        if role is not None:
+            clauses.append("role = ?")
+            parameters.append(role)
+        if class_type is not None:
+            clauses.append("class_type = ?")
+            parameters.append(class_type.lower())
+        if level is not None:
+            clauses.append("level = ?")
+            parameters.append(level)
+        if min_level is not None:
+            clauses.append("level >= ?")
+            parameters.append(min_level)
+        if max_level is not None:
+            clauses.append("level <= ?")
+            parameters.append(max_level)
+        if names is not None:
+            clauses.append("name IN (SELECT value FROM json_each(?))")
+            parameters.append(json.dumps(list(names)))
+        for tag in tags:
+            clauses.append("id IN (SELECT character_id FROM character_tags WHERE tag = ?)")
+            parameters.append(tag)
+        sql = "SELECT data FROM characters"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            parameters.append(limit)
+        return sql, parameters
+
+    def find(self, class_type=None, level=None, min_level=None, max_level=None, tags=(), role=None,
+             names=None, limit=None):
+        """The stored entries matching every filter given, in the order they were first saved."""
+        sql, parameters = self._query(class_type, level, min_level, max_level, tags, role, names, limit)
+        # One JSON array built by SQLite and decoded in one go, rather than one json.loads per row
+        with self.pool.connection() as connection:
+            (array,) = connection.execute(f"SELECT '[' || coalesce(group_concat(data, ','), '') || ']' FROM ({sql})",
+                                          parameters).fetchone()
+        return json.loads(array)
+
+    def get(self, name, role=None):
+        """The stored entry of a character (the first saved of either role unless `role` is given), or None."""
+        found = self.find(names=[name], role=role, limit=1)
+        return found[0] if found else None
+
+    def explain(self, **filters):
+        """SQLite's query plan for find(**filters), to check which indexes a query uses."""
+        sql, parameters = self._query(**filters)
+        with self.pool.connection() as connection:
+            return [row[-1] for row in connection.execute(f"EXPLAIN QUERY PLAN {sql}", parameters)]
+
+    def tags_of(self, name, role=None):
+        with self.pool.connection() as connection:
+            return sorted({tag for (tag,) in connection.execute(
+                "SELECT tag FROM character_tags JOIN characters ON characters.id = character_id "
+                "WHERE name = ? AND coalesce(?, role) = role", (name, role))})
+
+    def delete(self, name, role=None):
+        """Delete the character of that name (of either role unless `role` is given); True if one was stored."""
+        with self.transaction() as connection:
+            return connection.execute("DELETE FROM characters WHERE name = ? AND coalesce(?, role) = role",
+                                      (name, role)).rowcount > 0
+
+    def count(self, **filters):
+        sql, parameters = self._query(**filters)
+        with self.pool.connection() as connection:
+            return connection.execute(f"SELECT count(*) FROM ({sql})", parameters).fetchone()[0]
+
+    def load_characters(self, role="npc", **filters):
+        """The matching players or NPCs built as engine objects, spells compiled once per distinct spell."""
+        section = SECTION_OF_ROLE[role]
+        interner = SpecInterner()
+        return [build_character(entry, f"{section}[{index}]", section, interner=interner)
+                for index, entry in enumerate(self.find(role=role, **filters))]
+
+    # --- Encounters ---
+
+    def build_encounter(self, party=None, enemies=None, name=None):
+        """
+        A game_state dict with the players matching the `party` filters and the NPCs matching
+        the `enemies` filters (see find()); saved as an encounter if named.
+        """
+        game_state = {"players": self.find(**dict(party or {}, role="player")),
+                      "npcs": self.find(**dict(enemies or {}, role="npc"))}
+        if name is not None:
+            self.save_encounter(name, game_state)
+        return game_state
+
+    def save_encounter(self, name, game_state):
+        build_roster(game_state)  # Validated like a game_state file, so a broken scenario fails here
+        with self.transaction() as connection:
+            connection.execute("INSERT INTO encounters (name, data) VALUES (?, ?) "
+                               "ON CONFLICT (name) DO UPDATE SET data = excluded.data", (name, json.dumps(game_state)))
+
+    def encounter(self, name):
+        """The game_state dict of a saved encounter, or None."""
+        with self.pool.connection() as connection:
+            row = connection.execute("SELECT data FROM encounters WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def load_encounter(self, name):
+        """(players, npcs) of a saved encounter, like load_characters_from_json."""
+        game_state = self.encounter(name)
+        if game_state is None:
+            raise KeyError(f"No encounter named {name!r}.")
+        return build_roster(game_state)
+
+    def encounters(self):
+        with self.pool.connection() as connection:
+            return [name for (name,) in connection.execute("SELECT name FROM encounters ORDER BY name")]
+
+    # --- Migration ---
+
+    def import_files(self, players_dir="players", scenario_pattern="game_state*.json"):
+        """
+        Migrate the JSON files: every players/character_*.json becomes a player character, and
+        every scenario file an encounter named after the file, whose NPCs also join the
+        repository unless an NPC of that name is already stored. One transaction per kind of file.
+        Returns (characters imported, encounters imported).
+        """
+        players = []
+        for path in sorted(glob.glob(os.path.join(players_dir, "character_*.json"))):
+            with open(path, "r") as file:
+                players.append(json.load(file))
+        imported = self.save_characters(players, role="player") if players else 0
+
+        scenarios = {}
+        for path in sorted(glob.glob(scenario_pattern)):
+            with open(path, "r") as file:
+                game_state = json.load(file)
+            build_roster(game_state)
+            scenarios[os.path.splitext(os.path.basename(path))[0]] = game_state
+        npcs = {}
+        for game_state in scenarios.values():
+            for entry in game_state["npcs"]:
+                npcs.setdefault(entry["name"], entry)
+        with self.transaction() as connection:
+            connection.executemany("INSERT INTO encounters (name, data) VALUES (?, ?) "
+                                   "ON CONFLICT (name) DO UPDATE SET data = excluded.data",
+                                   [(name, json.dumps(game_state)) for name, game_state in scenarios.items()])
+            before = connection.total_changes
+            connection.executemany("INSERT OR IGNORE INTO characters (name, role, class_type, level, data) "
+                                   "VALUES (?, 'npc', ?, ?, ?)",
+                                   [(name, entry["class_type"].lower(), _level_of(entry), json.dumps(entry))
+                                    for name, entry in npcs.items()])
+            imported += connection.total_changes - before
+            self._tag(connection, "npc", [(name, set(entry.get("tags") or ())) for name, entry in npcs.items()], replace=False)
+        return imported, len(scenarios)
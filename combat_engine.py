@@ -1,6 +1,14 @@
 # effects and conditions are applied successfully, but not removed successfully, seems like something is wrong with the part that decrements conditions. 
 # Imports
-import json
+import random
+import re
+import hashlib
+import heapq
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Sequence
+from contextlib import contextmanager
 import d20
 from rich.console import Console
 from rich.logging import RichHandler
@@ -9,6 +17,10 @@ from rich.traceback import install
 import logging
 from enum import Enum, auto
 from class_data import CLASS_DATA
+from battle_grid import MELEE_REACH, SQUARE_FEET, SpatialHash, as_position, grid_distance, weapon_reach
+from area_templates import DEFAULT_SPELL_RANGE, area_mask, area_of, orientation
+from pathfinding import FlowField, find_path
+from condition_schema import load_conditions_file
 
 
 # Initialize rich traceback handler
@@ -27,18 +39,34 @@ logger.addHandler(file_handler)
 
 # === DEBUG MODE FLAG ===
 DEBUG_MODE = True  # Set to False for normal play, True for detailed logs
+QUIET_MODE = False  # Set to True to silence log_message entirely (servers, batch simulation)
+DECISION_CACHE = None  # Shared DecisionCache for utility AI decisions, see enable_decision_cache()
+DECISION_HP_BUCKETS = 10  # HP resolution of the decision cache's abstract state keys
+DECISION_CACHE_AI_TYPES = ()  # AI types whose decisions go through DECISION_CACHE
 
-# Load the action restrictions from a file
-# Load conditions from the new conditions_apply.json file
+# Load conditions from the consolidated conditions file, validated so a malformed
+# condition fails here with a GameStateError naming the field rather than mid-fight
 def load_conditions(filepath="conditions/consolidated_conditions.json"):
-    with open(filepath, 'r') as file:
-        return json.load(file)
+    return load_conditions_file(filepath)
 
 # Example usage
 CONDITIONS_DICT = load_conditions()
 
 
+@contextmanager
+def quiet_mode():
+    """Temporarily silence all combat logging (used for replays and simulations)."""
+    global QUIET_MODE
+    previous = QUIET_MODE
+    QUIET_MODE = True
+    try:
+        yield
+    finally:
+        QUIET_MODE = previous
+
 def log_message(message, debug_only=False):
+    if QUIET_MODE:
+        return
     if not debug_only or DEBUG_MODE:
         logger.info(message)
 
@@ -57,6 +85,30 @@ def roll_with_advantage_disadvantage(modifier, adv_disadv="normal"):
     else:
         return d20.roll(f"1d20 + {modifier}")
 
+DICE_TERM = re.compile(r"\s*([+-]?)\s*(?:(\d*)d(\d+)|(\d+))\s*")
+
+def expected_dice_value(expression):
+    """
+    Average result of a dice expression such as "2d6" or "3d4+3", or None if the
+    expression is empty or not a plain sum of dice and constants.
+    """
+    if not isinstance(expression, str) or not expression.strip():
+        return None
+    total = 0.0
+    position = 0
+    while position < len(expression):
+        match = DICE_TERM.match(expression, position)
+        if not match or match.end() == position:
+            return None
+        sign = -1 if match.group(1) == "-" else 1
+        if match.group(3):
+            count = int(match.group(2) or 1)
+            total += sign * count * (int(match.group(3)) + 1) / 2
+        else:
+            total += sign * int(match.group(4))
+        position = match.end()
+    return total
+
 # Enums for action types, damage types, conditions
 class ActionType(Enum):
     ATTACK = auto()
@@ -288,7 +340,7 @@ class UnifiedEffect:
             "removal_conditions": self.removal_conditions,
             "active": self.active,
             "current_duration": self.current_duration,
-            "applied_modifiers": self.applied_modifiers
+            "applied_modifiers": dict(self.applied_modifiers)
         }
         
     @classmethod
@@ -310,10 +362,186 @@ class UnifiedEffect:
         effect.applied_modifiers = data.get("applied_modifiers", {})
         return effect
 
+class CapabilityIndex:
+    """
+    What a character can do, grouped once so AI decisions are dictionary lookups: spells by
+    type, targeting and effect attribute, condition removal spells, and damaging weapons
+    ranked by expected damage (highest first).
+    """
+
+    def __init__(self, spells, inventory):
+        self.spells_by_type = {}
+        self.spells_by_targeting = {}
+        self.spells_by_attribute = {}
+        for spell in spells or ():
+            self.spells_by_type.setdefault(spell.get('type'), []).append(spell)
+            self.spells_by_targeting.setdefault(spell.get('targeting'), []).append(spell)
+            attribute = (spell.get('effect') or {}).get('attribute')
+            if attribute is not None:
+                self.spells_by_attribute.setdefault(attribute, []).append(spell)
+        self.removal_spells = self.spells_by_attribute.get('condition_removal', [])
+
+        ranked = []
+        for index, item in enumerate(inventory or ()):
+            expected = expected_dice_value(item.get('damage'))
+            if expected is not None and expected > 0:
+                ranked.append((-expected, index, item))
+        ranked.sort(key=lambda entry: entry[:2])
+        self.damaging_weapons = [item for _, _, item in ranked]
+        self.weapon_damage = {id(item): -negated for negated, _, item in ranked}
+        self.weapons_by_name = {}
+        for item in self.damaging_weapons:
+            self.weapons_by_name.setdefault(item.get('name'), item)
+        self.spells_by_name = {}
+        for spell in spells or ():
+            self.spells_by_name.setdefault(spell.get('name'), spell)
+        # What the character can do, by name: part of the decision cache's abstract state key
+        self.profile = (tuple(self.spells_by_name), tuple(self.weapons_by_name))
+
+    def first_spell(self, spell_type):
+        """The first spell of a type, in spell list order, or None."""
+        spells = self.spells_by_type.get(spell_type)
+        return spells[0] if spells else None
+
+    @property
+    def best_weapon(self):
+        return self.damaging_weapons[0] if self.damaging_weapons else None
+
+class DecisionCache:
+    """
+    Thread-safe LRU cache for AI decisions. Holds at most max_entries, evicting the least
+    recently used first; with a ttl, entries also expire that many seconds after being stored.
+    """
+
+    def __init__(self, max_entries=65536, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # Key -> (expiry time or None, value)
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] is not None and entry[0] <= time.monotonic():
+                del self.entries[key]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self.entries[key] = (None if self.ttl is None else time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evicted += 1
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate,
+                "entries": len(self.entries), "evicted": self.evicted, "expired": self.expired}
+
+
+# AI types whose decisions depend only on the visible situation, so they can be cached
+UTILITY_AI_TYPES = ("aggressive", "healer", "support", "tactical")
+
+_effect_bits = {}  # Effect name -> bit in effect_mask, assigned on first sight
+
+def enable_decision_cache(max_entries=65536, hp_buckets=10, ai_types=("tactical",)):
+    """
+    Memoize utility AI decisions by abstract situation for every NPC in this process, so
+    encounters that keep meeting the same situation (batch runs, servers) skip the AI.
+    Building a key costs about as much as an aggressive, healer or support decision (those
+    are heap lookups), so by default only the tactical AI is cached.
+    Returns the shared DecisionCache, whose hits, misses and hit_rate report its use.
+    """
+    global DECISION_CACHE, DECISION_HP_BUCKETS, DECISION_CACHE_AI_TYPES
+    unknown = set(ai_types) - set(UTILITY_AI_TYPES)
+    if unknown:
+        raise ValueError(f"Decisions of AI types {sorted(unknown)} cannot be cached.")
+    DECISION_CACHE = DecisionCache(max_entries)
+    DECISION_HP_BUCKETS = hp_buckets
+    DECISION_CACHE_AI_TYPES = tuple(ai_types)
+    return DECISION_CACHE
+
+def disable_decision_cache():
+    global DECISION_CACHE, DECISION_CACHE_AI_TYPES
+    DECISION_CACHE = None
+    DECISION_CACHE_AI_TYPES = ()
+
+def effect_mask(character):
+    """Bitmask of the character's active effects."""
+    mask = 0
+    for name, effect in character.unified_effects.items():
+        if effect.active:
+            bit = _effect_bits.get(name)
+            if bit is None:
+                bit = _effect_bits[name] = 1 << len(_effect_bits)
+            mask |= bit
+    return mask
+
+def hp_bucket(character, buckets):
+    """HP as a fraction of max HP rounded up to 1/buckets, so only 0 HP falls in bucket 0."""
+    return -(-max(character.current_hp, 0) * buckets // max(character.hp, 1))
+
+def situation_descriptor(character, buckets):
+    """(class, HP bucket, effect bitmask) of a character, recomputed only after it changes."""
+    cached = character._situation
+    if cached is None or cached[0] != character.state_version or cached[1] != buckets:
+        descriptor = (str(character.class_type or ""), hp_bucket(character, buckets), effect_mask(character))
+        cached = character._situation = (character.state_version, buckets, descriptor)
+    return cached[2]
+
+def rank_situation(characters, buckets):
+    """The descriptors of the living characters, sorted, and the characters in the same order."""
+    ranked = sorted((situation_descriptor(c, buckets), index, c) for index, c in enumerate(characters) if c.is_alive())
+    return tuple(entry[0] for entry in ranked), [entry[2] for entry in ranked]
+
+# Marker for snapshot attributes a character does not have yet (e.g. set later by an effect)
+_MISSING = object()
+
+# Effect types that count against a character when the AI triages allies; everything else is a buff
+HARMFUL_EFFECT_TYPES = ("condition", "debuff")
+# Ability -> the Character attribute holding its modifier, used for saving throws
+SAVE_MODIFIERS = {"strength": "str_mod", "dexterity": "dex_mod", "constitution": "con_mod",
+                  "intelligence": "int_mod", "wisdom": "wis_mod", "charisma": "cha_mod"}
+
 class Character:
     """Base class for all characters (players and NPCs) in the game."""
 
-    def __init__(self, name, hp, ac, strength, dexterity, constitution, intelligence, wisdom, charisma, damage, inventory, class_type, spells=None, conditions=None, speed=30, effects=None, description=None, **kwargs):
+    # Plain attributes that change during combat and are captured by snapshots.
+    # Spells, inventory and other static data are shared between snapshots, never copied.
+    is_stack = False  # True for horde.NPCStack, which stands for several identical creatures
+    template = None  # Name of the monster template the character was spawned from, if any
+
+    SNAPSHOT_ATTRIBUTES = (
+        "current_hp", "hp", "ac", "strength", "dexterity", "constitution", "intelligence",
+        "wisdom", "charisma", "str_mod", "dex_mod", "con_mod", "int_mod", "wis_mod", "cha_mod",
+        "movement", "adv_disadv", "initiative", "proficiency_bonus", "check_action_restrictions",
+        "position",
+    )
+
+    def __init__(self, name, hp, ac, strength, dexterity, constitution, intelligence, wisdom, charisma, damage, inventory, class_type, spells=None, conditions=None, speed=30, effects=None, description=None, position=None, **kwargs):
         # log_message(f"DEBUG: conditions passed to init: {conditions}")  # Check the value of conditions passed
 
         self.name = name
@@ -332,10 +560,18 @@ class Character:
         self.class_type = class_type
         self.default_movement = speed  # Default movement set here
         self.movement = self.default_movement  # Start with the default movement
+        self.position = as_position(position)  # (x, y) grid square, or None when not on the battle map
+        self._grid = None  # Engine SpatialHash holding this character, if any
         self.spells = spells if spells is not None else []
         self.proficiency_bonus = 0  # Base proficiency bonus, can be updated dynamically
         self.current_hp = hp  # To track damage
         self.initiative = 0
+        self.state_version = 0  # Bumped whenever HP or effects change, see mark_changed()
+        self._roster = None  # CombatRoster indexing this character, if any
+        self._capabilities = None
+        self._capability_signature = None
+        self._spell_handlers = {}  # id(spell) -> spell_handlers.SpellHandler, see compile_spells()
+        self._situation = None  # (state_version, buckets, descriptor) cached by situation_descriptor()
 
 
         self.stats = {
@@ -376,12 +612,13 @@ class Character:
         self.unified_effects = {}  # Dictionary of effect_name -> UnifiedEffect
         # self.alive = True # checks that character is alive
         
-        self.str_mod = self.calculate_modifier("strength")
-        self.dex_mod = self.calculate_modifier("dexterity")
-        self.con_mod = self.calculate_modifier("constitution")
-        self.int_mod = self.calculate_modifier("intelligence")
-        self.wis_mod = self.calculate_modifier("wisdom")
-        self.cha_mod = self.calculate_modifier("charisma")
+        # Same as calculate_modifier() for each ability, without its dispatch (loaders build thousands)
+        self.str_mod = (strength - 10) // 2
+        self.dex_mod = (dexterity - 10) // 2
+        self.con_mod = (constitution - 10) // 2
+        self.int_mod = (intelligence - 10) // 2
+        self.wis_mod = (wisdom - 10) // 2
+        self.cha_mod = (charisma - 10) // 2
 
 
 
@@ -397,13 +634,39 @@ class Character:
         # Set the proficiency bonus based on character level
 
 
-    def is_within_melee_range(self, target):
-        """Placeholder: Assume all melee attacks are in range for now."""
-        return True
-
-    def is_within_ranged_range(self, target):
-        """Placeholder: Assume all ranged attacks are in range for now."""
-        return True
+    def distance_to(self, other):
+        """Grid distance in feet to another character, or None if either is off the battle map."""
+        if self.position is None or other.position is None:
+            return None
+        return grid_distance(self.position, other.position)
+
+    def is_within_melee_range(self, target, reach=MELEE_REACH):
+        """True if the target is within reach (characters off the battle map are always in range)."""
+        distance = self.distance_to(target)
+        return distance is None or distance <= reach
+
+    def is_within_ranged_range(self, target, weapon=None):
+        """True if the target is within the long range of a ranged weapon (default 320 ft)."""
+        return self.is_in_range(target, weapon)
+
+    def is_adjacent(self, other):
+        """True if the other character stands in one of the eight squares around this one."""
+        return self.is_within_melee_range(other)
+
+    def is_in_range(self, other, weapon=None):
+        """True if the weapon (a ranged one by default) can reach between this character and the other."""
+        distance = self.distance_to(other)
+        return distance is None or distance <= weapon_reach(weapon or {"type": "ranged"})
+
+    def move_to(self, position):
+        """Place the character on a grid square (None takes it off the map), keeping the engine's spatial hash current."""
+        self.position = as_position(position)
+        if self._grid is not None:
+            if self.position is None:
+                self._grid.remove(self)
+            else:
+                self._grid.move(self, self.position)
+        self.mark_changed()  # Reach, sight and cover to and from the character may have changed
     
     def apply_condition_with_effects(self, condition_name, duration, spell=None):
         """
@@ -483,6 +746,72 @@ class Character:
                     combat_engine.check_condition_removal(self)
                     break
 
+    @property
+    def capabilities(self):
+        """
+        The character's CapabilityIndex. Rebuilt when the spell list or inventory is replaced
+        or changes length; call invalidate_capabilities() after editing an entry in place.
+        """
+        signature = (id(self.spells), len(self.spells or ()), id(self.inventory), len(self.inventory or ()))
+        if self._capabilities is None or signature != self._capability_signature:
+            self._capabilities = CapabilityIndex(self.spells, self.inventory)
+            self._capability_signature = signature
+        return self._capabilities
+
+    def invalidate_capabilities(self):
+        self._capabilities = None
+
+    def compile_spells(self, handlers=None):
+        """
+        Compile every spell to its handler (see spell_handlers.py) now, so a malformed one
+        fails at load time rather than mid-combat. Call again after editing a spell in place.
+        A loader that already compiled the spells passes their handlers, in spell list order.
+        """
+        from spell_handlers import SpellDefinitionError, compile_spell
+        if handlers is not None:
+            self._spell_handlers = {id(handler.spell): handler for handler in handlers}
+            return
+        try:
+            self._spell_handlers = {id(spell): compile_spell(spell) for spell in self.spells or ()}
+        except SpellDefinitionError as error:
+            raise SpellDefinitionError(f"{self.name}: {error}") from None
+
+    def spell_handler(self, spell):
+        """The compiled handler of a spell, compiling it on first use if it was not compiled at load."""
+        handler = self._spell_handlers.get(id(spell))
+        if handler is None or handler.spell is not spell:
+            from spell_handlers import compile_spell
+            handler = self._spell_handlers[id(spell)] = compile_spell(spell)
+        return handler
+
+    def clone(self):
+        """
+        Another creature just like this one, for spawning from a monster template: spells,
+        inventory and compiled spell handlers are shared with the original, while HP, stats,
+        conditions and position are the clone's own. Clone characters that are not in combat.
+        """
+        clone = object.__new__(type(self))
+        clone.__dict__.update(self.__dict__)
+        clone.stats = dict(self.stats)
+        clone.conditions = {name: dict(data) for name, data in self.conditions.items()}
+        clone.unified_effects = {}
+        clone._grid = None
+        clone._roster = None
+        clone._situation = None
+        clone.state_version = 0
+        return clone
+
+    def mark_changed(self):
+        """Record that HP or effects changed so the roster's triage queues re-rank this character."""
+        self.state_version += 1
+        if self._roster is not None:
+            self._roster.character_changed(self)
+
+    def count_effects(self, harmful):
+        """Count active harmful (conditions, debuffs) or beneficial unified effects."""
+        return sum(1 for effect in self.unified_effects.values()
+                   if effect.active and (effect.effect_type in HARMFUL_EFFECT_TYPES) == harmful)
+
     def remove_condition(self, condition_name):
         """Removes the specified condition from the character and reverses its effects if the condition is active."""
         # Check if the condition exists in the unified effects system
@@ -492,6 +821,7 @@ class Character:
                 log_message(f"Removing {condition_name} from {self.name} and reversing its effects.")
                 effect.remove(self)
                 del self.unified_effects[condition_name]
+                self.mark_changed()
                 log_message(f"{condition_name} has been removed from {self.name} and its effects reversed.")
             else:
                 log_message(f"{condition_name} is not active on {self.name}, skipping removal.")
@@ -535,13 +865,14 @@ class Character:
         
         self.unified_effects[effect_name] = effect
         effect.apply(self)
+        self.mark_changed()
         log_message(f"{effect_name} applied to {self.name}.")
         
-    def apply_effect(self, effect_name, attribute, modifier, duration):
+    def apply_effect(self, effect_name, attribute, modifier, duration, effect_type="spell_effect"):
         """Legacy method for backward compatibility."""
         self.apply_unified_effect(
             effect_name=effect_name,
-            effect_type="spell_effect",
+            effect_type=effect_type,
             source="spell",
             duration_type=EffectDuration.FIXED,
             duration_value=duration,
@@ -564,6 +895,8 @@ class Character:
             effect.remove(self)
             del self.unified_effects[effect_name]
             log_message(f"Removed expired effect {effect_name} from {self.name}.")
+        if expired_effects:
+            self.mark_changed()
             
     def process_effects_by_timing(self, timing):
         """Process effects based on their timing (start of turn, end of turn, etc.)."""
@@ -585,6 +918,86 @@ class Character:
         """Check if character has a specific active effect."""
         return effect_name in self.unified_effects and self.unified_effects[effect_name].active
 
+    def to_dict(self):
+        """
+        Serialize the character, including its in-combat state, so it can be rebuilt with
+        character_from_dict. Ability scores are saved as their current (effect-modified) values.
+        The inventory and spell lists are copies; the items and spells in them are shared, read-only.
+        """
+        return {
+            "kind": "character",
+            "name": self.name,
+            "description": self.description,
+            "hp": self.hp,
+            "ac": self.ac,
+            "strength": self.strength,
+            "dexterity": self.dexterity,
+            "constitution": self.constitution,
+            "intelligence": self.intelligence,
+            "wisdom": self.wisdom,
+            "charisma": self.charisma,
+            "damage": self.damage,
+            "inventory": list(self.inventory),
+            "class_type": self.class_type,
+            "spells": list(self.spells) if self.spells is not None else None,
+            "speed": self.default_movement,
+            "position": list(self.position) if self.position is not None else None,
+            "conditions": {name: dict(info) if isinstance(info, dict) else info for name, info in self.conditions.items()},
+            "state": {
+                "attributes": {attribute: getattr(self, attribute) for attribute in self.SNAPSHOT_ATTRIBUTES
+                               if hasattr(self, attribute)},
+                "unified_effects": [effect.to_dict() for effect in self.unified_effects.values()],
+            },
+        }
+
+    def load_state(self, state):
+        """Apply the in-combat state saved by to_dict on top of a freshly constructed character."""
+        for attribute, value in state.get("attributes", {}).items():
+            setattr(self, attribute, value)
+        self.position = as_position(self.position)
+        self.unified_effects = {}
+        for effect_data in state.get("unified_effects", []):
+            effect = UnifiedEffect.from_dict(effect_data)
+            self.unified_effects[effect.name] = effect
+        self.mark_changed()
+
+    def capture_state(self, previous=None):
+        """
+        Capture the character's mutable combat state as an immutable record.
+        Effect objects are referenced rather than copied; only their mutable fields are recorded.
+        If the state equals the `previous` record, that record is returned so unchanged
+        characters share their state between snapshots.
+        """
+        record = (
+            tuple(getattr(self, attribute, _MISSING) for attribute in self.SNAPSHOT_ATTRIBUTES),
+            tuple((name, effect, effect.active, effect.current_duration, tuple(effect.applied_modifiers.items()))
+                  for name, effect in self.unified_effects.items()),
+            tuple((name, tuple(info.items()) if isinstance(info, dict) else info)
+                  for name, info in self.conditions.items()),
+        )
+        if previous is not None and previous == record:
+            return previous
+        return record
+
+    def restore_state(self, record):
+        """Restore the mutable combat state captured by capture_state."""
+        values, effects, conditions = record
+        for attribute, value in zip(self.SNAPSHOT_ATTRIBUTES, values):
+            if value is _MISSING:
+                self.__dict__.pop(attribute, None)
+            else:
+                setattr(self, attribute, value)
+
+        self.unified_effects = {}
+        for name, effect, active, current_duration, applied_modifiers in effects:
+            effect.active = active
+            effect.current_duration = current_duration
+            effect.applied_modifiers = dict(applied_modifiers)
+            self.unified_effects[name] = effect
+
+        self.conditions = {name: dict(info) if isinstance(info, tuple) else info for name, info in conditions}
+        self.mark_changed()
+
 
     
     def get_modifier(self, attribute):
@@ -631,6 +1044,22 @@ class Character:
         self.current_hp -= amount
         if self.hp < 0:
             self.hp = 0
+        self.mark_changed()
+
+    def heal(self, amount):
+        """Restores HP up to the character's maximum."""
+        self.current_hp = min(self.current_hp + amount, self.hp)
+        self.mark_changed()
+
+    def take_save_damage(self, save, dc, damage):
+        """Saving throw against damage: half on a success, full on a failure. Returns True if the save failed."""
+        if self.saving_throw(self, save, dc):
+            log_message(f"{self.name} succeeds on saving throw, taking half damage: {damage // 2}.")
+            self.take_damage(damage // 2)
+            return False
+        log_message(f"{self.name} fails saving throw, taking full damage: {damage}.")
+        self.take_damage(damage)
+        return True
     
     def is_alive(self):
         """Checks if the character is still alive (HP greater than 0)."""
@@ -663,19 +1092,46 @@ class Character:
         """Checks if the character is proficient in a specific saving throw (e.g., 'strength', 'dexterity')."""
         return save in self.proficient_saves  # Assuming `proficient_saves` is a list of save types the character is proficient in
     
-    def saving_throw(self, target, save, dc, effect = None, adv_disadv="normal"):
+    def save_bonus(self, save):
+        """Saving throw modifier: the ability modifier (e.g. dex_mod), plus proficiency if the class grants it."""
+        attribute = SAVE_MODIFIERS.get(save)
+        modifier = getattr(self, attribute) if attribute else 0
+        if save in self.proficient_saves:
+            modifier += self.proficiency_bonus
+        return modifier
+
+    def save_advantage(self):
+        """Advantage state of this character's saving throws, from its active conditions' self_effects."""
+        states = {CONDITIONS_DICT[name].get("self_effects", {}).get("saving_throw")
+                  for name, effect in self.unified_effects.items() if effect.active and name in CONDITIONS_DICT}
+        advantage, disadvantage = "advantage" in states, "disadvantage" in states
+        if advantage == disadvantage:
+            return "normal"
+        return "advantage" if advantage else "disadvantage"
+
+    def remove_condition_on_save(self, condition_name):
+        """A successful saving throw against a condition removes any instance of it the character already has."""
+        log_message(f"[bold yellow]{self.name} successfully removes {condition_name}.[/bold yellow]")
+        # Remove from unified_effects if present
+        if condition_name in self.unified_effects:
+            effect = self.unified_effects[condition_name]
+            effect.remove(self)
+            del self.unified_effects[condition_name]
+            self.mark_changed()
+            log_message(f"{condition_name} has been removed from {self.name} (unified effects).")
+        # For backward compatibility, also update old conditions dict if present
+        if condition_name in self.conditions:
+            self.conditions[condition_name]["active"] = False
+
+    def saving_throw(self, target, save, dc, effect = None, adv_disadv=None):
         """
         Handles the saving throw for a target, applying proficiency if applicable.
         If a condition is provided, it attempts to remove that condition if the saving throw succeeds.
+        Rolls with the target's own save_advantage() unless adv_disadv is given.
         """
         condition_name = effect
-        # Get the appropriate ability modifier (e.g., str_mod, dex_mod)
-        modifier = getattr(target, f"{save}_mod", 0)
-
-        # Add proficiency bonus if the target's class grants proficiency in this save
-        if save in target.proficient_saves:
-            modifier += target.proficiency_bonus
-            # log_message(f"DEBUG 358: profficiency bonus -> {target.proficiency_bonus}.")
+        modifier = target.save_bonus(save)
+        adv_disadv = adv_disadv or target.save_advantage()
 
         # Roll the saving throw with advantage/disadvantage if applicable
         save_roll = roll_with_advantage_disadvantage(modifier, adv_disadv)
@@ -687,16 +1143,7 @@ class Character:
 
             # If the saving throw is linked to a condition, remove the condition
             if condition_name:
-                log_message(f"[bold yellow]{target.name} successfully removes {condition_name}.[/bold yellow]")
-                # Remove from unified_effects if present
-                if condition_name in target.unified_effects:
-                    effect = target.unified_effects[condition_name]
-                    effect.remove(target)
-                    del target.unified_effects[condition_name]
-                    log_message(f"{condition_name} has been removed from {target.name} (unified effects).")
-                # For backward compatibility, also update old conditions dict if present
-                if condition_name in target.conditions:
-                    target.conditions[condition_name]["active"] = False
+                target.remove_condition_on_save(condition_name)
 
             return True
         else:
@@ -709,19 +1156,32 @@ class PlayerCharacter(Character):
         self.spells = spells
         self.conditions = conditions or {}
 
+    def to_dict(self):
+        data = super().to_dict()
+        data["kind"] = "player"
+        return data
+
 class NonPlayerCharacter(Character):
-    def __init__(self, name, hp, ac, strength, dexterity, constitution, intelligence, wisdom, charisma, damage, inventory, class_type, spells=None, conditions=None, is_enemy=True, ai_type="aggressive", **kwargs):
+    def __init__(self, name, hp, ac, strength, dexterity, constitution, intelligence, wisdom, charisma, damage, inventory, class_type, spells=None, conditions=None, is_enemy=True, ai_type="aggressive", ai_config=None, **kwargs):
         super().__init__(name, hp, ac, strength, dexterity, constitution, intelligence, wisdom, charisma, damage, inventory, class_type, spells, conditions, **kwargs)
         self.is_enemy = is_enemy
-        self.ai_type = ai_type  # "aggressive", "healer", "support"
+        self.ai_type = ai_type  # "aggressive", "healer", "support", "tactical", "mcts", "llm"
+        self.ai_config = ai_config or {}  # Per-NPC AI tuning, e.g. {"iterations": 400} for an MCTS boss
+
+    def to_dict(self):
+        data = super().to_dict()
+        data["kind"] = "npc"
+        data["is_enemy"] = self.is_enemy
+        data["ai_type"] = self.ai_type
+        if self.ai_config:
+            data["ai_config"] = self.ai_config
+        return data
 
-    
-    def is_adjacent(self, action):
-        """For now, consider all characters adjacent."""
-        return True
     
     def get_allies(self, all_characters):
         """Get list of allies (other NPCs if enemy, or other players if friendly)."""
+        if isinstance(all_characters, CombatRoster):
+            return all_characters.allies_of(self)
         if self.is_enemy:
             return [char for char in all_characters if isinstance(char, NonPlayerCharacter) and char != self]
         else:
@@ -729,6 +1189,8 @@ class NonPlayerCharacter(Character):
     
     def get_enemies(self, all_characters):
         """Get list of enemies."""
+        if isinstance(all_characters, CombatRoster):
+            return all_characters.enemies_of(self)
         if self.is_enemy:
             return [char for char in all_characters if isinstance(char, PlayerCharacter)]
         else:
@@ -736,42 +1198,36 @@ class NonPlayerCharacter(Character):
     
     def has_healing_spells(self):
         """Check if this NPC has healing spells."""
-        if not self.spells:
-            return False
-        return any(spell.get('type') == 'healing' for spell in self.spells)
+        return 'healing' in self.capabilities.spells_by_type
     
     def has_condition_removal_spells(self):
         """Check if this NPC has condition removal spells."""
-        if not self.spells:
-            return False
-        return any(spell.get('effect', {}).get('attribute') == 'condition_removal' for spell in self.spells)
+        return bool(self.capabilities.removal_spells)
     
     def has_buff_spells(self):
         """Check if this NPC has buff spells."""
-        if not self.spells:
-            return False
-        return any(spell.get('type') == 'buff' for spell in self.spells)
+        return 'buff' in self.capabilities.spells_by_type
     
+    def _best_ally(self, allies, queue, limit):
+        """The ally ranked first by a triage queue, if its priority is below limit."""
+        if isinstance(allies, FactionView) and allies.roster is not None:
+            return allies.roster.best(allies.faction, queue, exclude=self, limit=limit)
+        # Plain character lists (tests, legacy callers): same ranking by a linear scan
+        key = TRIAGE_KEYS[queue]
+        candidates = [ally for ally in allies if ally.is_alive() and key(ally) < limit]
+        return min(candidates, key=key) if candidates else None
+
     def find_ally_needing_healing(self, allies):
-        """Find an ally that needs healing (below 50% HP)."""
-        for ally in allies:
-            if ally.is_alive() and ally.current_hp < (ally.hp * 0.5):
-                return ally
-        return None
+        """Find the most wounded ally below 50% HP."""
+        return self._best_ally(allies, "wounded", 0.5)
     
     def find_ally_with_conditions(self, allies):
-        """Find an ally with active conditions that can be removed."""
-        for ally in allies:
-            if ally.is_alive() and ally.unified_effects:
-                return ally
-        return None
+        """Find the ally suffering the most conditions and debuffs."""
+        return self._best_ally(allies, "afflicted", 0)
     
     def find_ally_needing_buffs(self, allies):
-        """Find an ally that could benefit from buffs."""
-        for ally in allies:
-            if ally.is_alive() and not ally.unified_effects:
-                return ally
-        return None
+        """Find an ally without any active buffs."""
+        return self._best_ally(allies, "unbuffed", 1)
             
     def decide_action(self, action, all_characters=None):
         """Enhanced AI to decide what action to take based on AI type and conditions."""
@@ -783,6 +1239,83 @@ class NonPlayerCharacter(Character):
             log_message(f"{self.name} is stunned/incapacitated and cannot act this turn.")
             return None
         
+        # Abstract situations ignore the battle map, so positioned NPCs always decide afresh
+        if DECISION_CACHE is not None and self.ai_type in DECISION_CACHE_AI_TYPES and self.position is None:
+            action = self._cached_decision(all_characters)
+        else:
+            action = self._decide_by_ai_type(all_characters)
+        if action is None and self.position is not None:
+            return self._approach_action(all_characters)
+        return action
+    
+    def _approach_action(self, all_characters):
+        """With nothing in reach, move towards the nearest enemy on the battle map."""
+        engine = getattr(all_characters, "engine", None)
+        target = engine.nearest_enemy(self) if engine is not None else None
+        if target is None or self.is_adjacent(target):
+            return None
+        log_message(f"{self.name} closes in on {target.name}.")
+        # "approach" moves by the engine's shared flow field rather than a path of its own
+        return {"type": "move", "to": target.position, "approach": True}
+    
+    def abstract_situation(self, all_characters, buckets):
+        """
+        The decision cache key for this NPC's situation - its name, what it can do, and the
+        class, bucketed HP and effect bitmask of every living member of both sides - with
+        each side's members in key order, for action templates.
+        """
+        if isinstance(all_characters, CombatRoster):
+            own = faction_of(self)
+            side_key, side = all_characters.situation(own, buckets)
+            other_key, others = all_characters.situation(PARTY if own == HOSTILE else HOSTILE, buckets)
+        else:
+            side_key, side = rank_situation([self, *self.get_allies(all_characters)], buckets)
+            other_key, others = rank_situation(self.get_enemies(all_characters), buckets)
+        key = (self.name, self.ai_type, self.capabilities.profile, situation_descriptor(self, buckets),
+               side_key, other_key)
+        return key, side, others
+    
+    def _cached_decision(self, all_characters):
+        """Reuse the decision made in an equivalent situation, or decide and remember it."""
+        key, side, others = self.abstract_situation(all_characters, DECISION_HP_BUCKETS)
+        template = DECISION_CACHE.get(key)
+        if template is not None:
+            action = self._action_from_template(template, side, others)
+            log_message(f"{self.name} ({self.ai_type.title()}) repeats its decision for this situation.", debug_only=True)
+            return action
+        action = self._decide_by_ai_type(all_characters)
+        template = self._action_template(action, side, others)
+        if template is not None:
+            DECISION_CACHE.put(key, template)
+        return action
+    
+    def _action_template(self, action, side, others):
+        """An action with targets as (group, index) slots of the abstract situation; None if not expressible."""
+        if action is None:
+            return ("pass",)
+        slots = {id(ally): ("side", index) for index, ally in enumerate(side)}
+        slots.update((id(enemy), ("others", index)) for index, enemy in enumerate(others))
+        slots[id(self)] = ("self", 0)
+        target = action.get("target")
+        targets = target if isinstance(target, list) else [target]
+        refs = tuple(slots.get(id(t)) for t in targets)
+        if None in refs:
+            return None
+        item = action["weapon"] if action["type"] == "attack" else action["spell"]
+        return (action["type"], item.get("name"), refs, isinstance(target, list))
+    
+    def _action_from_template(self, template, side, others):
+        if template[0] == "pass":
+            return None
+        action_type, item_name, refs, as_list = template
+        groups = {"self": [self], "side": side, "others": others}
+        targets = [groups[group][index] for group, index in refs]
+        if action_type == "attack":
+            return {"type": "attack", "target": targets[0], "weapon": self.capabilities.weapons_by_name[item_name]}
+        return {"type": action_type, "spell": self.capabilities.spells_by_name[item_name],
+                "target": targets if as_list else targets[0]}
+    
+    def _decide_by_ai_type(self, all_characters):
         # Healer AI logic
         if self.ai_type == "healer":
             return self._healer_ai_logic(all_characters)
@@ -791,6 +1324,21 @@ class NonPlayerCharacter(Character):
         elif self.ai_type == "support":
             return self._support_ai_logic(all_characters)
         
+        # Expected-value AI scoring every legal action
+        elif self.ai_type == "tactical":
+            from tactical_ai import decide_tactical_action
+            return decide_tactical_action(self, all_characters)
+        
+        # Monte Carlo tree search over simulated turns
+        elif self.ai_type == "mcts":
+            from mcts_ai import decide_mcts_action
+            return decide_mcts_action(self, all_characters)
+        
+        # Language model picking from the legal options, batched and cached
+        elif self.ai_type == "llm":
+            from llm_npc import decide_llm_action
+            return decide_llm_action(self, all_characters)
+        
         # Default aggressive AI logic
         else:
             return self._aggressive_ai_logic(all_characters)
@@ -803,7 +1351,7 @@ class NonPlayerCharacter(Character):
         if self.has_healing_spells():
             wounded_ally = self.find_ally_needing_healing(allies)
             if wounded_ally:
-                healing_spell = next(spell for spell in self.spells if spell.get('type') == 'healing')
+                healing_spell = self.capabilities.first_spell('healing')
                 log_message(f"{self.name} (Healer) decides to heal {wounded_ally.name}.")
                 return {"type": "cast_spell", "spell": healing_spell, "target": [wounded_ally]}
         
@@ -811,8 +1359,7 @@ class NonPlayerCharacter(Character):
         if self.has_condition_removal_spells():
             conditioned_ally = self.find_ally_with_conditions(allies)
             if conditioned_ally:
-                removal_spell = next(spell for spell in self.spells 
-                                  if spell.get('effect', {}).get('attribute') == 'condition_removal')
+                removal_spell = self.capabilities.removal_spells[0]
                 log_message(f"{self.name} (Healer) decides to remove conditions from {conditioned_ally.name}.")
                 return {"type": "cast_spell", "spell": removal_spell, "target": [conditioned_ally]}
         
@@ -820,7 +1367,7 @@ class NonPlayerCharacter(Character):
         if self.has_buff_spells():
             unbuffed_ally = self.find_ally_needing_buffs(allies)
             if unbuffed_ally:
-                buff_spell = next(spell for spell in self.spells if spell.get('type') == 'buff')
+                buff_spell = self.capabilities.first_spell('buff')
                 log_message(f"{self.name} (Healer) decides to buff {unbuffed_ally.name}.")
                 return {"type": "cast_spell", "spell": buff_spell, "target": [unbuffed_ally]}
         
@@ -835,8 +1382,7 @@ class NonPlayerCharacter(Character):
         if self.has_condition_removal_spells():
             conditioned_ally = self.find_ally_with_conditions(allies)
             if conditioned_ally:
-                removal_spell = next(spell for spell in self.spells 
-                                  if spell.get('effect', {}).get('attribute') == 'condition_removal')
+                removal_spell = self.capabilities.removal_spells[0]
                 log_message(f"{self.name} (Support) decides to remove conditions from {conditioned_ally.name}.")
                 return {"type": "cast_spell", "spell": removal_spell, "target": [conditioned_ally]}
         
@@ -844,7 +1390,7 @@ class NonPlayerCharacter(Character):
         if self.has_buff_spells():
             unbuffed_ally = self.find_ally_needing_buffs(allies)
             if unbuffed_ally:
-                buff_spell = next(spell for spell in self.spells if spell.get('type') == 'buff')
+                buff_spell = self.capabilities.first_spell('buff')
                 log_message(f"{self.name} (Support) decides to buff {unbuffed_ally.name}.")
                 return {"type": "cast_spell", "spell": buff_spell, "target": [unbuffed_ally]}
         
@@ -852,7 +1398,7 @@ class NonPlayerCharacter(Character):
         if self.has_healing_spells():
             wounded_ally = self.find_ally_needing_healing(allies)
             if wounded_ally:
-                healing_spell = next(spell for spell in self.spells if spell.get('type') == 'healing')
+                healing_spell = self.capabilities.first_spell('healing')
                 log_message(f"{self.name} (Support) decides to heal {wounded_ally.name}.")
                 return {"type": "cast_spell", "spell": healing_spell, "target": [wounded_ally]}
         
@@ -862,14 +1408,32 @@ class NonPlayerCharacter(Character):
     def _aggressive_ai_logic(self, all_characters):
         """Default aggressive AI logic."""
         enemies = self.get_enemies(all_characters)
-        alive_enemies = [enemy for enemy in enemies if enemy.is_alive()]
-        
-        if not alive_enemies:
-            return None
         
         # Choose weakest enemy
-        target = min(alive_enemies, key=lambda e: e.current_hp)
-        chosen_weapon = self.inventory[0] if self.inventory else None
+        if isinstance(enemies, FactionView) and enemies.roster is not None:
+            target = enemies.roster.best(enemies.faction, "weakest")
+        else:
+            alive_enemies = [enemy for enemy in enemies if enemy.is_alive()]
+            target = min(alive_enemies, key=lambda e: e.current_hp) if alive_enemies else None
+        
+        # Hit hardest with what we have; foci and other items without damage dice are never picked
+        chosen_weapon = self.capabilities.best_weapon
+        engine = getattr(all_characters, "engine", None)
+        if target is not None and chosen_weapon:
+            if engine is not None:
+                reachable = engine.can_target(self, target, chosen_weapon)
+            else:
+                reachable = self.is_in_range(target, chosen_weapon)
+            if not reachable:
+                # The weakest enemy is out of reach or sight on the battle map: settle for the weakest one in reach
+                if engine is not None:
+                    in_reach = engine.enemies_in_reach(self, chosen_weapon)
+                else:
+                    in_reach = [enemy for enemy in enemies if enemy.is_alive() and self.is_in_range(enemy, chosen_weapon)]
+                target = min(in_reach, key=lambda e: e.current_hp) if in_reach else None
+        
+        if target is None:
+            return None
         
         if chosen_weapon:
             log_message(f"{self.name} (Aggressive) decides to attack {target.name}.")
@@ -880,15 +1444,582 @@ class NonPlayerCharacter(Character):
     
 # Legacy Effect class removed - replaced by UnifiedEffect
 
+PARTY = "party"  # Players and friendly NPCs
+HOSTILE = "hostile"  # NPCs with is_enemy set
+
+def faction_of(character):
+    """Returns the faction a character fights for, honouring NonPlayerCharacter.is_enemy."""
+    return HOSTILE if getattr(character, "is_enemy", False) else PARTY
+
+class FactionView(Sequence):
+    """Read-only view over a faction's members, optionally hiding one character (the viewer)."""
+    __slots__ = ("_members", "_exclude", "_excluded_present", "roster", "faction")
+
+    def __init__(self, members, exclude=None, excluded_present=False, roster=None, faction=None):
+        self._members = members
+        self._exclude = exclude
+        self._excluded_present = excluded_present
+        self.roster = roster  # Owning CombatRoster, for priority queries
+        self.faction = faction
+
+    def __iter__(self):
+        exclude = self._exclude
+        for member in self._members:
+            if member is not exclude:
+                yield member
+
+    def __len__(self):
+        return len(self._members) - (1 if self._excluded_present else 0)
+
+    def __getitem__(self, index):
+        if not self._excluded_present:
+            return self._members[index]
+        return list(self)[index]
+
+
+def _hp_fraction(character):
+    return character.current_hp / character.hp if character.hp > 0 else 1.0
+
+# Priority keys of the roster's triage queues; the lowest key is served first
+TRIAGE_KEYS = {
+    "wounded": _hp_fraction,
+    "weakest": lambda character: character.current_hp,
+    "afflicted": lambda character: -character.count_effects(harmful=True),
+    "unbuffed": lambda character: character.count_effects(harmful=False),
+}
+
+
+class TriageQueue:
+    """
+    Lazily invalidated min-heap over one faction. Entries carry the character's state_version
+    when pushed; a character that changes is pushed again and its older entries are discarded
+    when they reach the top, so updates and queries both cost O(log n).
+    """
+
+    def __init__(self, key, members):
+        self.key = key
+        self.members = members
+        self.order = {id(character): index for index, character in enumerate(members)}
+        self.rebuild()
+
+    def rebuild(self):
+        self.heap = [(self.key(character), index, character.state_version, character)
+                     for index, character in enumerate(self.members)]
+        heapq.heapify(self.heap)
+
+    def push(self, character):
+        heapq.heappush(self.heap, (self.key(character), self.order[id(character)],
+                                   character.state_version, character))
+        if len(self.heap) > 4 * len(self.members) + 16:
+            self.rebuild()  # Too many stale entries have piled up below the top
+
+    def best(self, exclude=None, limit=None):
+        """The live character with the lowest key (ties go to roster order), skipping `exclude`."""
+        heap = self.heap
+        set_aside = None
+        result = None
+        while heap:
+            key, _, version, character = heap[0]
+            if version != character.state_version or not character.is_alive():
+                heapq.heappop(heap)
+            elif character is exclude:
+                set_aside = heapq.heappop(heap)
+            else:
+                if limit is None or key < limit:
+                    result = character
+                break
+        if set_aside is not None:
+            heapq.heappush(heap, set_aside)
+        return result
+
+
+class CombatRoster:
+    """
+    Faction indexes over an engine's players and NPCs. NPC AI receives the roster instead of
+    a freshly concatenated character list and gets read-only ally/enemy views from it.
+    Iterating the roster still yields every combatant, players first.
+    """
+
+    def __init__(self, players, npcs, engine=None):
+        self.players = players
+        self.npcs = npcs
+        self.engine = engine  # Owning CombatEngine, for AI that simulates ahead
+        self.factions = {PARTY: [], HOSTILE: []}
+        self._member_factions = {}  # id(character) -> faction
+        self._signature = None
+        self.queues = {}  # faction -> {queue name -> TriageQueue}, built on first query
+        self._situations = {}  # (faction, buckets) -> rank_situation result, for the decision cache
+
+    def __iter__(self):
+        yield from self.players
+        yield from self.npcs
+
+    def __len__(self):
+        return len(self.players) + len(self.npcs)
+
+    def invalidate(self):
+        """Force the indexes to be rebuilt, e.g. after a character changes sides."""
+        self._signature = None
+
+    def _refresh(self):
+        signature = (len(self.players), len(self.npcs))
+        if signature == self._signature:
+            return
+        self.factions = {PARTY: [], HOSTILE: []}
+        self._member_factions = {}
+        for character in self:
+            faction = faction_of(character)
+            self.factions[faction].append(character)
+            self._member_factions[id(character)] = faction
+            character._roster = self
+        self._signature = signature
+        self.queues = {}
+        self._situations = {}
+
+    def members(self, faction):
+        self._refresh()
+        return FactionView(self.factions[faction], roster=self, faction=faction)
+
+    def allies_of(self, character):
+        """Everyone on the character's side except the character itself."""
+        self._refresh()
+        faction = faction_of(character)
+        return FactionView(self.factions[faction], exclude=character,
+                           excluded_present=self._member_factions.get(id(character)) == faction,
+                           roster=self, faction=faction)
+
+    def enemies_of(self, character):
+        """Everyone on the opposing side."""
+        self._refresh()
+        opposing = PARTY if faction_of(character) == HOSTILE else HOSTILE
+        return FactionView(self.factions[opposing], roster=self, faction=opposing)
+
+    def character_changed(self, character):
+        """Called by Character.mark_changed: re-rank the character in its faction's queues."""
+        self._situations.clear()
+        faction = self._member_factions.get(id(character))
+        if faction is None or self._signature != (len(self.players), len(self.npcs)):
+            return  # Not indexed yet; queues are built from scratch on the next query
+        for queue in self.queues.get(faction, {}).values():
+            queue.push(character)
+
+    def best(self, faction, queue_name, exclude=None, limit=None):
+        """
+        The top living member of a faction's triage queue ("wounded", "weakest", "afflicted"
+        or "unbuffed", see TRIAGE_KEYS), or None if nobody ranks below limit.
+        """
+        self._refresh()
+        queues = self.queues.setdefault(faction, {})
+        queue = queues.get(queue_name)
+        if queue is None:
+            queue = queues[queue_name] = TriageQueue(TRIAGE_KEYS[queue_name], self.factions[faction])
+        return queue.best(exclude=exclude, limit=limit)
+
+    def situation(self, faction, buckets):
+        """A faction's living members ranked by situation descriptor (see rank_situation), cached until one changes."""
+        self._refresh()
+        entry = self._situations.get((faction, buckets))
+        if entry is None:
+            entry = self._situations[(faction, buckets)] = rank_situation(self.factions[faction], buckets)
+        return entry
+
+
+class CombatSnapshot:
+    """
+    A checkpoint of everything that changes during combat, taken by CombatEngine.snapshot().
+    Character records are shared with the previous snapshot when a character has not changed.
+    """
+    __slots__ = ("players", "npcs", "characters", "initiative_order", "turn_index",
+                 "round_number", "combat_ended", "rng_state")
+
+    def __init__(self, players, npcs, characters, initiative_order, turn_index, round_number, combat_ended, rng_state):
+        self.players = players
+        self.npcs = npcs
+        self.characters = characters  # Tuple of (character, state record)
+        self.initiative_order = initiative_order
+        self.turn_index = turn_index
+        self.round_number = round_number
+        self.combat_ended = combat_ended
+        self.rng_state = rng_state
+
+
 # Combat Engine Class
 class CombatEngine:
-    def __init__(self, players, npcs, debug_mode=DEBUG_MODE):
+    def __init__(self, players, npcs, debug_mode=DEBUG_MODE, battle_map=None):
         self.players = players
         self.npcs = npcs
         self.initiative_order = []
         self.round_number = 0
         self.debug_mode = debug_mode
         self.max_rounds = None  # For testing - limit combat rounds
+        self.turn_index = 0  # Initiative cursor: index of the next entry in initiative_order to act
+        self.combat_ended = False
+        self.event_listeners = []  # Callables receiving structured turn events (dicts)
+        self._last_snapshot = None  # Most recent snapshot, used for structural sharing
+        self.player_controller = None  # Optional callable(engine, player) -> action, replaces the input prompts
+        self.roster = CombatRoster(self.players, self.npcs, self)  # Faction indexes handed to NPC AI
+        self.grid = SpatialHash()  # Positioned combatants by grid square, see battle_grid.py
+        self.battle_map = battle_map  # Optional visibility.BattleMap: obstacles, line of sight and cover
+        self.path_cache = DecisionCache(max_entries=4096)  # find_path results, see pathfinding.py
+        self.flow_fields = {}  # Faction -> (map version, occupancy version, FlowField towards it)
+        self.sync_grid()
+
+    def snapshot(self):
+        """
+        Capture the engine's mutable state: every character's HP, ability scores, effects and
+        conditions, the initiative order and cursor, the round number and the dice RNG state.
+        Cheap enough to call every turn: static data is never copied and characters that did not
+        change since the last snapshot reuse its records.
+        """
+        previous = {}
+        if self._last_snapshot is not None:
+            previous = {id(character): record for character, record in self._last_snapshot.characters}
+        characters = tuple(
+            (character, character.capture_state(previous.get(id(character))))
+            for character in self.players + self.npcs
+        )
+        snapshot = CombatSnapshot(
+            players=tuple(self.players),
+            npcs=tuple(self.npcs),
+            characters=characters,
+            initiative_order=tuple(self.initiative_order),
+            turn_index=self.turn_index,
+            round_number=self.round_number,
+            combat_ended=self.combat_ended,
+            rng_state=random.getstate(),
+        )
+        self._last_snapshot = snapshot
+        return snapshot
+
+    def to_dict(self):
+        """
+        Serialize the whole in-progress combat: characters with their effects and legacy
+        conditions, initiative order and cursor, round number and dice RNG state.
+        """
+        combatants = self.players + self.npcs
+        index = {id(character): i for i, character in enumerate(combatants)}
+        version, internal_state, gauss_next = random.getstate()
+        return {
+            "format": 1,
+            "round_number": self.round_number,
+            "turn_index": self.turn_index,
+            "combat_ended": self.combat_ended,
+            "max_rounds": self.max_rounds,
+            "initiative_order": [index[id(character)] for character in self.initiative_order],
+            "rng_state": [version, list(internal_state), gauss_next],
+            "players": [player.to_dict() for player in self.players],
+            "npcs": [npc.to_dict() for npc in self.npcs],
+            "battle_map": self.battle_map.to_dict() if self.battle_map is not None else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data, restore_rng=True):
+        """Rebuild an engine saved with to_dict, ready to continue with run_combat()."""
+        players = [character_from_dict(pc) for pc in data["players"]]
+        npcs = [character_from_dict(npc) for npc in data["npcs"]]
+        battle_map = None
+        if data.get("battle_map"):
+            from visibility import BattleMap
+            battle_map = BattleMap.from_dict(data["battle_map"])
+        engine = cls(players, npcs, battle_map=battle_map)
+        combatants = players + npcs
+        engine.initiative_order = [combatants[i] for i in data["initiative_order"]]
+        engine.round_number = data["round_number"]
+        engine.turn_index = data["turn_index"]
+        engine.combat_ended = data.get("combat_ended", False)
+        engine.max_rounds = data.get("max_rounds")
+        if restore_rng and data.get("rng_state"):
+            version, internal_state, gauss_next = data["rng_state"]
+            random.setstate((version, tuple(internal_state), gauss_next))
+        return engine
+
+    def state_hash(self, include_rng=True):
+        """
+        A short digest of the combat state, used to detect divergence between a recorded
+        encounter and its replay. Characters are identified by name.
+        """
+        state = [self.round_number, self.turn_index, [c.name for c in self.initiative_order]]
+        for character in self.players + self.npcs:
+            values, effects, conditions = character.capture_state()
+            state.append((
+                character.name,
+                tuple(None if value is _MISSING else value for value in values),
+                tuple((name, active, duration, modifiers) for name, _, active, duration, modifiers in effects),
+                conditions,
+            ))
+        if include_rng:
+            state.append(random.getstate())
+        return hashlib.blake2b(repr(state).encode(), digest_size=16).hexdigest()
+
+    def restore(self, snapshot):
+        """Roll the engine back (or across, for what-if branches) to a snapshot taken on it."""
+        self.players[:] = snapshot.players
+        self.npcs[:] = snapshot.npcs
+        self.roster.invalidate()
+        for character, record in snapshot.characters:
+            character.restore_state(record)
+        self.initiative_order = list(snapshot.initiative_order)
+        self.turn_index = snapshot.turn_index
+        self.round_number = snapshot.round_number
+        self.combat_ended = snapshot.combat_ended
+        random.setstate(snapshot.rng_state)
+        self._last_snapshot = snapshot
+        self.sync_grid()
+        self.grid.touch()  # Restored HP may have raised the dead, who block movement again
+
+    def sync_grid(self):
+        """
+        Bring the spatial hash in line with the combatants' positions, e.g. after a restore or
+        after characters joined the fight. Only characters whose square changed are moved.
+        """
+        combatants = self.players + self.npcs
+        present = set(combatants)
+        for character in [item for item in self.grid.positions if item not in present]:
+            self.grid.remove(character)
+            character._grid = None
+        for character in combatants:
+            character._grid = self.grid
+            if character.position is None:
+                self.grid.remove(character)
+            else:
+                self.grid.move(character, character.position)
+
+    def characters_within(self, position, feet, predicate=None):
+        """Living combatants within `feet` of a grid square."""
+        return self.grid.within(position, feet, lambda c: c.is_alive() and (predicate is None or predicate(c)))
+
+    def nearest_enemy(self, character, max_feet=None):
+        """The closest living enemy on the battle map, or None (also when the character has no position)."""
+        if character.position is None:
+            return None
+        side = faction_of(character)
+        return self.grid.nearest(character.position,
+                                 lambda c: c.is_alive() and faction_of(c) != side, max_feet)
+
+    def enemies_in_reach(self, character, weapon):
+        """Living enemies the weapon can reach and the character can see; every enemy if it has no position."""
+        side = faction_of(character)
+        enemies = [c for c in self.roster if c.is_alive() and faction_of(c) != side
+                   and (character.position is None or c.position is None)]
+        if character.position is not None:
+            enemies += self.characters_within(character.position, weapon_reach(weapon),
+                                              lambda c: faction_of(c) != side and self.has_line_of_sight(character, c))
+        return enemies
+
+    def has_line_of_sight(self, viewer, target):
+        """True unless the battle map's walls stand between the two (always True off the map)."""
+        if self.battle_map is None or viewer.position is None or target.position is None:
+            return True
+        return self.battle_map.line_of_sight(viewer.position, target.position)
+
+    def cover_bonus(self, attacker, target):
+        """AC bonus the target gets from obstacles between it and the attacker: 0, 2 or 5 (0 without LOS)."""
+        if self.battle_map is None or attacker.position is None or target.position is None:
+            return 0
+        return self.battle_map.cover(attacker.position, target.position) or 0
+
+    def effective_ac(self, attacker, target):
+        """The target's AC against this attacker, cover included."""
+        return target.ac + self.cover_bonus(attacker, target)
+
+    def can_target(self, actor, target, weapon=None):
+        """True if the actor can see the target and the weapon (a ranged one by default) reaches it."""
+        return actor.is_in_range(target, weapon) and self.has_line_of_sight(actor, target)
+
+    def movement_cost(self, square):
+        """Feet it takes to enter a square: from the battle map's terrain, or 5 ft without a map."""
+        if self.battle_map is None:
+            return SQUARE_FEET
+        return self.battle_map.movement_cost(square)
+
+    def find_path(self, character, destination):
+        """
+        A* path for a character towards a grid square (next to it, if someone stands there),
+        around walls, through difficult terrain and allies but not enemies. Returns
+        (squares after the start, cost in feet, reached); cached until the map or anyone's
+        square changes.
+        """
+        start, goal = character.position, as_position(destination)
+        side = faction_of(character)
+        key = (self.battle_map.version if self.battle_map is not None else None, self.grid.version, side, start, goal)
+        result = self.path_cache.get(key)
+        if result is not None:
+            return result
+
+        occupants = self.grid.occupants
+
+        def step_cost(square):
+            cost = self.movement_cost(square)
+            if cost is not None:
+                for other in occupants.get(square, ()):
+                    if other is not character and other.is_alive() and faction_of(other) != side:
+                        return None
+            return cost
+
+        occupied_goal = any(other is not character and other.is_alive() for other in occupants.get(goal, ()))
+        result = find_path(start, goal, step_cost, goal_radius=1 if occupied_goal else 0)
+        self.path_cache.put(key, result)
+        return result
+
+    def move_character(self, character, destination):
+        """
+        Walk a character along its A* path towards a grid square for up to its movement in
+        feet (0 while grappled, restrained and so on), ending on a free square.
+        Returns the feet moved.
+        """
+        if character.position is None or destination is None:
+            return 0
+        path, _, _ = self.find_path(character, destination)
+        budget = max(character.movement, 0)
+        steps, spent = [], 0
+        for square in path:
+            spent += self.movement_cost(square)
+            if spent > budget:
+                break
+            steps.append((square, spent))
+        return self._walk(character, steps)
+
+    def _walk(self, character, steps):
+        """Move a character to the last free square of [(square, feet spent so far), ...]."""
+        # Allies can be passed through but not stood on
+        while steps and any(other is not character and other.is_alive() for other in self.grid.at(steps[-1][0])):
+            steps.pop()
+        if not steps:
+            return 0
+        square, spent = steps[-1]
+        character.move_to(square)
+        log_message(f"{character.name} moves {spent} ft to {square}.")
+        return spent
+
+    def flow_field(self, faction):
+        """
+        The shared FlowField leading to the squares next to the faction's living members, for
+        everyone coming after them. Brought up to date incrementally when anyone has moved or
+        fallen since it was last asked for; rebuilt when the map or the area it covers changes.
+        """
+        if self.battle_map is not None:
+            bounds = (0, 0, self.battle_map.width - 1, self.battle_map.height - 1)
+            map_version = self.battle_map.version
+        else:
+            # Open ground: the occupied area of the spatial hash and one cell around it
+            low_x, low_y, high_x, high_y = self.grid.bounds or (0, 0, 0, 0)
+            size = self.grid.cell_squares
+            bounds = ((low_x - 1) * size, (low_y - 1) * size, (high_x + 2) * size - 1, (high_y + 2) * size - 1)
+            map_version = None
+        entry = self.flow_fields.get(faction)
+        if entry is not None and entry[0] == (map_version, bounds) and entry[1] == self.grid.version:
+            return entry[2]
+        if entry is None or entry[0] != (map_version, bounds):
+            field = FlowField(self.movement_cost, bounds)
+        else:
+            field = entry[2]
+        occupied = {c.position for c in self.roster.members(faction) if c.is_alive() and c.position is not None}
+        goals = {(x + dx, y + dy) for x, y in occupied for dx in (-1, 0, 1) for dy in (-1, 0, 1)}
+        if occupied != field.blocked:
+            field.update(goals, occupied)
+        self.flow_fields[faction] = ((map_version, bounds), self.grid.version, field)
+        return field
+
+    def advance(self, character):
+        """
+        Move a character towards the nearest of its enemies by the shared flow field, for up
+        to its movement. Every creature of a side shares one field, so a horde moving costs
+        about as much as a single path search. Returns the feet moved.
+        """
+        if character.position is None:
+            return 0
+        field = self.flow_field(PARTY if faction_of(character) == HOSTILE else HOSTILE)
+        return self._walk(character, field.walk(character.position, max(character.movement, 0)))
+
+    def area_targets(self, actor, spell, origin, facing=None):
+        """
+        Living creatures inside a spell's template placed on `origin` (facing is an
+        area_templates.orientation index). Only the hash cells under the template are visited.
+        """
+        area = area_of(spell)
+        directional = area["shape"] != "sphere" and not (area["shape"] == "cube" and area["origin"] == "point")
+        mask = area_mask(area["shape"], area["size"], facing if directional else None)
+        origin_x, origin_y = origin
+        side = faction_of(actor)
+
+        def caught(character):
+            if character is actor and area["origin"] == "self":
+                return False
+            if not area["friendly_fire"] and faction_of(character) == side:
+                return False
+            return (character.position[0] - origin_x, character.position[1] - origin_y) in mask
+
+        return self.characters_within(origin, mask.extent, caught)
+
+    def place_area(self, actor, spell, aim_at=None):
+        """
+        Pick where to put an area spell: the origin square and facing that catch the most
+        creatures it is meant for (enemies, or allies for healing and buffs) minus the others.
+        Aims at the creatures in `aim_at`, or at every suitable creature in reach.
+        Returns {"origin": (x, y), "facing": index or None}, or None if no placement is worth it.
+        """
+        if actor.position is None:
+            return None
+        area = area_of(spell)
+        side = faction_of(actor)
+        beneficial = spell.get("type") in ("healing", "buff")
+        wanted = (lambda c: faction_of(c) == side) if beneficial else (lambda c: faction_of(c) != side)
+        spell_range = spell.get("range", DEFAULT_SPELL_RANGE)
+        if aim_at is None:
+            reach = area_mask(area["shape"], area["size"], 0 if area["shape"] in ("cone", "line") else None).extent
+            if area["origin"] == "point":
+                reach += spell_range
+            aim_at = self.characters_within(actor.position, reach, wanted)
+
+        placements = {}
+        for target in aim_at:
+            if target.position is None or not target.is_alive():
+                continue
+            if area["origin"] == "point":
+                if grid_distance(actor.position, target.position) <= spell_range and self.has_line_of_sight(actor, target):
+                    placements.setdefault((target.position, None))
+            elif area["shape"] == "sphere":
+                placements.setdefault((actor.position, None))
+            else:
+                direction = (target.position[0] - actor.position[0], target.position[1] - actor.position[1])
+                placements.setdefault((actor.position, orientation(direction)))
+
+        best, best_score = None, 0
+        for origin, facing in placements:
+            score = sum(1 if wanted(c) else -1 for c in self.area_targets(actor, spell, origin, facing))
+            if score > best_score:
+                best, best_score = {"origin": origin, "facing": facing}, score
+        return best
+
+    def aoe_targets(self, actor, spell, targets_list=None, area=None):
+        """
+        The creatures an area spell affects. On the battle map that is everyone inside its
+        template (placed by place_area if no placement is given); off the map it is the
+        given targets, or all of the caster's enemies.
+        """
+        if actor.position is None:
+            if targets_list is None:
+                targets_list = list(self.roster.enemies_of(actor))
+            log_message(f"{spell['name']} is an area-of-effect spell targeting all enemies.")
+            return [t for t in targets_list if t.is_alive()]
+        if area is None:
+            area = self.place_area(actor, spell, targets_list)
+            if area is None:
+                log_message(f"{actor.name} finds no one worth catching in {spell['name']}.")
+                return []
+        shape = area_of(spell)
+        targets = self.area_targets(actor, spell, area["origin"], area.get("facing"))
+        log_message(f"{spell['name']} ({shape['size']} ft {shape['shape']}) centred on {area['origin']} "
+                    f"catches {len(targets)} creatures.")
+        return targets
+
+    def emit_event(self, event_type, **data):
+        """Send a structured turn event to every registered listener."""
+        if not self.event_listeners:
+            return
+        event = {"event": event_type, **data}
+        for listener in self.event_listeners:
+            listener(event)
 
     def determine_initiative(self):
         all_characters = self.players + self.npcs
@@ -899,34 +2030,88 @@ class CombatEngine:
         # log_message(f"\n--- Initiative Order - - -\n {initiative_list()}")
 
     def start_combat(self):
-        log_message(f"\n[bold cyan]--- Combat Begins --- [/bold cyan]")
-        self.determine_initiative()
-        while not self.is_combat_over():
-            self.round_number += 1
-            log_message(f"[bold yellow]--- Round {self.round_number}: Start!---[/bold yellow]")
-            for character in self.initiative_order:
-                if character.is_alive():
-                    self.take_turn(character)
-            self.end_round()
-            
-            # Check if we've reached max rounds (for testing)
-            if self.max_rounds and self.round_number >= self.max_rounds:
-                log_message(f"[bold cyan]--- Combat ended after {self.round_number} rounds (test limit). ---[/bold cyan]")
+        self.begin_combat()
+        self.run_combat()
+
+    def run_combat(self):
+        """Plays turns from the current initiative position until combat is over."""
+        while True:
+            character = self.next_turn()
+            if character is None:
                 break
+            self.take_turn(character)
 
         # End of combat message
         log_message(f"\n[bold cyan]--- Combat has ended after {self.round_number} rounds. ---[/bold cyan]")
         console.print("[bold magenta]Thank you for playing! Exiting combat engine...[/bold magenta]")
 
-    def take_turn(self, character):
-        """Handles the turn logic for a character."""
+    def begin_combat(self):
+        """Rolls initiative and opens round one without taking any turns."""
+        log_message(f"\n[bold cyan]--- Combat Begins --- [/bold cyan]")
+        self.determine_initiative()
+        self.round_number = 1
+        self.turn_index = 0
+        self.combat_ended = False
+        log_message(f"[bold yellow]--- Round {self.round_number}: Start!---[/bold yellow]")
+        self.emit_event("round_start", round=self.round_number)
+
+    def next_turn(self):
+        """
+        Advances the initiative cursor and returns the next living character due to act.
+        Rolls over into a new round when the order is exhausted. Returns None once combat
+        is over or the max_rounds limit has been reached.
+        """
+        while not self.is_combat_over():
+            if self.turn_index >= len(self.initiative_order):
+                self.end_round()
+
+                # Check if we've reached max rounds (for testing)
+                if self.max_rounds and self.round_number >= self.max_rounds:
+                    log_message(f"[bold cyan]--- Combat ended after {self.round_number} rounds (test limit). ---[/bold cyan]")
+                    break
+
+                self.round_number += 1
+                self.turn_index = 0
+                log_message(f"[bold yellow]--- Round {self.round_number}: Start!---[/bold yellow]")
+                self.emit_event("round_start", round=self.round_number)
+                continue
+
+            character = self.initiative_order[self.turn_index]
+            self.turn_index += 1
+            if character.is_alive():
+                return character
+
+        if not self.combat_ended:
+            self.combat_ended = True
+            self.emit_event("combat_end", round=self.round_number, winner=self.winning_side())
+        return None
+
+    def winning_side(self):
+        """Returns 'players' or 'npcs' once one side has been defeated, otherwise None."""
+        if not any(npc.is_alive() for npc in self.npcs):
+            return "players"
+        if not any(player.is_alive() for player in self.players):
+            return "npcs"
+        return None
+
+    def can_act(self, character):
+        """Checks whether the character will get to choose an action on its turn."""
+        return character.is_alive() and self.check_action_restrictions(character, "take_turn")
+
+    def take_turn(self, character, action=None):
+        """
+        Handles the turn logic for a character.
+        If an action is given it is used instead of prompting the player or asking the NPC AI.
+        """
         # Check if combat is already over before taking the turn
         if self.is_combat_over():
             return
+        self.emit_event("turn_start", actor=character.name, round=self.round_number)
         # Check if the character can act at all
         if not self.check_action_restrictions(character, "take_turn"):
             log_message(f"{character.name} is unable to act due to conditions like 'stunned' or 'paralyzed'.")
             character.decrement_conditions(self)  # Decrement conditions after skipping the turn
+            self.emit_event("turn_end", actor=character.name, hp=character.current_hp, skipped=True)
             return  # Skip the turn if the character cannot act
 
         # Movement logic (only if the character can move)
@@ -948,9 +2133,9 @@ class CombatEngine:
         # log_message(f"DEBUG 540: about to take turn.")
         # Handle player or NPC-specific actions
         if isinstance(character, PlayerCharacter):
-            self.handle_player_turn(character)
+            self.handle_player_turn(character, action)
         else:
-            self.handle_npc_turn(character)
+            self.handle_npc_turn(character, action)
 
         # Process effects based on timing (end of turn)
         character.process_effects_by_timing(EffectTiming.END_OF_TURN)
@@ -958,6 +2143,7 @@ class CombatEngine:
         # Decrement condition durations after the character's turn
         log_message(f"{character.name}'s turn ends. Conditions & effects updated.")
         character.decrement_conditions(self)
+        self.emit_event("turn_end", actor=character.name, hp=character.current_hp, skipped=False)
 
 
     def check_condition_removal(self, character):
@@ -1056,9 +2242,14 @@ class CombatEngine:
         return True  # No restrictions, action is allowed
 
 
-    def handle_player_turn(self, player):
+    def handle_player_turn(self, player, action=None):
         """Handles the player's turn and checks if they can perform actions."""
-        action = self.get_player_action(player)
+        if action is None:
+            if self.player_controller:
+                action = self.player_controller(self, player) or {"type": "pass"}
+            else:
+                action = self.get_player_action(player)
+        self.emit_event("action", actor=player.name, action=self.describe_action(action))
         
         # Check if the player is allowed to perform the chosen action (e.g., attack, move, cast spell)
         if action["type"] == "attack" and not self.check_action_restrictions(player, "attack"):
@@ -1127,7 +2318,7 @@ class CombatEngine:
             
             if 1 <= weapon_choice <= len(player.inventory):
                 chosen_weapon = player.inventory[weapon_choice - 1]
-                target = self.choose_target(player, self.npcs)
+                target = self.choose_target(player, self.npcs, attack_type=chosen_weapon.get("type", "melee"))
                 return {"type": "attack", "target": target, "weapon": chosen_weapon}
             else:
                 console.print("[red]Invalid choice. Please try again.[/red]")
@@ -1154,8 +2345,8 @@ class CombatEngine:
                 spell = player.spells[spell_choice - 1]
                 # Determine target based on the spell's targeting type
                 if spell['targeting'] == "aoe":
-                    target = self.npcs  # All NPCs are affected by the AOE spell
-                    log_message(f"{spell['name']} affects all NPCs!")
+                    target = None  # Everyone caught in the area, see aoe_targets
+                    log_message(f"{spell['name']} affects the enemies in its area!")
                 elif spell['targeting'] == "self":
                     target = [player]  # The actor is the only target
                 else:  # 'single'
@@ -1165,10 +2356,20 @@ class CombatEngine:
                 console.print("[red]Invalid choice. Please try again.[/red]")
 
     def handle_move_action(self, player):
-        """Handle the move action (placeholder for now)."""
-        console.print(f"{player.name} moves! (Movement system not yet implemented)")
-        console.print("This is a placeholder for the future movement system.")
-        return {"type": "move"}
+        """Handle the move action: ask for a destination square when the player is on the battle map."""
+        if player.position is None:
+            console.print(f"{player.name} moves! (Not on the battle map)")
+            return {"type": "move"}
+        enemy = self.nearest_enemy(player)
+        if enemy is not None:
+            console.print(f"Nearest enemy: {enemy.name} at {enemy.position} ({player.distance_to(enemy)} ft).")
+        destination = input(f"{player.name} is at {player.position}. Enter the destination square as x,y: ")
+        try:
+            x, y = (int(part) for part in destination.split(","))
+        except ValueError:
+            console.print("[red]Invalid square, staying put.[/red]")
+            return {"type": "move"}
+        return {"type": "move", "to": (x, y)}
 
     def choose_target(self, actor, targets_list, spell=None, is_attack=True, attack_type="melee"):
         # Filter valid targets based on whether they are alive
@@ -1185,16 +2386,23 @@ class CombatEngine:
                 else:
                     # Damage or debuff spells target only alive enemies
                     valid_targets = [target for target in self.npcs if target.is_alive()]
+                valid_targets = [target for target in valid_targets if self.has_line_of_sight(actor, target)]
             elif spell['targeting'] == "area":
-                valid_targets = self.choose_aoe_targets(actor, valid_targets, spell)
+                valid_targets = self.choose_aoe_target(actor, valid_targets, spell)
         # Handle attack targeting (melee and ranged)
         elif is_attack:
             if attack_type == "melee":
                 # Only enemies within melee range are valid
-                valid_targets = [target for target in valid_targets if target.is_enemy and target.is_adjacent(actor)]
+                valid_targets = [target for target in valid_targets
+                                 if target.is_enemy and target.is_adjacent(actor) and self.has_line_of_sight(actor, target)]
             elif attack_type == "ranged":
                 # Can target distant enemies
-                valid_targets = [target for target in valid_targets if target.is_enemy and target.is_in_range(actor)]
+                valid_targets = [target for target in valid_targets
+                                 if target.is_enemy and target.is_in_range(actor) and self.has_line_of_sight(actor, target)]
+
+        if not valid_targets:
+            console.print("[red]No valid targets in range.[/red]")
+            return None
 
         # Display the valid targets for selection
         for i, target in enumerate(valid_targets):
@@ -1204,9 +2412,10 @@ class CombatEngine:
         choice = int(input("Enter the number of your target: ")) - 1
         return valid_targets[choice] if 0 <= choice < len(valid_targets) else valid_targets[0]
 
-    def cast_spell(self, actor, spell, targets_list=None):
+    def cast_spell(self, actor, spell, targets_list=None, area=None):
         """Cast a spell with comprehensive logging."""
         
+        handler = actor.spell_handler(spell)
         log_message(f"[bold cyan]{actor.name} begins casting {spell['name']}...[/bold cyan]")
         
         # Apply advantage or disadvantage only for attack roll spells
@@ -1217,192 +2426,39 @@ class CombatEngine:
         log_message(f"{actor.name} uses {actor.class_type} spellcasting modifier: {spell_mod}")
 
         # Handle spell targeting "self"
-        if spell['targeting'] == "self":
+        if handler.targeting == "self":
             targets_list = [actor]
             log_message(f"{spell['name']} targets {actor.name} (self-targeting spell).")
 
         # Handle spell targeting a single target (enemy or ally)
-        elif spell['targeting'] == "single":
+        elif handler.targeting == "single":
             if targets_list is None:
-                # Healing, buff, or debuff spells should target allies
-                if spell['type'] in ['healing', 'buff']:
+                # Healing and buff spells should target allies
+                if handler.beneficial:
                     log_message(f"{spell['name']} is a beneficial spell - selecting an ally target.")
                     targets_list = [actor] + self.players  # Target allies and actor
                 else:
                     # Damage or debuff spells target enemies (NPCs)
                     log_message(f"{spell['name']} is a harmful spell - selecting an enemy target.")
                     targets_list = [self.choose_target(actor, self.npcs, spell)]
+            unseen = [t for t in targets_list if t is not None and not self.has_line_of_sight(actor, t)]
+            if unseen:
+                log_message(f"{actor.name} cannot see {', '.join(t.name for t in unseen)} to cast {spell['name']}.")
+                targets_list = [t for t in targets_list if t not in unseen]
 
         # Handle AOE spells
-        elif spell['targeting'] == "aoe":
-            log_message(f"{spell['name']} is an area-of-effect spell targeting all enemies.")
-            targets_list = [t for t in self.npcs if t.is_alive()]
+        elif handler.targeting == "aoe":
+            targets_list = self.aoe_targets(actor, spell, targets_list, area)
 
         # Filter out defeated targets
-        targets_list = [t for t in targets_list if t.is_alive()]
+        targets_list = [t for t in targets_list if t is not None and t.is_alive()]
         if not targets_list:
             log_message(f"No valid targets for {spell['name']}.")
             return
             
         log_message(f"{spell['name']} will affect: {[t.name for t in targets_list]}")
+        handler.resolve(self, actor, targets_list, spell_mod, adv_disadv)
 
-        # Handle attack roll-based damage spells (e.g., Firebolt, Eldritch Blast)
-        if spell.get('damage') and spell.get('save') is None:
-            attack_roll = roll_with_advantage_disadvantage(spell_mod, adv_disadv)
-
-            for target in targets_list:
-                if attack_roll.total >= target.ac:
-                    damage_roll = d20.roll(spell['damage'])
-                    log_message(f"{actor.name} rolls a {attack_roll.result} ({adv_disadv}) to hit {target.name}'s AC of {target.ac} with the {spell['name']} spell.")
-                    log_message(f"The spell hits! {actor.name} rolls a {spell['damage']} for a total damage of {damage_roll.total}.")
-                    log_message(f"{target.name} takes {damage_roll.total} damage.")
-                    target.take_damage(damage_roll.total)
-                else:
-                    log_message(f"{actor.name} rolls a {attack_roll.result} ({adv_disadv}) to hit {target.name}'s AC of {target.ac} with the {spell['name']} spell.")
-                    log_message(f"{target.name} dodges {spell['name']}!")
-                self.check_target_status(target)
-
-        # Handle saving throw-based damage spells (e.g., Fireball)
-        elif spell.get('damage') and spell.get('save'):
-            damage_roll = d20.roll(spell['damage'])
-            log_message(f"{actor.name} rolls {spell['damage']} for a total of damage of {damage_roll}!")
-            for target in targets_list:
-                if target.saving_throw(target, spell['save'], spell['dc']):
-                    half_damage = damage_roll.total // 2
-                    log_message(f"{target.name} succeeds on saving throw, taking half damage: {half_damage}.")
-                    target.take_damage(half_damage)
-                else:
-                    log_message(f"{target.name} fails saving throw, taking full damage: {damage_roll.total}.")
-                    target.take_damage(damage_roll.total)
-                    
-                    # Apply condition effect if the spell has one
-                    if spell.get('effect'):
-                        effect_data = spell['effect']
-                        condition_name = effect_data['modifier']
-                        duration = effect_data.get('duration', 1)
-                        log_message(f"[bold yellow]Applying {condition_name} to {target.name} for {duration} round(s).[/bold yellow]")
-                        target.apply_condition_with_effects(condition_name, duration, spell)
-                        log_message(f"[bold yellow]{actor.name} successfully cast {spell['name']} on {target.name}![/bold yellow]")
-                        
-                self.check_target_status(target)
-
-        # Handle healing spells
-        elif spell.get('healing'):
-            healing_roll = d20.roll(spell['healing'])
-            log_message(f"{actor.name} rolls {healing_roll.result} for healing.")
-            for target in targets_list:
-                target.current_hp = min(target.current_hp + healing_roll.total, target.hp)  # Ensure HP doesn't exceed max
-                log_message(f"{target.name} is healed for {healing_roll.total} HP and now has {target.current_hp} HP.")
-
-        # Handle condition spells (e.g., stunning)
-        elif spell['type'] == 'condition':
-            effect_data = spell['effect']
-            condition_name_in_spell = effect_data['modifier']  # The condition being applied (e.g., 'stunned')
-            
-            log_message(f"[bold magenta]Processing condition spell: {spell['name']} applies {condition_name_in_spell}[/bold magenta]")
-
-            for target in targets_list:
-                log_message(f"Attempting to apply {condition_name_in_spell} to {target.name}...")
-                
-                # Check for saving throw if specified in the spell
-                if 'save' in spell:
-                    log_message(f"{target.name} must make a {spell['save']} saving throw (DC {spell['dc']}) to resist {condition_name_in_spell}.")
-                    if target.saving_throw(target, spell['save'], spell['dc'], spell['effect']['modifier']):
-                        log_message(f"[bold green]{target.name} succeeds on the saving throw and avoids {condition_name_in_spell}![/bold green]")
-                        continue  # Skip applying the condition if the saving throw succeeds
-                    else:
-                        log_message(f"[bold red]{target.name} fails the saving throw and is affected by {condition_name_in_spell}.[/bold red]")
-
-                duration = effect_data.get('duration', 1)  # Default to 1 round if duration isn't specified
-                log_message(f"[bold yellow]Applying {condition_name_in_spell} to {target.name} for {duration} round(s).[/bold yellow]")
-                target.apply_condition_with_effects(condition_name_in_spell, duration, spell)
-                log_message(f"[bold yellow]{actor.name} successfully cast {spell['name']} on {target.name}![/bold yellow]")
-
-        # Handle condition removal spells (e.g., Lesser Restoration, Greater Restoration)
-        elif spell['type'] == 'utility' and spell.get('effect', {}).get('attribute') == 'condition_removal':
-            effect_data = spell['effect']
-            removal_type = effect_data['modifier']  # 'remove_one' or 'remove_all'
-            
-            log_message(f"[bold magenta]Processing condition removal spell: {spell['name']} ({removal_type})[/bold magenta]")
-            
-            for target in targets_list:
-                if removal_type == 'remove_one':
-                    # Remove one condition (the first one found)
-                    if target.unified_effects:
-                        effect_name = list(target.unified_effects.keys())[0]
-                        effect = target.unified_effects[effect_name]
-                        effect.remove(target)
-                        del target.unified_effects[effect_name]
-                        log_message(f"[bold yellow]{actor.name} cast {spell['name']} on {target.name}, removing {effect_name}.[/bold yellow]")
-                    else:
-                        log_message(f"{target.name} has no conditions to remove.")
-                        
-                elif removal_type == 'remove_all':
-                    # Remove all conditions
-                    removed_effects = list(target.unified_effects.keys())
-                    for effect_name in removed_effects:
-                        effect = target.unified_effects[effect_name]
-                        effect.remove(target)
-                        del target.unified_effects[effect_name]
-                    
-                    if removed_effects:
-                        log_message(f"[bold yellow]{actor.name} cast {spell['name']} on {target.name}, removing all conditions: {removed_effects}[/bold yellow]")
-                    else:
-                        log_message(f"{target.name} has no conditions to remove.")
-
-        # Handle utility spells (like Blinding Light, Charm Person, etc.)
-        elif spell['type'] == 'utility':
-            effect_data = spell['effect']
-            condition_name_in_spell = effect_data['modifier']  # The condition being applied (e.g., 'blinded')
-            
-            log_message(f"[bold magenta]Processing utility spell: {spell['name']} applies {condition_name_in_spell}[/bold magenta]")
-
-            for target in targets_list:
-                log_message(f"Attempting to apply {condition_name_in_spell} to {target.name}...")
-                
-                # Check for saving throw if specified in the spell
-                if 'save' in spell:
-                    log_message(f"{target.name} must make a {spell['save']} saving throw (DC {spell['dc']}) to resist {condition_name_in_spell}.")
-                    if target.saving_throw(target, spell['save'], spell['dc'], spell['effect']['modifier']):
-                        log_message(f"[bold green]{target.name} succeeds on the saving throw and avoids {condition_name_in_spell}![/bold green]")
-                        continue  # Skip applying the condition if the saving throw succeeds
-                    else:
-                        log_message(f"[bold red]{target.name} fails the saving throw and is affected by {condition_name_in_spell}.[/bold red]")
-
-                duration = effect_data.get('duration', 1)  # Default to 1 round if duration isn't specified
-                log_message(f"[bold yellow]Applying {condition_name_in_spell} to {target.name} for {duration} round(s).[/bold yellow]")
-                target.apply_condition_with_effects(condition_name_in_spell, duration, spell)
-                log_message(f"[bold yellow]{actor.name} successfully cast {spell['name']} on {target.name}![/bold yellow]")
-
-        # Handle buff spells (e.g., granting advantage, increasing AC)
-        elif spell['type'] == 'buff':
-            effect_data = spell['effect']
-            spell_name = spell['name']
-            attribute = effect_data['attribute']  # The attribute being affected (e.g., 'adv_disadv', 'ac')
-            modifier = effect_data['modifier']  # The value being applied (e.g., 'advantage', +2)
-            duration = effect_data.get('duration', 1)  # Default to 1 round if not specified
-
-            log_message(f"[bold magenta]Processing buff spell: {spell['name']} modifies {attribute} by {modifier}[/bold magenta]")
-
-            for target in targets_list:
-                target.apply_effect(spell['name'], attribute, modifier, duration)
-                log_message(f"[bold yellow]{actor.name} cast buff {spell['name']} on {target.name}: {attribute} is modified by {modifier} for {duration} round(s).[/bold yellow]")
-                log_message(f"{target.name} is now affected by the buff for {duration} rounds.")
-
-        # Handle debuff spells (e.g., granting disadvantage, decreasing AC)
-        elif spell['type'] == 'debuff':
-            effect_data = spell['effect']
-            attribute = effect_data['attribute']  # The attribute being affected (e.g., 'adv_disadv', 'ac')
-            modifier = effect_data['modifier']  # The value being applied (e.g., 'disadvantage', -2)
-            duration = effect_data.get('duration', 1)  # Default to 1 round if not specified
-
-            log_message(f"[bold magenta]Processing debuff spell: {spell['name']} modifies {attribute} by {modifier}[/bold magenta]")
-
-            for target in targets_list:
-                target.apply_effect(spell['name'], attribute, modifier, duration)
-                log_message(f"[bold yellow]{actor.name} cast {spell['name']} on {target.name} debuffing it with {modifier} for {duration} round(s).[/bold yellow]")
-                log_message(f"{target.name} is now affected by the debuff for {duration} rounds.")
-   
     def attack(self, actor, target, weapon, adv_disadv=None, two_handed=False):
         """Handles the attack action, ensuring only alive targets are attacked and applying damage."""
     
@@ -1418,6 +2474,72 @@ class CombatEngine:
             log_message(f"{target.name} is already defeated and cannot be attacked.")
             return
 
+        if not actor.is_in_range(target, weapon):
+            log_message(f"{target.name} is out of reach of {actor.name}'s {weapon['name']} "
+                        f"({actor.distance_to(target)} ft, reach {weapon_reach(weapon)} ft).")
+            return
+
+        if not self.has_line_of_sight(actor, target):
+            log_message(f"{actor.name} has no line of sight to {target.name}.")
+            return
+
+        attack_mod, weapon_damage, adv_disadv, critical_hit = self.attack_profile(actor, target, weapon, adv_disadv, two_handed)
+        target_ac = self.effective_ac(actor, target)
+        if target_ac > target.ac:
+            log_message(f"{target.name} has cover from {actor.name} (+{target_ac - target.ac} AC).")
+
+        # Stacks of identical NPCs attack with every member at once
+        if actor.is_stack:
+            actor.volley(self, target, weapon, attack_mod, weapon_damage, adv_disadv, critical_hit, target_ac)
+            return
+
+        # log_message(f"DEBUG ATTACK 925: actor's adv_disadv -> {adv_disadv}")
+        attack_roll = roll_with_advantage_disadvantage(attack_mod, adv_disadv)
+        log_message(f"attack_roll -> {attack_roll} = attack_mod -> {attack_mod}, adv_disadv -> {adv_disadv}")
+
+        # Check if the roll is valid
+        if not attack_roll:
+            console.print("[red]Error: Attack roll failed.[/red]")
+            return
+
+        # Log the attack roll and modifiers
+        log_message(f"{actor.name} attacks {target.name} with {weapon['name']} ({adv_disadv}).")
+
+        log_message(f"{actor.name} rolls ({attack_roll.result}) ({adv_disadv}) to hit {target.name} (AC {target_ac}).")
+
+        # Handle critical hit from natural 20 or condition-based automatic crit
+        if attack_roll.crit == d20.CritType.CRIT or critical_hit:
+            log_message(f"CRITICAL HIT! {actor.name} rolls 1d20 ({attack_roll.result}) (Critical Hit)!")
+            damage_roll = d20.roll(f"2 * {weapon_damage} + {attack_mod}")
+            # log_message(f"DEBUG 1033: Critical hit damage_roll -> {damage_roll}")
+            total_damage = damage_roll.total
+            target.take_damage(total_damage)
+            log_message(f"{actor.name} hits {target.name} with {weapon['name']} for {damage_roll.result} damage!")
+            self.check_target_status(target)
+
+        # Handle critical failure
+        elif attack_roll.crit == d20.CritType.FAIL:
+            log_message(f"CRITICAL MISS! {actor.name} rolls 1d20 ({attack_roll.result}) (Critical Miss)!")
+        
+        # Handle regular hit
+        elif attack_roll.total >= target_ac:
+            damage_roll = d20.roll(f"{weapon_damage} + {attack_mod}")
+            total_damage = damage_roll.total
+            target.take_damage(total_damage)
+            log_message(f"[bold yellow]{actor.name} hits {target.name} with {weapon['name']} for {damage_roll.result} damage![/bold yellow]")
+            self.check_target_status(target)
+
+        # Handle miss
+        else:
+            log_message(f"{actor.name} misses {target.name} with {weapon['name']}!")
+
+
+    def attack_profile(self, actor, target, weapon, adv_disadv=None, two_handed=False):
+        """
+        Works out an attack before the dice are rolled: the attack modifier, the damage dice,
+        advantage/disadvantage from both sides' conditions and whether the hit is an
+        automatic critical. Returns (attack_mod, weapon_damage, adv_disadv, critical_hit).
+        """
         # Determine the attack modifier
         if weapon.get('finesse'):
             # Automatically choose the higher modifier between Strength and Dexterity for finesse weapons
@@ -1462,23 +2584,9 @@ class CombatEngine:
                         log_message(f"[bold green]{actor.name} has advantage on attack rolls due to {effect_name}.[/bold green]")
                         adv_disadv = "advantage"
 
-        # Roll to hit with advantage, disadvantage, or normally
+        # Otherwise use the actor's own advantage or disadvantage buff, if any
         if not adv_disadv:
-            adv_disadv = getattr(actor, 'adv_disadv', 'normal')  # Check if the actor has an advantage or disadvantage buff
-
-        # log_message(f"DEBUG ATTACK 925: actor's adv_disadv -> {adv_disadv}")
-        attack_roll = roll_with_advantage_disadvantage(attack_mod, adv_disadv)
-        log_message(f"attack_roll -> {attack_roll} = attack_mod -> {attack_mod}, adv_disadv -> {adv_disadv}")
-
-        # Check if the roll is valid
-        if not attack_roll:
-            console.print("[red]Error: Attack roll failed.[/red]")
-            return
-
-        # Log the attack roll and modifiers
-        log_message(f"{actor.name} attacks {target.name} with {weapon['name']} ({adv_disadv}).")
-
-        log_message(f"{actor.name} rolls ({attack_roll.result}) ({adv_disadv}) to hit {target.name} (AC {target.ac}).")
+            adv_disadv = getattr(actor, 'adv_disadv', 'normal')
 
         # Handle automatic critical hit based on unified effects on the target
         critical_hit = False
@@ -1492,45 +2600,11 @@ class CombatEngine:
                         log_message(f"{actor.name} automatically scores a critical hit on {target.name} due to {effect_name}.")
                         critical_hit = True
 
-        # Handle critical hit from natural 20 or condition-based automatic crit
-        if attack_roll.result == 20 or critical_hit:
-            log_message(f"CRITICAL HIT! {actor.name} rolls 1d20 ({attack_roll.result}) (Critical Hit)!")
-            damage_roll = d20.roll(f"2 * {weapon_damage} + {attack_mod}")
-            # log_message(f"DEBUG 1033: Critical hit damage_roll -> {damage_roll}")
-            total_damage = damage_roll.total
-            target.take_damage(total_damage)
-            log_message(f"{actor.name} hits {target.name} with {weapon['name']} for {damage_roll.result} damage!")
-            self.check_target_status(target)
-
-        # Handle critical failure
-        elif attack_roll.result == 1:
-            log_message(f"CRITICAL MISS! {actor.name} rolls 1d20 ({attack_roll.result}) (Critical Miss)!")
-        
-        # Handle regular hit
-        elif attack_roll.total >= target.ac:
-            damage_roll = d20.roll(f"{weapon_damage} + {attack_mod}")
-            total_damage = damage_roll.total
-            target.take_damage(total_damage)
-            log_message(f"[bold yellow]{actor.name} hits {target.name} with {weapon['name']} for {damage_roll.result} damage![/bold yellow]")
-            self.check_target_status(target)
-
-        # Handle miss
-        else:
-            log_message(f"{actor.name} misses {target.name} with {weapon['name']}!")
-
+        return attack_mod, weapon_damage, adv_disadv, critical_hit
 
     def choose_aoe_target(self, actor, target, spell):
-        """Handles the selection of targets for area-of-effect (AOE) spells."""
-        # Assuming all NPCs are in range, select all NPCs as targets for AOE spells
-        aoe_radius = spell.get('radius', None)  # Optional: Implement radius logic in the future
-        if aoe_radius:
-            log_message(f"{spell['name']} affects NPCs within a {aoe_radius} ft radius!")
-            # You could later add logic here to filter based on distance from actor if needed
-        else:
-            log_message(f"{spell['name']} affects all NPCs!")
-
-        # Return all valid NPC target in the area of effect
-        return [target for target in target if target.is_alive()]
+        """Handles the selection of targets for area-of-effect (AOE) spells, aimed at the given targets."""
+        return self.aoe_targets(actor, spell, [t for t in target if t.is_alive()])
 
     def choose_spell(self, actor):
         """Prompts the player to choose a spell to cast."""
@@ -1545,16 +2619,17 @@ class CombatEngine:
             console.print("[red]Invalid choice, defaulting to the first spell.[/red]")
             return actor.spells[0]
 
-    def handle_npc_turn(self, npc):
+    def handle_npc_turn(self, npc, action=None):
         """Determines the action of an NPC on their turn."""
         if not npc.is_alive():
             return
 
-        # Get all characters for AI decision making
-        all_characters = self.players + self.npcs
-        
-        # Use the new AI system
-        action = npc.decide_action(None, all_characters)
+        if action is None:
+            # Use the new AI system, handing it the maintained faction indexes
+            action = npc.decide_action(None, self.roster)
+        elif action["type"] == "pass":
+            action = None
+        self.emit_event("action", actor=npc.name, action=self.describe_action(action))
         
         if action is None:
             log_message(f"{npc.name} cannot act this turn.")
@@ -1564,7 +2639,14 @@ class CombatEngine:
         if action["type"] == "attack":
             self.attack(npc, action["target"], action["weapon"])
         elif action["type"] == "cast_spell":
-            self.cast_spell(npc, action["spell"], action["target"])
+            self.cast_spell(npc, action["spell"], action["target"], action.get("area"))
+        elif action["type"] == "move" and action.get("to") is not None:
+            if not self.check_action_restrictions(npc, "move"):
+                log_message(f"{npc.name} is restricted from moving due to conditions.")
+            elif action.get("approach"):
+                self.advance(npc)
+            else:
+                self.move_character(npc, action["to"])
         else:
             log_message(f"{npc.name} performs {action['type']} action.")
 
@@ -1584,7 +2666,11 @@ class CombatEngine:
     def remove_from_initiative(self, character):
         """Removes a defeated character from the initiative order."""
         if character in self.initiative_order:
+            # Keep the initiative cursor pointing at the same upcoming character
+            if self.initiative_order.index(character) < self.turn_index:
+                self.turn_index -= 1
             self.initiative_order.remove(character)
+            self.grid.touch()  # The fallen no longer block movement
             log_message(f"{character.name} has been removed from the initiative order.")
 
     def check_target_status(self, target):
@@ -1594,6 +2680,109 @@ class CombatEngine:
             self.remove_from_initiative(target)  # Removes from initiative
         else: 
             log_message(f"{target.name}'s HP is now {target.current_hp}.")
+        self.emit_event("target_status", target=target.name, hp=target.current_hp, alive=target.is_alive())
+
+    def check_targets_status(self, targets):
+        """check_target_status for a crowd (a batched area spell): one log line for the fallen, one for the rest."""
+        defeated = [target for target in targets if not target.is_alive()]
+        standing = [target for target in targets if target.is_alive()]
+        if defeated:
+            log_message(f"[bold red]Defeated: {', '.join(target.name for target in defeated)}!")
+            with quiet_mode():
+                for target in defeated:
+                    self.remove_from_initiative(target)
+        if standing:
+            log_message(f"HP now: {', '.join(f'{target.name} {target.current_hp}' for target in standing)}.")
+        for target in targets:
+            self.emit_event("target_status", target=target.name, hp=target.current_hp, alive=target.is_alive())
+
+    def find_combatant(self, name):
+        """Returns the combatant with the given name, preferring living ones, or None."""
+        match = None
+        for character in self.players + self.npcs:
+            if character.name == name:
+                if character.is_alive():
+                    return character
+                match = match or character
+        return match
+
+    def describe_action(self, action):
+        """
+        Converts an action dict into a JSON-safe description that refers to weapons,
+        spells and targets by name. The inverse of resolve_action.
+        """
+        if action is None:
+            return {"type": "pass"}
+        description = {"type": action["type"]}
+        if action["type"] == "attack":
+            description["weapon"] = action["weapon"]["name"] if action.get("weapon") else None
+            description["target"] = action["target"].name if action.get("target") else None
+        elif action["type"] == "cast_spell":
+            description["spell"] = action["spell"]["name"]
+            description["targets"] = [t.name for t in (action.get("target") or [])]
+            if action.get("area") is not None:
+                description["area"] = {"origin": list(action["area"]["origin"]), "facing": action["area"].get("facing")}
+        elif action["type"] == "move" and action.get("to") is not None:
+            description["to"] = list(action["to"])
+            if action.get("approach"):
+                description["approach"] = True
+        return description
+
+    def resolve_action(self, actor, description):
+        """
+        Turns an action description (as produced by describe_action or sent by a remote client)
+        back into an executable action dict for the actor. Returns None for a 'pass'.
+        Raises ValueError if the description refers to something the actor does not have.
+        """
+        action_type = description.get("type")
+        if action_type == "pass":
+            return None
+
+        if action_type == "attack":
+            weapon_name = description.get("weapon")
+            weapon = next((w for w in actor.inventory if w.get("name") == weapon_name), None)
+            if weapon is None:
+                raise ValueError(f"{actor.name} has no weapon named {weapon_name!r}.")
+            target = self.find_combatant(description.get("target"))
+            if target is None:
+                raise ValueError(f"Unknown target {description.get('target')!r}.")
+            return {"type": "attack", "target": target, "weapon": weapon}
+
+        if action_type == "cast_spell":
+            spell_name = description.get("spell")
+            spell = next((s for s in (actor.spells or []) if s.get("name") == spell_name), None)
+            if spell is None:
+                raise ValueError(f"{actor.name} does not know the spell {spell_name!r}.")
+            if spell["targeting"] == "self":
+                targets = [actor]
+            elif spell["targeting"] == "aoe":
+                # Named targets aim the area; without any it goes after all of the caster's enemies
+                names = description.get("targets")
+                targets = [t for t in map(self.find_combatant, names) if t is not None] if names else None
+                area = description.get("area")
+                if area is not None:
+                    return {"type": "cast_spell", "spell": spell, "target": targets,
+                            "area": {"origin": as_position(area["origin"]), "facing": area.get("facing")}}
+            else:
+                targets = []
+                for name in description.get("targets") or []:
+                    target = self.find_combatant(name)
+                    if target is None:
+                        raise ValueError(f"Unknown target {name!r}.")
+                    targets.append(target)
+                if not targets:
+                    raise ValueError(f"{spell_name} needs a target.")
+            return {"type": "cast_spell", "spell": spell, "target": targets}
+
+        if action_type == "move":
+            if description.get("to") is None:
+                return {"type": "move"}
+            action = {"type": "move", "to": as_position(description["to"])}
+            if description.get("approach"):
+                action["approach"] = True
+            return action
+
+        raise ValueError(f"Unknown action type {action_type!r}.")
 
     def execute_action(self, character, action):
         """Executes the action chosen by the player or NPC."""
@@ -1605,9 +2794,14 @@ class CombatEngine:
         if action["type"] == "attack":
             self.attack(character, action["target"], action["weapon"])
         elif action["type"] == "cast_spell":
-            self.cast_spell(character, action["spell"],  action["target"])
+            self.cast_spell(character, action["spell"], action["target"], action.get("area"))
         elif action["type"] == "move":
-            log_message(f"{character.name} moves! (Movement system not yet implemented)")
+            if action.get("to") is None or character.position is None:
+                log_message(f"{character.name} moves! (Not on the battle map)")
+            elif action.get("approach"):
+                self.advance(character)
+            else:
+                self.move_character(character, action["to"])
 
     def perform_contested_check(self, character, ability):
         """
@@ -1655,13 +2849,49 @@ class CombatEngine:
         # log_message(f"Round {self.round_number} begins.")
 
 
+def npc_class_for(data):
+    """NonPlayerCharacter, or horde.NPCStack for entries with a "count" of identical creatures."""
+    if "count" in data:
+        from horde import NPCStack
+        return NPCStack
+    return NonPlayerCharacter
+
+def character_from_dict(data):
+    """Rebuild a character saved with Character.to_dict, including its in-combat state."""
+    kwargs = {key: value for key, value in data.items() if key not in ("kind", "state")}
+    kind = data.get("kind")
+    if kind in ("npc", "stack"):
+        character_class = npc_class_for(data)
+    else:
+        character_class = {"player": PlayerCharacter}.get(kind, Character)
+    character = character_class(**kwargs)
+    character.load_state(data.get("state", {}))
+    character.compile_spells()
+    return character
+
 # Loading Characters from JSON
 def load_characters_from_json(file_path):
-    with open(file_path, 'r') as file:
-        game_state = json.load(file)
-    
+    """Builds players and NPCs from a game_state file, validating every entry (see game_state_loader.py)."""
+    from game_state_loader import load_game_state
+    return load_game_state(file_path)
+
+def load_characters_from_dict(game_state):
+    """Builds players and NPCs from an already-parsed game_state dict."""
     players = [PlayerCharacter(**pc) for pc in game_state['players']]
-    npcs = [NonPlayerCharacter(**npc) for npc in game_state['npcs']]
+    templates = {}
+    if game_state.get('templates'):
+        from monster_templates import load_templates
+        templates = load_templates(game_state['templates'])
+    npcs = []
+    for npc in game_state['npcs']:
+        if "template" in npc:
+            from monster_templates import spawn_from
+            npcs.append(spawn_from(templates, npc))
+        else:
+            npcs.append(npc_class_for(npc)(**npc))
+    for character in players + npcs:
+        if character.template is None:  # Template instances share their template's compiled spells
+            character.compile_spells()
     
     return players, npcs
 # Main Execution
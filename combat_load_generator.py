@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Load generator for combat_server.py.
+
+Starts a server (or connects to a running one), plays many encounters concurrently with
+simple scripted players, and reports how many sessions the server completes per CPU
+second - i.e. sessions per core, since one server process runs on one core.
+
+Usage:
+    python3 combat_load_generator.py --sessions 200 --concurrency 20
+    python3 combat_load_generator.py --port 8765 --no-spawn
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+from combat_server import DEFAULT_HOST, DEFAULT_PORT
+
+
+class LoadClient:
+    """One connection that plays encounters back to back, always attacking the first enemy."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.turn_events = 0
+        self.latencies = []
+
+    async def request(self, payload):
+        self.writer.write((json.dumps(payload) + "\n").encode())
+        await self.writer.drain()
+
+    async def read_until_decision(self):
+        """Reads streamed events until the server waits for us or the encounter ends."""
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                raise ConnectionError("Server closed the connection.")
+            message = json.loads(line)
+            event = message.get("event")
+            if event == "turn_start":
+                self.turn_events += 1
+            elif event in ("awaiting_action", "combat_end", "error"):
+                return message
+
+    def choose_action(self, message):
+        options = message["options"]
+        if options["weapons"] and options["enemies"]:
+            return {"type": "attack", "weapon": options["weapons"][0], "target": options["enemies"][0]}
+        return {"type": "pass"}
+
+    async def play_session(self, game_state, seed):
+        started = time.perf_counter()
+        await self.request({"op": "create", "game_state": game_state, "seed": seed})
+        message = await self.read_until_decision()
+        session_id = message.get("session")
+        while message["event"] == "awaiting_action":
+            sent = time.perf_counter()
+            await self.request({"op": "action", "session": session_id, "action": self.choose_action(message)})
+            message = await self.read_until_decision()
+            self.latencies.append(time.perf_counter() - sent)
+        await self.request({"op": "close", "session": session_id})
+        await self.reader.readline()
+        return message["event"] == "combat_end", time.perf_counter() - started
+
+
+async def fetch_stats(host, port, unix_path):
+    reader, writer = await open_connection(host, port, unix_path)
+    writer.write(b'{"op": "stats"}\n')
+    await writer.drain()
+    stats = json.loads(await reader.readline())
+    writer.close()
+    return stats
+
+
+async def open_connection(host, port, unix_path):
+    if unix_path:
+        return await asyncio.open_unix_connection(unix_path, limit=1 << 20)
+    return await asyncio.open_connection(host, port, limit=1 << 20)
+
+
+async def run_load(game_state, sessions, concurrency, host, port, unix_path):
+    before = await fetch_stats(host, port, unix_path)
+    queue = asyncio.Queue()
+    for seed in range(sessions):
+        queue.put_nowait(seed)
+    results = []
+    clients = []
+
+    async def worker():
+        reader, writer = await open_connection(host, port, unix_path)
+        client = LoadClient(reader, writer)
+        clients.append(client)
+        while not queue.empty():
+            seed = queue.get_nowait()
+            results.append(await client.play_session(game_state, seed))
+        writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall_time = time.perf_counter() - started
+    after = await fetch_stats(host, port, unix_path)
+
+    cpu_time = after["cpu_time"] - before["cpu_time"]
+    completed = sum(1 for ok, _ in results if ok)
+    latencies = sorted(l for client in clients for l in client.latencies)
+    report = {
+        "sessions": len(results),
+        "completed": completed,
+        "turns": sum(client.turn_events for client in clients),
+        "wall_time": wall_time,
+        "server_cpu_time": cpu_time,
+        "sessions_per_core_second": completed / cpu_time if cpu_time else float("inf"),
+        "sessions_per_second": completed / wall_time if wall_time else float("inf"),
+        "p50_action_latency_ms": latencies[len(latencies) // 2] * 1000 if latencies else 0.0,
+        "p99_action_latency_ms": latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0.0,
+    }
+    if after.get("decision_cache"):
+        report["decision_cache_hit_rate"] = after["decision_cache"]["hit_rate"]
+        report["decision_cache_entries"] = after["decision_cache"]["entries"]
+    return report
+
+
+def spawn_server(host, port, unix_path, decision_cache=0):
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "combat_server.py"),
+               "--max-sessions", "100000", "--decision-cache", str(decision_cache)]
+    command += ["--unix", unix_path] if unix_path else ["--host", host, "--port", str(port)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    process.stdout.readline()  # Wait for the "listening" banner
+    return process
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure combat_server throughput in sessions per core.")
+    parser.add_argument("--game-state", default="game_state_test.json")
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix", help="Connect over this Unix socket path instead of TCP.")
+    parser.add_argument("--no-spawn", action="store_true", help="Use an already running server.")
+    parser.add_argument("--decision-cache", type=int, default=0, metavar="ENTRIES",
+                        help="Start the server with a shared NPC decision cache of this size.")
+    args = parser.parse_args()
+
+    with open(args.game_state, "r") as file:
+        game_state = json.load(file)
+
+    process = None if args.no_spawn else spawn_server(args.host, args.port, args.unix, args.decision_cache)
+    try:
+        report = asyncio.run(run_load(game_state, args.sessions, args.concurrency,
+                                      args.host, args.port, args.unix))
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+    print("\n" + "=" * 60)
+    print("COMBAT SERVER LOAD REPORT")
+    print("=" * 60)
+    for key, value in report.items():
+        print(f"{key.replace('_', ' ').title()}: {value:.2f}" if isinstance(value, float)
+              else f"{key.replace('_', ' ').title()}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Deterministic recording and replay of encounters.
+
+An encounter is fully determined by its starting game_state, the dice seed and the
+sequence of decisions taken on each turn. The recorder captures those decisions (for
+players and NPCs alike) together with a hash of the combat state after every turn.
+Replaying feeds the recorded decisions back in with all logging silenced, skipping the
+NPC AI entirely, so the engine can fast-forward to any round and optionally hand over
+to interactive play from there. Any mismatch in the per-turn state hashes raises
+ReplayDivergenceError at the first turn that differs.
+
+Usage:
+    python3 combat_replay.py record game_state_test.json --seed 7 --out encounter.json
+    python3 combat_replay.py replay encounter.json --round 4 --resume
+"""
+
+import argparse
+import json
+import random
+
+from combat_engine import CombatEngine, load_characters_from_dict, log_message, quiet_mode
+
+
+class ReplayDivergenceError(Exception):
+    """Raised when a replayed encounter stops matching its recording."""
+
+    def __init__(self, turn_index, message):
+        super().__init__(f"Replay diverged at turn {turn_index}: {message}")
+        self.turn_index = turn_index
+
+
+class EncounterRecorder:
+    """Listens to an engine's turn events and records every decision and the resulting state hash."""
+
+    def __init__(self, engine, game_state, seed):
+        self.engine = engine
+        self.record = {
+            "seed": seed,
+            "max_rounds": engine.max_rounds,
+            "game_state": game_state,
+            "turns": [],
+        }
+        engine.event_listeners.append(self._on_event)
+
+    def _on_event(self, event):
+        turns = self.record["turns"]
+        if event["event"] == "turn_start":
+            turns.append({"round": event["round"], "actor": event["actor"], "action": None})
+        elif event["event"] == "action":
+            turns[-1]["action"] = event["action"]
+        elif event["event"] == "turn_end":
+            turns[-1]["hash"] = self.engine.state_hash()
+
+    def save(self, file_path):
+        with open(file_path, 'w') as file:
+            json.dump(self.record, file, indent=2)
+        return file_path
+
+
+def record_combat(game_state, seed, max_rounds=None, player_controller=None):
+    """
+    Plays a full encounter with a fixed seed and returns its recording.
+    Without a player_controller the players are prompted as usual.
+    """
+    players, npcs = load_characters_from_dict(game_state)
+    engine = CombatEngine(players, npcs)
+    engine.max_rounds = max_rounds
+    engine.player_controller = player_controller
+    recorder = EncounterRecorder(engine, game_state, seed)
+    random.seed(seed)
+    engine.start_combat()
+    return recorder.record
+
+
+def replay_encounter(record, until_round=None, verify=True):
+    """
+    Re-runs a recorded encounter at full simulation speed and returns the engine.
+
+    With until_round the replay stops just before the first turn of that round, leaving
+    the engine ready to continue (e.g. with engine.run_combat()). With verify the state
+    hash is checked after each turn and ReplayDivergenceError is raised on a mismatch.
+    """
+    players, npcs = load_characters_from_dict(record["game_state"])
+    engine = CombatEngine(players, npcs)
+    engine.max_rounds = record.get("max_rounds")
+
+    with quiet_mode():
+        random.seed(record["seed"])
+        engine.begin_combat()
+        for turn_index, turn in enumerate(record["turns"]):
+            if until_round is not None and turn["round"] >= until_round:
+                break
+
+            character = engine.next_turn()
+            if character is None or character.name != turn["actor"]:
+                actual = character.name if character else "end of combat"
+                raise ReplayDivergenceError(turn_index, f"expected {turn['actor']} to act, got {actual}.")
+
+            if turn["action"] is None:
+                # The character could not act when recorded; the engine skips it the same way
+                engine.take_turn(character, {"type": "pass"})
+            else:
+                try:
+                    action = engine.resolve_action(character, turn["action"])
+                except ValueError as e:
+                    raise ReplayDivergenceError(turn_index, str(e))
+                engine.take_turn(character, action if action is not None else {"type": "pass"})
+
+            if verify and "hash" in turn and engine.state_hash() != turn["hash"]:
+                raise ReplayDivergenceError(turn_index, f"state hash mismatch after {turn['actor']}'s turn.")
+
+    return engine
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record or replay a deterministic encounter.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = subparsers.add_parser("record", help="Play an encounter and save its decision log.")
+    record_parser.add_argument("game_state")
+    record_parser.add_argument("--seed", type=int, default=0)
+    record_parser.add_argument("--max-rounds", type=int)
+    record_parser.add_argument("--out", default="encounter_record.json")
+
+    replay_parser = subparsers.add_parser("replay", help="Fast-forward through a recorded encounter.")
+    replay_parser.add_argument("record")
+    replay_parser.add_argument("--round", type=int, help="Stop before this round instead of replaying everything.")
+    replay_parser.add_argument("--resume", action="store_true", help="Continue interactively after the replay.")
+    replay_parser.add_argument("--no-verify", action="store_true", help="Skip the per-turn state hash check.")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        with open(args.game_state, 'r') as file:
+            game_state = json.load(file)
+        record = record_combat(game_state, args.seed, args.max_rounds)
+        with open(args.out, 'w') as file:
+            json.dump(record, file, indent=2)
+        print(f"Recorded {len(record['turns'])} turns to {args.out}")
+        return
+
+    with open(args.record, 'r') as file:
+        record = json.load(file)
+    engine = replay_encounter(record, until_round=args.round, verify=not args.no_verify)
+    log_message(f"[bold cyan]Replay reached round {engine.round_number}.[/bold cyan]")
+    for character in engine.players + engine.npcs:
+        log_message(f"{character.name}: {character.current_hp}/{character.hp} HP, effects: {sorted(character.get_active_effects())}")
+    if args.resume:
+        engine.run_combat()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""
+Save and load in-progress combats.
+
+A save file is an append-only log of checkpoints. The first record holds the full engine
+state (CombatEngine.to_dict); later records are deltas holding only what changed since
+the previous checkpoint, so autosaving every turn costs roughly the size of the change.
+Loading replays the log to the last checkpoint.
+
+Two encodings are supported:
+  - JSON lines: one JSON record per line, easy to inspect.
+  - Binary: a compact tagged encoding with per-record string interning and optional zlib
+    compression, framed by varint lengths after a magic header.
+"""
+
+import json
+import os
+import struct
+import zlib
+
+from combat_engine import CombatEngine
+
+BINARY_MAGIC = b"RCSAVE1\n"
+
+# Binary encoding tags
+_NONE, _FALSE, _TRUE, _INT, _FLOAT, _STR, _STR_REF, _LIST, _DICT = range(9)
+_RAW, _ZLIB = 0, 1
+_COMPRESS_THRESHOLD = 256  # Records smaller than this are not worth compressing
+
+
+# --- Deltas ---
+
+def make_delta(old, new):
+    """
+    Describe how to turn `old` into `new`. Dicts become {"$patch": ..., "$removed": [...]},
+    equal-length lists with few changes become {"$items": [[index, delta], ...]},
+    anything else is replaced wholesale.
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        patch = {key: make_delta(old[key], value) if key in old else value
+                 for key, value in new.items() if key not in old or old[key] != value}
+        delta = {"$patch": patch}
+        removed = [key for key in old if key not in new]
+        if removed:
+            delta["$removed"] = removed
+        return delta
+    if isinstance(old, list) and isinstance(new, list) and len(old) == len(new):
+        items = [[i, make_delta(a, b)] for i, (a, b) in enumerate(zip(old, new)) if a != b]
+        if len(items) * 2 < len(new):
+            return {"$items": items}
+    return new
+
+
+def apply_delta(old, delta):
+    """Apply a delta produced by make_delta and return the new value."""
+    if isinstance(delta, dict):
+        if "$patch" in delta:
+            result = dict(old)
+            for key, value in delta["$patch"].items():
+                result[key] = apply_delta(result[key], value) if key in result else value
+            for key in delta.get("$removed", []):
+                result.pop(key, None)
+            return result
+        if "$items" in delta:
+            result = list(old)
+            for i, value in delta["$items"]:
+                result[i] = apply_delta(result[i], value)
+            return result
+    return delta
+
+
+# --- Compact binary encoding ---
+
+def _write_varint(out, value):
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return
+
+
+def _read_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _encode(value, out, strings):
+    if value is None:
+        out.append(_NONE)
+    elif value is True:
+        out.append(_TRUE)
+    elif value is False:
+        out.append(_FALSE)
+    elif isinstance(value, int):
+        out.append(_INT)
+        _write_varint(out, (value << 1) if value >= 0 else ((-value << 1) - 1))  # Zigzag
+    elif isinstance(value, float):
+        out.append(_FLOAT)
+        out += struct.pack("<d", value)
+    elif isinstance(value, str):
+        ref = strings.get(value)
+        if ref is not None:
+            out.append(_STR_REF)
+            _write_varint(out, ref)
+        else:
+            strings[value] = len(strings)
+            encoded = value.encode()
+            out.append(_STR)
+            _write_varint(out, len(encoded))
+            out += encoded
+    elif isinstance(value, (list, tuple)):
+        out.append(_LIST)
+        _write_varint(out, len(value))
+        for item in value:
+            _encode(item, out, strings)
+    elif isinstance(value, dict):
+        out.append(_DICT)
+        _write_varint(out, len(value))
+        for key, item in value.items():
+            _encode(key, out, strings)
+            _encode(item, out, strings)
+    else:
+        raise TypeError(f"Cannot save value of type {type(value).__name__}.")
+
+
+def _decode(data, pos, strings):
+    tag = data[pos]
+    pos += 1
+    if tag == _NONE:
+        return None, pos
+    if tag == _TRUE:
+        return True, pos
+    if tag == _FALSE:
+        return False, pos
+    if tag == _INT:
+        raw, pos = _read_varint(data, pos)
+        return (raw >> 1) if not raw & 1 else -((raw + 1) >> 1), pos
+    if tag == _FLOAT:
+        return struct.unpack_from("<d", data, pos)[0], pos + 8
+    if tag == _STR:
+        length, pos = _read_varint(data, pos)
+        value = bytes(data[pos:pos + length]).decode()
+        strings.append(value)
+        return value, pos + length
+    if tag == _STR_REF:
+        ref, pos = _read_varint(data, pos)
+        return strings[ref], pos
+    if tag == _LIST:
+        length, pos = _read_varint(data, pos)
+        items = []
+        for _ in range(length):
+            item, pos = _decode(data, pos, strings)
+            items.append(item)
+        return items, pos
+    if tag == _DICT:
+        length, pos = _read_varint(data, pos)
+        result = {}
+        for _ in range(length):
+            key, pos = _decode(data, pos, strings)
+            result[key], pos = _decode(data, pos, strings)
+        return result, pos
+    raise ValueError(f"Corrupt save data: unknown tag {tag} at byte {pos - 1}.")
+
+
+def pack(value):
+    """Encode a JSON-compatible value in the compact binary format."""
+    out = bytearray()
+    _encode(value, out, {})
+    if len(out) >= _COMPRESS_THRESHOLD:
+        compressed = zlib.compress(bytes(out), 6)
+        if len(compressed) < len(out):
+            return bytes([_ZLIB]) + compressed
+    return bytes([_RAW]) + bytes(out)
+
+
+def unpack(data):
+    """Decode a value produced by pack."""
+    payload = zlib.decompress(data[1:]) if data[0] == _ZLIB else memoryview(data)[1:]
+    value, _ = _decode(payload, 0, [])
+    return value
+
+
+# --- Save files ---
+
+class CombatSaveWriter:
+    """
+    Appends checkpoints of one combat to a save file. The first checkpoint (and every
+    `full_every`-th after it) stores the full state; the others store deltas. An existing
+    save file is appended to, not overwritten: the writer's first checkpoint is a full one,
+    so the history before it stays readable.
+    """
+
+    def __init__(self, file_path, binary=False, full_every=100):
+        self.file_path = file_path
+        self.binary = binary
+        self.full_every = full_every
+        self.last_state = None
+        self.checkpoints = 0
+        if os.path.exists(file_path) and os.path.getsize(file_path):
+            with open(file_path, 'rb') as file:
+                is_binary = file.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+            if is_binary != binary:
+                raise ValueError(f"{file_path} is a {'binary' if is_binary else 'JSON lines'} save file; "
+                                 f"open it with binary={is_binary}.")
+        else:
+            with open(file_path, 'wb') as file:
+                if binary:
+                    file.write(BINARY_MAGIC)
+
+    def save(self, engine):
+        """Checkpoint the engine. Returns the number of bytes appended."""
+        state = engine.to_dict()
+        if self.last_state is None or self.checkpoints % self.full_every == 0 \
+                or len(state["players"]) != len(self.last_state["players"]) \
+                or len(state["npcs"]) != len(self.last_state["npcs"]):
+            record = {"type": "full", "state": state}
+        else:
+            record = {"type": "delta", "delta": make_delta(self.last_state, state)}
+        self.last_state = state
+        self.checkpoints += 1
+        return self._append(record)
+
+    def _append(self, record):
+        if self.binary:
+            payload = pack(record)
+            frame = bytearray()
+            _write_varint(frame, len(payload))
+            data = bytes(frame) + payload
+        else:
+            data = (json.dumps(record, separators=(",", ":")) + "\n").encode()
+        with open(self.file_path, 'ab') as file:
+            file.write(data)
+        return len(data)
+
+
+def read_save_records(file_path):
+    """Yield the raw records of a save file in either encoding."""
+    with open(file_path, 'rb') as file:
+        data = file.read()
+    if data.startswith(BINARY_MAGIC):
+        pos = len(BINARY_MAGIC)
+        while pos < len(data):
+            length, pos = _read_varint(data, pos)
+            yield unpack(data[pos:pos + length])
+            pos += length
+    else:
+        for line in data.splitlines():
+            if line.strip():
+                yield json.loads(line)
+
+
+def load_combat_state(file_path):
+    """Replay a save file's checkpoints and return the latest engine state dict."""
+    state = None
+    for record in read_save_records(file_path):
+        if record["type"] == "full":
+            state = record["state"]
+        elif state is None:
+            raise ValueError(f"{file_path} starts with a delta and has no full checkpoint.")
+        else:
+            state = apply_delta(state, record["delta"])
+    if state is None:
+        raise ValueError(f"{file_path} contains no checkpoints.")
+    return state
+
+
+def save_combat(engine, file_path, binary=False):
+    """Append a full checkpoint of the engine to a save file (creating it if needed)."""
+    return CombatSaveWriter(file_path, binary=binary).save(engine)
+
+
+def load_combat(file_path):
+    """Load the latest checkpoint of a save file as a CombatEngine ready to continue."""
+    return CombatEngine.from_dict(load_combat_state(file_path))
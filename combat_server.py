@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+Local multi-session combat server.
+
+Hosts many CombatEngine encounters inside one process and talks to clients over a
+JSON-lines protocol (one JSON object per line) on a TCP port or a Unix socket.
+
+Client requests (every request may carry an "id" which is echoed back):
+    {"op": "create", "game_state": {...}, "seed": 42, "max_rounds": 20}
+    {"op": "action", "session": "s1", "action": {"type": "attack", "weapon": "Longsword", "target": "Goblin"}}
+    {"op": "state", "session": "s1"}
+    {"op": "close", "session": "s1"}
+    {"op": "stats"}
+    {"op": "ping"}
+
+Server messages are turn events streamed as they happen, for example:
+    {"session": "s1", "event": "turn_start", "actor": "Goblin", "round": 1}
+    {"session": "s1", "event": "awaiting_action", "actor": "Hero", "options": {...}}
+    {"session": "s1", "event": "combat_end", "round": 4, "winner": "players"}
+
+A session is dropped as soon as its combat ends (or it is closed, or idle too long).
+Engine work (create, action, state and close requests, and idle eviction) runs on a single
+worker thread, one request at a time, so a long run of NPC turns does not stall other
+clients' pings, stats or reads; it is never run in parallel because every session swaps
+its dice stream in and out of the process-wide random module. That thread is also the only
+one that adds or drops sessions, so the session table and its counters need no lock.
+
+Usage:
+    python3 combat_server.py --port 8765
+    python3 combat_server.py --unix /tmp/combat.sock
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import itertools
+import json
+import random
+import time
+
+import combat_engine
+from combat_engine import CombatEngine, PlayerCharacter, load_characters_from_dict
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+ENGINE_OPS = ("create", "action", "state", "close")  # Requests handled on the engine thread
+
+
+class CombatSession:
+    """One encounter hosted by the server, advanced turn by turn as player actions arrive."""
+
+    def __init__(self, session_id, game_state, seed=None, max_rounds=None):
+        self.session_id = session_id
+        players, npcs = load_characters_from_dict(game_state)
+        self.engine = CombatEngine(players, npcs)
+        self.engine.max_rounds = max_rounds
+        self.events = []
+        self.engine.event_listeners.append(self._record_event)
+        # Each session keeps its own dice stream so interleaved sessions stay reproducible
+        self.rng_state = random.Random(seed).getstate()
+        self.pending_actor = None
+        self.finished = False
+        self.last_active = time.monotonic()
+
+    def _record_event(self, event):
+        self.events.append({"session": self.session_id, **event})
+
+    def _run(self, step):
+        """Runs one engine step with this session's dice stream and returns the events it produced."""
+        self.last_active = time.monotonic()
+        saved_state = random.getstate()
+        random.setstate(self.rng_state)
+        try:
+            step()
+        finally:
+            self.rng_state = random.getstate()
+            random.setstate(saved_state)
+        events, self.events = self.events, []
+        return events
+
+    def start(self):
+        """Rolls initiative and plays until a player needs to choose an action."""
+        def step():
+            self.engine.begin_combat()
+            self._advance()
+        return self._run(step)
+
+    def submit(self, description):
+        """Applies a player's action and plays on until the next player decision."""
+        if self.finished:
+            raise ValueError("Combat in this session has already ended.")
+        if self.pending_actor is None:
+            raise ValueError("No player is waiting to act.")
+        action = self.engine.resolve_action(self.pending_actor, description)
+
+        def step():
+            actor, self.pending_actor = self.pending_actor, None
+            self.engine.take_turn(actor, action if action is not None else {"type": "pass"})
+            self._advance()
+        return self._run(step)
+
+    def _advance(self):
+        """Plays NPC turns until a player can act or combat is over."""
+        while True:
+            character = self.engine.next_turn()
+            if character is None:
+                self.finished = True
+                return
+            if isinstance(character, PlayerCharacter) and self.engine.can_act(character):
+                self.pending_actor = character
+                self._record_event({"event": "awaiting_action", "actor": character.name,
+                                    "options": self.action_options(character)})
+                return
+            self.engine.take_turn(character)
+
+    def action_options(self, player):
+        """Lists what the waiting player may do, using the names the protocol expects."""
+        enemies = [npc.name for npc in self.engine.npcs if npc.is_alive()]
+        allies = [pc.name for pc in self.engine.players if pc.is_alive()]
+        return {
+            "weapons": [w["name"] for w in player.inventory if w.get("damage")],
+            "spells": [{"name": s["name"], "targeting": s["targeting"], "type": s["type"]}
+                       for s in (player.spells or [])],
+            "enemies": enemies,
+            "allies": allies,
+        }
+
+    def state(self):
+        """A compact view of every combatant for clients that reconnect mid-fight."""
+        return {
+            "session": self.session_id,
+            "event": "state",
+            "round": self.engine.round_number,
+            "finished": self.finished,
+            "awaiting": self.pending_actor.name if self.pending_actor else None,
+            "combatants": [
+                {"name": c.name, "side": "players" if isinstance(c, PlayerCharacter) else "npcs",
+                 "hp": c.current_hp, "max_hp": c.hp, "effects": sorted(c.get_active_effects())}
+                for c in self.engine.players + self.engine.npcs
+            ],
+        }
+
+
+class CombatServer:
+    """Accepts JSON-lines connections and routes requests to hosted sessions."""
+
+    def __init__(self, max_sessions=1000, idle_timeout=300.0, max_queued_messages=256,
+                 max_line_bytes=1 << 20, default_max_rounds=100):
+        self.sessions = {}
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_queued_messages = max_queued_messages
+        self.max_line_bytes = max_line_bytes
+        self.default_max_rounds = default_max_rounds
+        self._ids = itertools.count(1)
+        self.sessions_created = 0
+        self.sessions_completed = 0
+        self.sessions_evicted = 0
+        self.sessions_closed = 0
+        self.started_at = time.monotonic()
+        self._engine = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="combat-engine")
+
+    async def handle_connection(self, reader, writer):
+        """Reads requests line by line; replies go through a bounded outbox for backpressure."""
+        outbox = asyncio.Queue(maxsize=self.max_queued_messages)
+        sender = asyncio.create_task(self._send_messages(writer, outbox))
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (asyncio.LimitOverrunError, ValueError):
+                    await outbox.put({"event": "error", "message": "Request line too long."})
+                    break
+                except ConnectionError:
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                for message in await self.dispatch_async(line):
+                    # Blocks (and stops reading this client) while the client is slow to consume
+                    await outbox.put(message)
+        finally:
+            await outbox.put(None)
+            await sender
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _send_messages(self, writer, outbox):
+        while True:
+            message = await outbox.get()
+            if message is None:
+                return
+            try:
+                writer.write((json.dumps(message) + "\n").encode())
+                await writer.drain()
+            except ConnectionError:
+                return
+
+    def dispatch(self, line):
+        """Handles one request line and returns the list of messages to send back."""
+        request, errors = self._parse(line)
+        return errors or self._respond(request)
+
+    async def dispatch_async(self, line):
+        """dispatch() for the event loop: engine requests run on the engine thread."""
+        request, errors = self._parse(line)
+        if errors:
+            return errors
+        if request.get("op") in ENGINE_OPS:
+            return await asyncio.get_running_loop().run_in_executor(self._engine, self._respond, request)
+        return self._respond(request)
+
+    @staticmethod
+    def _parse(line):
+        """(request, None), or (None, error messages) for a line that is not a JSON object."""
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("Requests must be JSON objects.")
+        except ValueError as e:
+            return None, [{"event": "error", "message": f"Invalid request: {e}"}]
+        return request, None
+
+    def _respond(self, request):
+        request_id = request.get("id")
+        try:
+            messages = self._handle_request(request)
+        except (KeyError, ValueError, TypeError) as e:
+            messages = [{"event": "error", "message": str(e), "session": request.get("session")}]
+        except Exception as e:
+            # A bug inside the engine must not take the whole server down with it
+            messages = [{"event": "error", "message": f"Engine error: {e!r}", "session": request.get("session")}]
+        if request_id is not None:
+            for message in messages:
+                message["id"] = request_id
+        return messages
+
+    def _handle_request(self, request):
+        op = request.get("op")
+        if op == "create":
+            return self.create_session(request["game_state"], request.get("seed"),
+                                       request.get("max_rounds", self.default_max_rounds))
+        if op == "action":
+            session = self._get_session(request["session"])
+            events = session.submit(request["action"])
+            self._drop_if_finished(session)
+            return events
+        if op == "state":
+            return [self._get_session(request["session"]).state()]
+        if op == "close":
+            if self.sessions.pop(request["session"], None) is not None:
+                self.sessions_closed += 1
+            return [{"session": request["session"], "event": "closed"}]
+        if op == "stats":
+            return [self.stats()]
+        if op == "ping":
+            return [{"event": "pong"}]
+        raise ValueError(f"Unknown op {op!r}.")
+
+    def _get_session(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise ValueError(f"Unknown, finished or evicted session {session_id!r}.")
+        return session
+
+    def _drop_if_finished(self, session):
+        if session.finished:
+            self.sessions.pop(session.session_id, None)
+            self.sessions_completed += 1
+
+    def create_session(self, game_state, seed=None, max_rounds=None):
+        if len(self.sessions) >= self.max_sessions:
+            self.evict_idle_sessions()
+            if len(self.sessions) >= self.max_sessions:
+                raise ValueError("Server is at its session limit, try again later.")
+        session_id = f"s{next(self._ids)}"
+        session = CombatSession(session_id, game_state, seed, max_rounds)
+        self.sessions[session_id] = session
+        self.sessions_created += 1
+        events = [{"session": session_id, "event": "session_created"}] + session.start()
+        self._drop_if_finished(session)
+        return events
+
+    def evict_idle_sessions(self, now=None):
+        """Drops sessions nobody has touched for idle_timeout seconds."""
+        now = time.monotonic() if now is None else now
+        idle = [sid for sid, session in list(self.sessions.items())
+                if now - session.last_active > self.idle_timeout]
+        for sid in idle:
+            self.sessions.pop(sid, None)
+        self.sessions_evicted += len(idle)
+        return idle
+
+    async def evict_periodically(self, interval=None):
+        """Evicts idle sessions every `interval` seconds, on the engine thread like every other session change."""
+        interval = interval or max(1.0, self.idle_timeout / 4)
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.get_running_loop().run_in_executor(self._engine, self.evict_idle_sessions)
+
+    def stats(self):
+        return {
+            "event": "stats",
+            "active_sessions": len(self.sessions),
+            "sessions_created": self.sessions_created,
+            "sessions_completed": self.sessions_completed,
+            "sessions_evicted": self.sessions_evicted,
+            "sessions_closed": self.sessions_closed,
+            "cpu_time": time.process_time(),
+            "uptime": time.monotonic() - self.started_at,
+            "decision_cache": combat_engine.DECISION_CACHE.stats() if combat_engine.DECISION_CACHE else None,
+        }
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_path=None, ready=None):
+        if unix_path:
+            server = await asyncio.start_unix_server(self.handle_connection, path=unix_path,
+                                                     limit=self.max_line_bytes)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port,
+                                                limit=self.max_line_bytes)
+        evictor = asyncio.create_task(self.evict_periodically())
+        if ready is not None:
+            ready(server)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            evictor.cancel()
+            self._engine.shutdown(wait=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Host many combat sessions over a JSON-lines socket.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix", help="Listen on this Unix socket path instead of TCP.")
+    parser.add_argument("--max-sessions", type=int, default=1000)
+    parser.add_argument("--idle-timeout", type=float, default=300.0)
+    parser.add_argument("--max-rounds", type=int, default=100)
+    parser.add_argument("--verbose", action="store_true", help="Keep combat logging enabled.")
+    parser.add_argument("--decision-cache", type=int, default=0, metavar="ENTRIES",
+                        help="Share up to this many cached NPC decisions across sessions (0 = off).")
+    args = parser.parse_args()
+
+    combat_engine.QUIET_MODE = not args.verbose
+    if args.decision_cache:
+        combat_engine.enable_decision_cache(args.decision_cache)
+    server = CombatServer(max_sessions=args.max_sessions, idle_timeout=args.idle_timeout,
+                          default_max_rounds=args.max_rounds)
+    where = args.unix or f"{args.host}:{args.port}"
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix,
+                                 ready=lambda _: print(f"Combat server listening on {where}", flush=True)))
+    except KeyboardInterrupt:
+        print("Combat server stopped.")
+
+
+if __name__ == "__main__":
+    main()
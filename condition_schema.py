@@ -0,0 +1,100 @@
+"""
+The conditions file schema, and the field-table checker the game_state loader shares.
+
+combat_engine loads CONDITIONS_DICT through load_conditions_file at import, so a malformed
+conditions file (an unknown save attribute, a "critical_hit" that is neither "yes" nor "no")
+fails there with a GameStateError naming the field, instead of a saving throw or attack
+crashing mid-fight. This module imports nothing from the engine, so the engine can use it.
+"""
+
+import json
+
+ABILITIES = ("strength", "dexterity", "constitution", "intelligence", "wisdom", "charisma")
+NONE = type(None)
+_ABSENT = object()
+
+# Field -> accepted JSON types
+CONDITION_FIELDS = {"self_effects": (dict,), "interaction_effects": (dict,)}
+CONDITION_OPTIONAL_FIELDS = {"description": (str,), "duration": (dict,), "removal": (dict, NONE), "stacking": (dict,)}
+INTERACTION_FIELDS = {"attack_roll_against": (str,), "critical_hit": (str,)}  # Read by every attack roll
+INTERACTION_VALUES = {"attack_roll_against": ("advantage", "disadvantage", "normal"), "critical_hit": ("yes", "no")}
+REMOVAL_FIELDS = {"removable_by": (list,), "saving_throw": (dict, NONE), "spell_removal": (list,)}
+SAVE_FIELDS = {"attribute": (str,), "dc": (int, str)}
+
+
+class GameStateError(ValueError):
+    """An invalid game_state entry; `path` is the offending field, e.g. "npcs[12].spells[0]"."""
+
+    def __init__(self, path, message):
+        super().__init__(f"{path}: {message}")
+        self.path = path
+
+
+def _type_names(types):
+    return " or ".join("null" if kind is NONE else {str: "string", int: "integer", bool: "boolean", list: "array",
+                                                      dict: "object"}[kind] for kind in types)
+
+
+def compile_schema(*tables, required=()):
+    """
+    Compile field tables into one checker(data, path) that raises GameStateError at the first
+    missing or mistyped field. Types are matched exactly, as json decodes them (so a boolean
+    is not an integer), and the message is only worked out once a field fails.
+    """
+    checks = tuple((field, frozenset(types), types, field in required)
+                   for table in tables for field, types in table.items())
+
+    def check(data, path):
+        for field, accepted, types, needed in checks:
+            value = data.get(field, _ABSENT)
+            if value is _ABSENT:
+                if needed:
+                    raise GameStateError(f"{path}.{field}", "missing required field.")
+            elif type(value) not in accepted:
+                raise GameStateError(f"{path}.{field}", f"expected {_type_names(types)}, got {json.dumps(value)[:40]}.")
+    return check
+
+
+CONDITION_SCHEMA = compile_schema(CONDITION_FIELDS, CONDITION_OPTIONAL_FIELDS, required=CONDITION_FIELDS)
+INTERACTION_SCHEMA = compile_schema(INTERACTION_FIELDS, required=INTERACTION_FIELDS)
+REMOVAL_SCHEMA = compile_schema(REMOVAL_FIELDS)
+SAVE_SCHEMA = compile_schema(SAVE_FIELDS, required=SAVE_FIELDS)
+
+
+def validate_condition(data, path):
+    """Check one condition of a conditions file (see conditions/consolidated_conditions.json)."""
+    if not isinstance(data, dict):
+        raise GameStateError(path, "expected an object.")
+    CONDITION_SCHEMA(data, path)
+    interaction = data["interaction_effects"]
+    INTERACTION_SCHEMA(interaction, f"{path}.interaction_effects")
+    for field, allowed in INTERACTION_VALUES.items():
+        if interaction[field] not in allowed:
+            raise GameStateError(f"{path}.interaction_effects.{field}",
+                                 f"expected one of {', '.join(allowed)}, got {interaction[field]!r}.")
+    removal = data.get("removal") or {}
+    REMOVAL_SCHEMA(removal, f"{path}.removal")
+    if "saving_throw" in (removal.get("removable_by") or ()):
+        save = removal.get("saving_throw")
+        save_path = f"{path}.removal.saving_throw"
+        if not isinstance(save, dict):
+            raise GameStateError(save_path, "expected an object for a condition removable by saving throw.")
+        SAVE_SCHEMA(save, save_path)
+        if save["attribute"] not in ABILITIES:
+            raise GameStateError(f"{save_path}.attribute", f"expected one of {', '.join(ABILITIES)}, got {save['attribute']!r}.")
+        if isinstance(save["dc"], str) and not save["dc"].isdigit():
+            raise GameStateError(f"{save_path}.dc", f"expected an integer, got {save['dc']!r}.")
+
+
+def load_conditions_file(file_path):
+    """The {condition name: definition} of a conditions file, every condition validated."""
+    with open(file_path, "r") as file:
+        try:
+            conditions = json.load(file)
+        except json.JSONDecodeError as error:
+            raise GameStateError("$", f"invalid JSON at character {error.pos}: {error.msg}.") from None
+    if not isinstance(conditions, dict):
+        raise GameStateError("$", "expected an object.")
+    for name, data in conditions.items():
+        validate_condition(data, name)
+    return conditions
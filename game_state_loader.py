@@ -0,0 +1,307 @@
+"""
+Validated game_state, character and conditions loading, including streaming for very large rosters.
+
+load_game_state is load_characters_from_json's fast path: the file is decoded in one go,
+every entry is checked against the schema below (compiled once into a checker per section)
+and built into its character, and spells are interned as they go, so each distinct spell is
+compiled to its handler once however many characters know it. A malformed entry fails the
+load with a GameStateError naming the field, instead of a cast_spell or attack crashing
+mid-fight. load_character_file does the same for a single character file
+(players/character_*.json), and load_conditions_file (from condition_schema, which the engine
+itself loads CONDITIONS_DICT through) for a conditions file.
+
+load_game_state holds the whole file in memory. stream_characters instead reads it in
+chunks, decodes the entries of the "players" and "npcs" arrays one at a time, validates each
+and yields its character, so memory stays flat however many NPCs a generated world holds:
+
+    for section, character in stream_characters("world.json"):
+        ...
+
+The first invalid entry stops the stream with a GameStateError naming the offending field,
+e.g. "npcs[4127].spells[0]: Fire Bolt: cannot parse damage dice '2d' (...)". Monster
+templates (see monster_templates.py) must come before the "npcs" that use them; an instance
+is checked only for the fields it sets itself. Other top-level keys are decoded and skipped.
+"""
+
+import json
+
+from class_data import CLASS_DATA
+from combat_engine import PlayerCharacter, npc_class_for
+from condition_schema import (
+    ABILITIES,
+    NONE,
+    GameStateError,
+    compile_schema,
+    load_conditions_file,
+    validate_condition,
+)
+from monster_templates import MonsterTemplate, SpecInterner
+from spell_handlers import SpellDefinitionError, compile_spell
+
+CHUNK_SIZE = 1 << 16  # Characters read from the file at a time
+MAX_ENTRY_SIZE = 1 << 24  # Characters one entry may span; beyond it the JSON is taken to be broken
+SECTIONS = ("players", "npcs")
+
+# Field -> accepted JSON types; required fields first, then optional ones
+REQUIRED_FIELDS = {
+    "name": (str,), "hp": (int,), "ac": (int,), **{ability: (int,) for ability in ABILITIES},
+    "damage": (str,), "inventory": (list,), "class_type": (str,),
+}
+OPTIONAL_FIELDS = {
+    "spells": (list, NONE), "conditions": (dict, NONE), "speed": (int,), "effects": (list, dict, NONE),
+    "description": (str, NONE), "position": (list, NONE),
+}
+NPC_FIELDS = {"is_enemy": (bool,), "ai_type": (str,), "ai_config": (dict, NONE), "count": (int,)}
+ITEM_FIELDS = {"name": (str,), "type": (str,), "damage": (str, NONE), "mod": (str, NONE),
+               "reach": (int,), "range": (int, list)}
+
+
+ENTRY_SCHEMAS = {
+    ("players", True): compile_schema(REQUIRED_FIELDS, OPTIONAL_FIELDS, required=REQUIRED_FIELDS),
+    ("players", False): compile_schema(REQUIRED_FIELDS, OPTIONAL_FIELDS),
+    ("npcs", True): compile_schema(REQUIRED_FIELDS, OPTIONAL_FIELDS, NPC_FIELDS, required=REQUIRED_FIELDS),
+    ("npcs", False): compile_schema(REQUIRED_FIELDS, OPTIONAL_FIELDS, NPC_FIELDS),
+}
+ITEM_SCHEMA = compile_schema(ITEM_FIELDS, required=("name",))
+
+
+def validate_entry(data, path, section, required=True, interner=None):
+    """
+    Check one "players"/"npcs" entry against the schema; raises GameStateError at the first
+    problem. Returns the handlers its spells compiled to, through the interner if given. With
+    required=False only the fields present are checked, as for an instance overriding a template.
+    """
+    if not isinstance(data, dict):
+        raise GameStateError(path, "expected an object.")
+    ENTRY_SCHEMAS[section, required](data, path)
+    if "class_type" in data and data["class_type"].lower() not in CLASS_DATA:
+        raise GameStateError(f"{path}.class_type", f"unknown class {data['class_type']!r}.")
+    position = data.get("position")
+    if position is not None and (len(position) != 2 or not all(type(value) is int for value in position)):
+        raise GameStateError(f"{path}.position", "expected [x, y] integers.")
+    for index, item in enumerate(data.get("inventory", ())):
+        item_path = f"{path}.inventory[{index}]"
+        if not isinstance(item, dict):
+            raise GameStateError(item_path, "expected an object.")
+        ITEM_SCHEMA(item, item_path)
+    handlers = []
+    for index, spell in enumerate(data.get("spells") or ()):
+        try:
+            handlers.append(interner.compile(spell) if interner is not None else compile_spell(spell))
+        except SpellDefinitionError as error:
+            raise GameStateError(f"{path}.spells[{index}]", str(error)) from None
+    return handlers
+
+
+def build_templates(data, path, interner=None):
+    """Validate the "templates" object and build its {name: MonsterTemplate}."""
+    if not isinstance(data, dict):
+        raise GameStateError(path, "expected an object.")
+    interner = interner or SpecInterner()
+    templates = {}
+    for name, entry in data.items():
+        entry_path = f"{path}.{name}"
+        validate_entry(dict(entry, name=entry.get("name", name)) if isinstance(entry, dict) else entry,
+                       entry_path, "npcs", interner=interner)
+        try:
+            templates[name] = MonsterTemplate(name, entry, interner)
+        except (TypeError, ValueError) as error:
+            raise GameStateError(entry_path, str(error)) from None
+    return templates
+
+
+def _template_of(data, path, templates, interner):
+    """(template, the instance's own fields) of a validated NPC entry naming a template."""
+    fields = dict(data)
+    name = fields.pop("template")
+    if not isinstance(name, str):
+        raise GameStateError(f"{path}.template", f"expected string, got {json.dumps(name)[:40]}.")
+    template = templates.get(name)
+    if template is None:
+        raise GameStateError(f"{path}.template", f"unknown template {name!r}.")
+    validate_entry(fields, path, "npcs", required=False, interner=interner)
+    return template, fields
+
+
+def expand_instance(data, path, templates, interner=None):
+    """Validate an NPC entry naming a template and return the full entry it stands for."""
+    template, fields = _template_of(data, path, templates, interner)
+    entry = dict(template.data, **fields)
+    entry["spells"], entry["inventory"] = list(entry["spells"]), list(entry["inventory"])
+    return entry
+
+
+def build_instance(data, path, templates, interner=None):
+    """Validate an NPC entry naming a template and spawn it."""
+    template, fields = _template_of(data, path, templates, interner)
+    try:
+        return template.spawn(**fields)
+    except (TypeError, ValueError) as error:
+        raise GameStateError(path, str(error)) from None
+
+
+def build_character(data, path, section, templates=None, interner=None):
+    """
+    Validate an entry and build its PlayerCharacter, NonPlayerCharacter or NPCStack. With an
+    interner the character gets the shared copies of its spells.
+    """
+    if section == "npcs" and isinstance(data, dict) and "template" in data:
+        return build_instance(data, path, templates or {}, interner)
+    handlers = validate_entry(data, path, section, interner=interner)
+    if interner is not None and handlers:
+        data = dict(data, spells=[handler.spell for handler in handlers])
+    character_class = PlayerCharacter if section == "players" else npc_class_for(data)
+    try:
+        character = character_class(**data)
+    except (TypeError, ValueError) as error:
+        raise GameStateError(path, str(error)) from None
+    character.compile_spells(handlers)
+    return character
+
+
+class _ChunkReader:
+    """A sliding window over a text file for decoding one JSON value at a time."""
+
+    def __init__(self, file, chunk_size):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.offset = 0  # Characters dropped from the front of the buffer
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        if self.pos > self.chunk_size:
+            self.offset += self.pos
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+        self.buffer += chunk
+
+    def peek(self):
+        """The next non-whitespace character (consumed up to it), or "" at the end of the file."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos:self.pos + 1]
+            self._fill()
+
+    def expect(self, characters, path):
+        found = self.peek()
+        if found == "" or found not in characters:
+            raise GameStateError(path, f"invalid JSON at character {self.offset + self.pos}: expected "
+                                       f"{' or '.join(repr(c) for c in characters)}, got {found or 'end of file'!r}.")
+        self.pos += 1
+        return found
+
+    def value(self, path):
+        """Decode the next JSON value, reading more of the file until it is complete."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number could run on into the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError as error:
+                if self.eof or len(self.buffer) - self.pos > MAX_ENTRY_SIZE:
+                    raise GameStateError(path, f"invalid JSON at character {self.offset + error.pos}: {error.msg}.") from None
+            self._fill()
+
+
+def iter_entries(file, chunk_size=CHUNK_SIZE):
+    """
+    Yield (section, path, entry dict) for each "players"/"npcs" entry of an open game_state
+    file, in file order, and ("templates", "templates", templates dict) for its templates.
+    """
+    reader = _ChunkReader(file, chunk_size)
+    reader.expect("{", "$")
+    if reader.peek() == "}":
+        return
+    while True:
+        key = reader.value("$")
+        if not isinstance(key, str):
+            raise GameStateError("$", "expected a key.")
+        reader.expect(":", key)
+        if key in SECTIONS:
+            reader.expect("[", key)
+            index = 0
+            if reader.peek() == "]":
+                reader.pos += 1
+            else:
+                while True:
+                    path = f"{key}[{index}]"
+                    yield key, path, reader.value(path)
+                    index += 1
+                    if reader.expect(",]", key) == "]":
+                        break
+        elif key == "templates":
+            yield key, key, reader.value(key)
+        else:
+            reader.value(key)
+        if reader.expect(",}", "$") == "}":
+            return
+
+
+def stream_characters(file_path, chunk_size=CHUNK_SIZE):
+    """
+    Yield (section, character) for every player and NPC of a game_state file, one at a time,
+    validating each entry first. Stops at the first invalid entry with a GameStateError.
+    """
+    templates = {}
+    interner = SpecInterner()
+    with open(file_path, "r") as file:
+        for section, path, data in iter_entries(file, chunk_size):
+            if section == "templates":
+                templates = build_templates(data, path, interner)
+            else:
+                yield section, build_character(data, path, section, templates, interner)
+
+
+def load_characters_streaming(file_path, chunk_size=CHUNK_SIZE):
+    """load_characters_from_json through the streaming loader: (players, npcs), validated."""
+    players, npcs = [], []
+    for section, character in stream_characters(file_path, chunk_size):
+        (players if section == "players" else npcs).append(character)
+    return players, npcs
+
+
+def build_roster(game_state, interner=None):
+    """Validate an already-parsed game_state dict and build its (players, npcs)."""
+    if not isinstance(game_state, dict):
+        raise GameStateError("$", "expected an object.")
+    interner = interner or SpecInterner()
+    templates = build_templates(game_state["templates"], "templates", interner) if "templates" in game_state else {}
+    roster = []
+    for section in SECTIONS:
+        entries = game_state.get(section)
+        if not isinstance(entries, list):
+            raise GameStateError(section, "expected an array." if section in game_state else "missing required field.")
+        roster.append([build_character(data, f"{section}[{index}]", section, templates, interner)
+                       for index, data in enumerate(entries)])
+    return tuple(roster)
+
+
+def load_game_state(file_path):
+    """load_characters_from_json with validation: (players, npcs), or a GameStateError naming the bad field."""
+    with open(file_path, "r") as file:
+        try:
+            game_state = json.load(file)
+        except json.JSONDecodeError as error:
+            raise GameStateError("$", f"invalid JSON at character {error.pos}: {error.msg}.") from None
+    return build_roster(game_state)
+
+
+def load_character_file(file_path):
+    """A validated PlayerCharacter from a single-character file such as players/character_<name>.json."""
+    with open(file_path, "r") as file:
+        try:
+            data = json.load(file)
+        except json.JSONDecodeError as error:
+            raise GameStateError("$", f"invalid JSON at character {error.pos}: {error.msg}.") from None
+    return build_character(data, "$", "players")
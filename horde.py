@@ -0,0 +1,164 @@
+"""
+Horde mode: stacks of identical NPCs that act as one combatant.
+
+A game state NPC entry with a "count" is loaded as an NPCStack instead of a
+NonPlayerCharacter; its "hp" is each member's maximum:
+    {"name": "Goblin Horde", "count": 40, "hp": 7, "ac": 13, ...}
+
+The stack keeps one stat block, one spell list and inventory, one initiative slot and one
+AI decision per turn, plus the HP of every living member:
+  - an attack rolls every member's d20 in one batch and the damage dice of all the hits
+    in one expression,
+  - a single hit lands on the front member; save-for-half damage (area spells) is applied
+    to every member at once, each with its own saving throw,
+  - members at 0 HP drop out and the stack is defeated when none are left.
+
+Conditions, buffs and debuffs apply to the stack as a whole.
+"""
+
+import random
+from functools import lru_cache
+
+import d20
+
+from combat_engine import DICE_TERM, NonPlayerCharacter, expected_dice_value, log_message
+
+
+def roll_d20_batch(count, adv_disadv="normal"):
+    """Natural d20 results for `count` rolls, drawing from the same dice stream as d20.roll."""
+    randrange = random.randrange
+    if adv_disadv == "advantage":
+        return [max(randrange(20), randrange(20)) + 1 for _ in range(count)]
+    if adv_disadv == "disadvantage":
+        return [min(randrange(20), randrange(20)) + 1 for _ in range(count)]
+    return [randrange(20) + 1 for _ in range(count)]
+
+
+@lru_cache(maxsize=1024)
+def volley_damage_expression(weapon_damage, attack_mod, hits, crits):
+    """
+    One dice expression for the damage of `hits` normal and `crits` critical hits: every hit
+    adds the weapon dice and modifiers, a critical hit doubles the dice.
+    """
+    if expected_dice_value(weapon_damage) is None:
+        # Not a plain sum of dice and constants: repeat the expression per hit instead
+        parts = [f"({weapon_damage} + {attack_mod})"] * hits + [f"(2 * ({weapon_damage}) + {attack_mod})"] * crits
+        return " + ".join(parts)
+
+    terms = []
+    position = 0
+    while position < len(weapon_damage):
+        match = DICE_TERM.match(weapon_damage, position)
+        position = match.end()
+        sign = match.group(1) or "+"
+        if match.group(3):
+            count = int(match.group(2) or 1) * (hits + 2 * crits)
+            terms.append(f"{sign} {count}d{match.group(3)}")
+        else:
+            terms.append(f"{sign} {int(match.group(4)) * (hits + crits)}")
+    terms.append(f"{'+' if attack_mod >= 0 else '-'} {abs(attack_mod) * (hits + crits)}")
+    return " ".join(terms).lstrip("+ ")
+
+
+class NPCStack(NonPlayerCharacter):
+    """
+    `count` identical NPCs sharing one stat block, initiative slot and turn. HP is tracked
+    per living member in member_hp; current_hp and hp are the stack's totals.
+    """
+    is_stack = True
+    SNAPSHOT_ATTRIBUTES = NonPlayerCharacter.SNAPSHOT_ATTRIBUTES + ("member_hp",)
+
+    def __init__(self, *args, count=1, **kwargs):
+        super().__init__(*args, **kwargs)
+        if count < 1:
+            raise ValueError(f"{self.name}: a stack needs at least one member, got count={count}.")
+        self.count = count
+        self.member_max_hp = self.hp
+        self.member_hp = (self.hp,) * count  # Living members only, front member first
+        self.hp = self.member_max_hp * count
+        self.current_hp = self.hp
+
+    def to_dict(self):
+        data = super().to_dict()
+        data["kind"] = "stack"
+        data["hp"] = self.member_max_hp
+        data["count"] = self.count
+        return data
+
+    def load_state(self, state):
+        super().load_state(state)
+        self.member_hp = tuple(self.member_hp)
+
+    def _set_members(self, member_hp):
+        """Replace the member HP list, dropping members at 0 HP."""
+        living = tuple(hp for hp in member_hp if hp > 0)
+        fallen = len(self.member_hp) - len(living)
+        self.member_hp = living
+        self.current_hp = sum(living)
+        self.mark_changed()
+        if fallen > 0:
+            log_message(f"[bold red]{fallen} of {self.name} fall! {len(living)} remain.[/bold red]")
+
+    def take_damage(self, amount):
+        """A single hit: the front member takes it all."""
+        if self.member_hp:
+            self._set_members((self.member_hp[0] - amount,) + self.member_hp[1:])
+
+    def take_hits(self, total, hits):
+        """Spread the damage of several hits over the front members, one hit each (wrapping around)."""
+        if not self.member_hp or hits <= 0:
+            return
+        damage = [0] * len(self.member_hp)
+        share, remainder = divmod(total, hits)
+        for hit in range(hits):
+            damage[hit % len(damage)] += share + (1 if hit < remainder else 0)
+        self._set_members(tuple(hp - taken for hp, taken in zip(self.member_hp, damage)))
+
+    def heal(self, amount):
+        """Heal the most wounded member, up to its maximum."""
+        if not self.member_hp:
+            return
+        index = min(range(len(self.member_hp)), key=self.member_hp.__getitem__)
+        healed = min(self.member_hp[index] + amount, self.member_max_hp)
+        self._set_members(self.member_hp[:index] + (healed,) + self.member_hp[index + 1:])
+
+    def take_save_damage(self, save, dc, damage):
+        """
+        Area damage: every member makes its own saving throw (in one batch) and takes half
+        damage on a success. Returns True if most members failed, so a rider condition
+        lands on the stack.
+        """
+        members = len(self.member_hp)
+        if not members:
+            return False
+        modifier = self.save_bonus(save)
+        saved = [face + modifier >= dc for face in roll_d20_batch(members, self.save_advantage())]
+        half = damage // 2
+        failures = saved.count(False)
+        log_message(f"{self.name}: {members - failures} of {members} succeed on the {save} saving throw "
+                    f"(half damage: {half}), {failures} take full damage: {damage}.")
+        self._set_members(tuple(hp - (half if ok else damage) for hp, ok in zip(self.member_hp, saved)))
+        return failures * 2 > members
+
+    def volley(self, engine, target, weapon, attack_mod, weapon_damage, adv_disadv, critical_hit, target_ac=None):
+        """Every living member attacks the target: one batch of d20s, one damage roll for all hits."""
+        target_ac = target.ac if target_ac is None else target_ac
+        attackers = len(self.member_hp)
+        faces = roll_d20_batch(attackers, adv_disadv)
+        if critical_hit:
+            hits, crits = 0, attackers
+        else:
+            crits = faces.count(20)
+            hits = sum(1 for face in faces if 1 < face < 20 and face + attack_mod >= target_ac)
+        log_message(f"{self.name} ({attackers} attackers) attack {target.name} with {weapon['name']} ({adv_disadv}): "
+                    f"{hits} hits, {crits} critical hits.")
+        if not hits and not crits:
+            return
+
+        total = max(d20.roll(volley_damage_expression(weapon_damage, attack_mod, hits, crits)).total, 0)
+        if target.is_stack:
+            target.take_hits(total, hits + crits)
+        else:
+            target.take_damage(total)
+        log_message(f"[bold yellow]{self.name} deal {total} damage to {target.name}![/bold yellow]")
+        engine.check_target_status(target)
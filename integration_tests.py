@@ -426,6 +426,1779 @@ class IntegrationTester:
         if os.path.exists('test_combat_end.json'):
             os.remove('test_combat_end.json')
     
+    def test_combat_server_sessions(self):
+        """Test that the combat server hosts sessions and streams turn events."""
+        print("\n" + "="*60)
+        print("TESTING COMBAT SERVER SESSIONS")
+        print("="*60)
+        
+        output = StringIO()
+        events = []
+        with redirect_stdout(output), redirect_stderr(output):
+            try:
+                import asyncio
+                import threading
+                from combat_server import CombatServer
+                with open('game_state_test.json', 'r') as f:
+                    game_state = json.load(f)
+                
+                server = CombatServer()
+                for seed in (1, 2):
+                    messages = server.dispatch(json.dumps({"op": "create", "game_state": game_state, "seed": seed}).encode())
+                    session_id = messages[0]["session"]
+                    events.extend(messages)
+                    # Scripted player: always attack the first listed enemy with the first weapon
+                    while messages[-1]["event"] == "awaiting_action":
+                        options = messages[-1]["options"]
+                        action = {"type": "attack", "weapon": options["weapons"][0], "target": options["enemies"][0]}
+                        messages = server.dispatch(json.dumps({"op": "action", "session": session_id, "action": action}).encode())
+                        events.extend(messages)
+                
+                stats = server.stats()
+                print(f"Server stats: {stats}")
+                print(f"Finished sessions dropped: {stats['sessions_completed'] == 2 and stats['active_sessions'] == 0}")
+                
+                for seed in (3, 4):
+                    messages = server.dispatch(json.dumps({"op": "create", "game_state": game_state, "seed": seed}).encode())
+                    events.extend(messages)
+                server.dispatch(json.dumps({"op": "close", "session": "s4"}).encode())
+                server.dispatch(json.dumps({"op": "close", "session": "s4"}).encode())
+                print(f"Close counted once: {server.stats()['sessions_closed'] == 1}")
+                
+                async def ping_during_engine_work():
+                    server._engine.submit(time.sleep, 0.5)  # Stands in for a long run of NPC turns
+                    start = time.perf_counter()
+                    state = asyncio.ensure_future(server.dispatch_async(json.dumps({"op": "state", "session": "s3"}).encode()))
+                    closed = asyncio.ensure_future(server.dispatch_async(json.dumps({"op": "close", "session": "s4"}).encode()))
+                    pong = await server.dispatch_async(json.dumps({"op": "ping"}).encode())
+                    answered = time.perf_counter() - start
+                    state, closed = await state, await closed
+                    return pong, answered, state, closed, time.perf_counter() - start
+                pong, answered, state, closed, waited = asyncio.run(ping_during_engine_work())
+                print(f"Ping answered during engine work: {pong[0]['event'] == 'pong' and answered < 0.25}")
+                print(f"Engine requests wait their turn: {state[0]['event'] == 'state' and closed[0]['event'] == 'closed' and waited >= 0.5}")
+
+                async def evict_in_background():
+                    threads = []
+                    evict = server.evict_idle_sessions
+                    server.evict_idle_sessions = lambda: threads.append(threading.current_thread().name) or evict()
+                    evictor = asyncio.ensure_future(server.evict_periodically(0.01))
+                    while not threads:
+                        await asyncio.sleep(0.01)
+                    evictor.cancel()
+                    del server.evict_idle_sessions
+                    return threads
+                threads = asyncio.run(evict_in_background())
+                print(f"Periodic eviction on the engine thread: {threads[0].startswith('combat-engine')}")
+                server.idle_timeout = 0
+                print(f"Evicted sessions: {server.evict_idle_sessions()}")
+                
+            except Exception as e:
+                print(f"ERROR: {e}")
+        
+        output_text = output.getvalue()
+        event_types = {event.get("event") for event in events}
+        
+        analysis = {
+            "sessions_created": "session_created" in event_types,
+            "turn_events_streamed": "turn_start" in event_types and "turn_end" in event_types,
+            "player_input_requested": "awaiting_action" in event_types,
+            "combat_finished": "combat_end" in event_types,
+            "finished_sessions_dropped": "Finished sessions dropped: True" in output_text and "Close counted once: True" in output_text,
+            "idle_sessions_evicted": "Evicted sessions: ['s3']" in output_text,
+            "engine_off_event_loop": "Ping answered during engine work: True" in output_text and "Engine requests wait their turn: True" in output_text,
+            "eviction_on_engine_thread": "Periodic eviction on the engine thread: True" in output_text,
+            "no_errors": "ERROR" not in output_text and "error" not in event_types
+        }
+        
+        self._print_analysis("Combat Server Sessions", analysis)
+        self.test_results["combat_server"] = {"output": output_text, "analysis": analysis}
+    
+    def test_snapshot_and_restore(self):
+        """Test that restoring a snapshot replays combat identically."""
+        print("\n" + "="*60)
+        print("TESTING SNAPSHOT AND RESTORE")
+        print("="*60)
+        
+        def play_turns(engine, turns):
+            history = []
+            for _ in range(turns):
+                character = engine.next_turn()
+                if character is None:
+                    break
+                if character in engine.players:
+                    target = next(npc for npc in engine.npcs if npc.is_alive())
+                    engine.take_turn(character, {"type": "attack", "target": target, "weapon": character.inventory[0]})
+                else:
+                    engine.take_turn(character)
+                history.append([(c.name, c.current_hp, c.ac, c.adv_disadv, sorted(c.unified_effects))
+                                for c in engine.players + engine.npcs])
+            return history
+        
+        output = StringIO()
+        with redirect_stdout(output), redirect_stderr(output):
+            try:
+                players, npcs = load_characters_from_json('game_state_test.json')
+                engine = CombatEngine(players, npcs)
+                engine.begin_combat()
+                play_turns(engine, 4)
+                
+                snapshot = engine.snapshot()
+                first_branch = play_turns(engine, 20)
+                engine.restore(snapshot)
+                second_branch = play_turns(engine, 20)
+                
+                print(f"Branches identical: {first_branch == second_branch}")
+                unchanged = engine.snapshot()
+                print(f"Unchanged records shared: {all(a[1] is b[1] for a, b in zip(unchanged.characters, engine.snapshot().characters))}")
+                
+            except Exception as e:
+                print(f"ERROR: {e}")
+        
+        output_text = output.getvalue()
+        
+        analysis = {
+            "branches_identical": "Branches identical: True" in output_text,
+            "unchanged_state_shared": "Unchanged records shared: True" in output_text,
+            "no_errors": "ERROR" not in output_text and "Traceback" not in output_text
+        }
+        
+        self._print_analysis("Snapshot and Restore", analysis)
+        self.test_results["snapshot_restore"] = {"output": output_text, "analysis": analysis}
+    
+    def test_deterministic_replay(self):
+        """Test that a recorded encounter replays exactly and divergence is detected."""
+        print("\n" + "="*60)
+        print("TESTING DETERMINISTIC REPLAY")
+        print("="*60)
+        
+        def attack_first_npc(engine, player):
+            target = next(npc for npc in engine.npcs if npc.is_alive())
+            return {"type": "attack", "target": target, "weapon": player.inventory[0]}
+        
+        output = StringIO()
+        with redirect_stdout(output), redirect_stderr(output):
+            try:
+                from combat_replay import record_combat, replay_encounter, ReplayDivergenceError
+                with open('game_state_test.json', 'r') as f:
+                    game_state = json.load(f)
+                
+                record = json.loads(json.dumps(record_combat(game_state, seed=3, max_rounds=6, player_controller=attack_first_npc)))
+                engine = replay_encounter(record)
+                print(f"Replayed {len(record['turns'])} turns to round {engine.round_number}")
+                
+                engine = replay_encounter(record, until_round=3)
+                print(f"Fast-forwarded to round {engine.round_number + 1}")
+                
+                record["turns"][2]["hash"] = "tampered"
+                try:
+                    replay_encounter(record)
+                except ReplayDivergenceError as e:
+                    print(f"Divergence detected: {e}")
+                
+            except Exception as e:
+                print(f"ERROR: {e}")
+        
+        output_text = output.getvalue()
+        
+        analysis = {
+            "encounter_replayed": "Replayed" in output_text,
+            "fast_forward_reached_round": "Fast-forwarded to round 3" in output_text,
+            "divergence_detected": "Divergence detected: Replay diverged at turn 2" in output_text,
+            "no_errors": "ERROR" not in output_text and "Traceback" not in output_text
+        }
+        
+        self._print_analysis("Deterministic Replay", analysis)
+        self.test_results["deterministic_replay"] = {"output": output_text, "analysis": analysis}
+    
+    def test_save_and_load(self):
+        """Test full and delta saves of an in-progress combat in both formats."""
+        print("\n" + "="*60)
+        print("TESTING SAVE AND LOAD")
+        print("="*60)
+        
+        def attack_first_npc(engine, player):
+            target = next(npc for npc in engine.npcs if npc.is_alive())
+            return {"type": "attack", "target": target, "weapon": player.inventory[0]}
+        
+        output = StringIO()
+        with redirect_stdout(output), redirect_stderr(output):
+            try:
+                from combat_save import CombatSaveWriter, load_combat
+                players, npcs = load_characters_from_json('game_state_test.json')
+                engine = CombatEngine(players, npcs)
+                engine.player_controller = attack_first_npc
+                engine.begin_combat()
+                
+                writers = [CombatSaveWriter('test_save.jsonl'), CombatSaveWriter('test_save.bin', binary=True)]
+                sizes = {writer.file_path: [] for writer in writers}
+                for _ in range(12):
+                    character = engine.next_turn()
+                    if character is None:
+                        break
+                    engine.take_turn(character)
+                    for writer in writers:
+                        sizes[writer.file_path].append(writer.save(engine))
+                
+                for file_path, written in sizes.items():
+                    loaded = load_combat(file_path)
+                    print(f"{file_path}: full {written[0]} bytes, last delta {written[-1]} bytes")
+                    print(f"{file_path} state matches: {loaded.state_hash() == engine.state_hash()}")
+                
+                from combat_save import read_save_records
+                records = {writer.file_path: len(list(read_save_records(writer.file_path))) for writer in writers}
+                writers = [CombatSaveWriter('test_save.jsonl'), CombatSaveWriter('test_save.bin', binary=True)]
+                for writer in writers:
+                    writer.save(engine)
+                players[0].inventory.append({"name": "Rope", "type": "gear"})  # An in-place edit of a saved list
+                for writer in writers:
+                    writer.save(engine)
+                for writer in writers:
+                    resumed = list(read_save_records(writer.file_path))
+                    print(f"{writer.file_path} resumed: {len(resumed) == records[writer.file_path] + 2 and resumed[records[writer.file_path]]['type'] == 'full'}")
+                    print(f"{writer.file_path} in-place edit saved: {load_combat(writer.file_path).players[0].inventory[-1]['name'] == 'Rope'}")
+                try:
+                    CombatSaveWriter('test_save.bin')
+                    print("Encoding mismatch rejected: False")
+                except ValueError:
+                    print("Encoding mismatch rejected: True")
+                
+            except Exception as e:
+                print(f"ERROR: {e}")
+        
+        output_text = output.getvalue()
+        
+        analysis = {
+            "json_save_matches": "test_save.jsonl state matches: True" in output_text,
+            "binary_save_matches": "test_save.bin state matches: True" in output_text,
+            "delta_saves_written": "last delta" in output_text,
+            "resumed_appending": all(f"{file_path} {check}: True" in output_text for file_path in ('test_save.jsonl', 'test_save.bin')
+                                     for check in ("resumed", "in-place edit saved")),
+            "encoding_mismatch_rejected": "Encoding mismatch rejected: True" in output_text,
+            "no_errors": "ERROR" not in output_text and "Traceback" not in output_text
+        }
+        
+        self._print_analysis("Save and Load", analysis)
+        self.test_results["save_load"] = {"output": output_text, "analysis": analysis}
+        
+        # Cleanup
+        for file_path in ('test_save.jsonl', 'test_save.bin'):
+            if os.path.exists(file_path):
+                os.remove(file_path)
+    
+    def test_triage_queues(self):
+        """Test that support AI queries pick the best ally and track HP and effect changes."""
+        print("\n" + "="*60)
+        print("TESTING TRIAGE QUEUES")
+        print("="*60)
+        
+        output = StringIO()
+        with redirect_stdout(output), redirect_stderr(output):
+            try:
+                players, npcs = load_characters_from_json('game_state_test.json')
+                engine = CombatEngine(players, npcs)
+                healer = npcs[0]
+                allies = engine.roster.allies_of(healer)
+                enemies = engine.roster.enemies_of(healer)
+                
+                for ally in allies:
+                    ally.take_damage(ally.hp // 2 + 1)
+                most_wounded = list(allies)[-1]
+                most_wounded.take_damage(1)
+                print(f"Most wounded picked: {healer.find_ally_needing_healing(allies) is most_wounded}")
+                print(f"Matches linear scan: {healer.find_ally_needing_healing(allies) is healer.find_ally_needing_healing(list(allies))}")
+                
+                most_wounded.heal(most_wounded.hp)
+                print(f"Healed ally re-ranked: {healer.find_ally_needing_healing(allies) is not most_wounded}")
+                
+                most_wounded.apply_effect("Bane", "ac", -1, 2, effect_type="debuff")
+                print(f"Debuffed ally picked: {healer.find_ally_with_conditions(allies) is most_wounded}")
+                print(f"Debuffed ally still unbuffed: {healer.find_ally_needing_buffs(allies) is not None}")
+                
+                weakest = min(enemies, key=lambda e: e.current_hp)
+                print(f"Weakest enemy targeted: {healer._aggressive_ai_logic(engine.roster)['target'] is weakest}")
+                weakest.take_damage(weakest.current_hp)
+                action = healer._aggressive_ai_logic(engine.roster)
+                print(f"Dead enemy skipped: {action is None or action['target'] is not weakest}")
+                
+            except Exception as e:
+                print(f"ERROR: {e}")
+        
+        output_text = output.getvalue()
+        
+        analysis = {
+            "most_wounded_ally_picked": "Most wounded picked: True" in output_text,
+            "matches_linear_scan": "Matches linear scan: True" in output_text,
+            "heal_updates_queue": "Healed ally re-ranked: True" in output_text,
+            "debuff_updates_queue": "Debuffed ally picked: True" in output_text and "still unbuffed: True" in output_text,
+            "weakest_enemy_targeted": "Weakest enemy targeted: True" in output_text,
+            "dead_enemy_skipped": "Dead enemy skipped: True" in output_text,
+            "no_errors": "ERROR" not in output_text and "Traceback" not in output_text
+        }
+        
+        self._print_analysis("Triage Queues", analysis)
+        self.test_results["triage_queues"] = {"output": output_text, "analysis": analysis}
+    
+    def test_capability_index(self):
+        """Test the per-character spell and weapon index used by the NPC AI."""
+        print("\n" + "="*60)
+        print("TESTING CAPABILITY INDEX")
+        print("="*60)
+        
+        output = StringIO()
+        with redirect_stdout(output), redirect_stderr(output):
+            try:
+                from combat_engine import NonPlayerCharacter, expected_dice_value
+                inventory = [
+                    {"name": "Arcane Focus", "type": "magic", "damage": None},
+                    {"name": "Dagger", "type": "melee", "damage": "1d4"},
+                    {"name": "Greatsword", "type": "melee", "damage": "2d6"},
+                ]
+                spells = [
+                    {"name": "Cure Wounds", "type": "healing", "targeting": "single", "effect": None},
+                    {"name": "Shield of Faith", "type": "buff", "targeting": "single",
+                     "effect": {"attribute": "ac", "modifier": 2, "duration": 3}},
+                    {"name": "Lesser Restoration", "type": "utility", "targeting": "single",
+                     "effect": {"attribute": "condition_removal", "modifier": "remove_one", "duration": 0}},
+                ]
+                npc = NonPlayerCharacter("Cleric", 20, 14, 10, 10, 12, 10, 16, 10, "1d6",
+                                         inventory, "cleric", spells=spells, ai_type="healer")
+                index = npc.capabilities
+                print(f"Expected 3d4+3: {expected_dice_value('3d4+3')}")
+                print(f"Best weapon: {index.best_weapon['name']}")
+                print(f"Spell types indexed: {sorted(index.spells_by_type)}")
+                print(f"Removal spell: {npc.has_condition_removal_spells() and index.removal_spells[0]['name']}")
+                print(f"Index reused: {npc.capabilities is index}")
+                
+                npc.inventory.append({"name": "Maul", "type": "melee", "damage": "2d8"})
+                print(f"Rebuilt best weapon: {npc.capabilities.best_weapon['name']}")
+                
+            except Exception as e:
+                print(f"ERROR: {e}")
+        
+        output_text = output.getvalue()
+        
+        analysis = {
+            "dice_expectation": "Expected 3d4+3: 10.5" in output_text,
+            "best_weapon_ranked": "Best weapon: Greatsword" in output_text,
+            "null_effect_spells_indexed": "Spell types indexed: ['buff', 'healing', 'utility']" in output_text,
+            "removal_spells_indexed": "Removal spell: Lesser Restoration" in output_text,
+            "index_cached": "Index reused: True" in output_text,
+            "index_rebuilt_on_change": "Rebuilt best weapon: Maul" in output_text,
+            "no_errors": "ERROR" not in output_text and "Traceback" not in output_text
+        }
+        
+        self._print_analysis("Capability Index", analysis)
+        self.test_results["capability_index"] = {"output": output_text, "analysis": analysis}
+    
+    def test_tactical_ai(self):
+        """Test the expected-value tactical AI and its probability model."""
+        print("\n" + "="*60)
+        print("TESTING TACTICAL AI")
+        print("="*60)
+        
+        output = StringIO()
+        with redirect_stdout(output), redirect_stderr(output):
+            try:
+                import random
+                from combat_engine import load_characters_from_dict
+                from tactical_ai import TacticalPlanner, damage_distribution, save_success_probability, weapon_hit_probabilities
+                hit, crit = weapon_hit_probabilities(5, 15)
+                print(f"Hit chance +5 vs AC 15: {hit + crit:.2f}")
+                print(f"2d6 distribution sums to one: {abs(sum(p for _, p in damage_distribution('2d6')) - 1) < 1e-9}")
+                
+                with open('game_state_test.json', 'r') as f:
+                    game_state = json.load(f)
+                for npc in game_state["npcs"]:
+                    npc["ai_type"] = "tactical"
+                players, npcs = load_characters_from_dict(game_state)
+                engine = CombatEngine(players, npcs)
+                actor = npcs[0]
+
+                # Natural 20s and 1s decide the engine's attacks as the model assumes
+                target, weapon = players[0], actor.capabilities.best_weapon
+                ac, hp = target.ac, target.current_hp
+                random.seed(7)
+                rates = []
+                for target.ac in (40, -10):
+                    hits = 0
+                    for _ in range(2000):
+                        target.current_hp = 1000
+                        engine.attack(actor, target, weapon, "normal")
+                        hits += target.current_hp < 1000
+                    attack_mod = engine.attack_profile(actor, target, weapon, "normal")[0]
+                    rates.append(abs(hits / 2000 - sum(weapon_hit_probabilities(attack_mod, target.ac))))
+                target.ac, target.current_hp = ac, hp
+                print(f"Natural 20 hits and natural 1 misses: {max(rates) < 0.02}")
+
+                planner = TacticalPlanner(actor, engine.roster)
+                action, score = planner.best_action()
+                print(f"Tactical action chosen: {action is not None and score > 0}")
+                print(f"Score cached: {planner.score(action) == score and len(planner.cache) > 0}")
+                
+                target = players[0]
+                before = planner.score({"type": "attack", "target": target, "weapon": actor.capabilities.best_weapon})
+                target.take_damage(target.current_hp - 1)
+                after = TacticalPlanner(actor, engine.roster).score(
+                    {"type": "attack", "target": target, "weapon": actor.capabilities.best_weapon})
+                print(f"Score refreshed after damage: {after != before}")
+                nimble = next(player for player in players if player.dex_mod == 3)
+                print(f"Save chance uses ability modifier: {abs(save_success_probability(nimble, 'dexterity', 15) - 0.45) < 1e-9}")
+                bolt = {"name": "Bolt", "type": "attack", "damage": "2d6"}
+                attack_score = planner.score_spell(bolt, [nimble])
+                print(f"Spells without a save scored as attacks: {attack_score > 0 and planner.score_spell(dict(bolt, save='none'), [nimble]) == attack_score and planner.score_spell(dict(bolt, save=None), [nimble]) == attack_score}")
+                
+                actions = []
+                engine.event_listeners.append(
+                    lambda event: actions.append(event) if event["event"] == "action" and event["actor"] == actor.name else None)
+                engine.max_rounds = 5
+                engine.player_controller = lambda engine, player: {"type": "pass"}
+                engine.start_combat()
+                print(f"Tactical NPC acted: {any(event['action'] for event in actions)}")
+                
+            except Exception as e:
+                print(f"ERROR: {e}")
+        
+        output_text = output.getvalue()
+        
+        analysis = {
+            "hit_probability": "Hit chance +5 vs AC 15: 0.55" in output_text,
+            "natural_crits_and_misses": "Natural 20 hits and natural 1 misses: True" in output_text,
+            "damage_distribution": "2d6 distribution sums to one: True" in output_text,
+            "action_chosen": "Tactical action chosen: True" in output_text,
+            "scores_cached": "Score cached: True" in output_text,
+            "cache_invalidated_on_change": "Score refreshed after damage: True" in output_text,
+            "save_modifiers": "Save chance uses ability modifier: True" in output_text,
+            "no_save_spells": "Spells without a save scored as attacks: True" in output_text,
+            "tactical_npcs_fight": "Tactical NPC acted: True" in output_text,
+            "no_errors": "ERROR" not in output_text and "Traceback" not in output_text
+        }
+        
+        self._print_analysis("Tactical AI", analysis)
+        self.test_results["tactical_ai"] = {"output": output_text, "analysis": analysis}
+    
+    def test_mcts_ai(self):
+        """Test the MCTS NPC policy: budgets, transposition table reuse and side-effect free search."""
+        print("\n" + "="*60)
+        print("TESTING MCTS AI")
+        print("="*60)
+        
+        output = StringIO()
+        with redirect_stdout(output), redirect_stderr(output):
+            try:
+                import random
+                import mcts_ai
+                from combat_engine import load_characters_from_dict
+                with open('game_state_test.json', 'r') as f:
+                    game_state = json.load(f)
+                game_state["npcs"][1].update(ai_type="mcts", ai_config={"iterations": 12, "rollout_rounds": 3})
+                players, npcs = load_characters_from_dict(game_state)
+                engine = CombatEngine(players, npcs)
+                random.seed(11)
+                engine.begin_combat()
+                boss = npcs[1]
+                
+                before = (engine.state_hash(), random.getstate())
+                stats, descriptions = mcts_ai.search(engine, boss, boss.ai_config)
+                print(f"Simulations run: {sum(visits for visits, _ in stats.values())}")
+                print(f"Live combat untouched: {(engine.state_hash(), random.getstate()) == before}")
+                print(f"Transposition table kept: {len(mcts_ai._tables[boss]) > 0}")
+                
+                again, _ = mcts_ai.search(engine, boss, {"iterations": 12, "rollout_rounds": 3})
+                print(f"Statistics reused: {sum(v for v, _ in again.values()) == 24}")
+                
+                parallel, _ = mcts_ai.search(engine, boss, {"iterations": 4, "workers": 2, "rollout_rounds": 3})
+                print(f"Parallel rollouts merged: {sum(v for v, _ in parallel.values()) == 4}")
+                processes = list(mcts_ai._pool._processes.values())
+                mcts_ai.close_pool()
+                print(f"Worker pool shut down: {mcts_ai._pool is None and not any(process.is_alive() for process in processes)}")
+                
+                timed, _ = mcts_ai.search(engine, boss, {"iterations": None, "time_budget": 0.2, "rollout_rounds": 3})
+                print(f"Time budget respected: {sum(v for v, _ in timed.values()) > 0}")
+                
+                action = boss.decide_action(None, engine.roster)
+                print(f"MCTS action chosen: {action is not None and action['type'] in ('attack', 'cast_spell')}")
+                
+            except Exception as e:
+                print(f"ERROR: {e}")
+        
+        output_text = output.getvalue()
+        
+        analysis = {
+            "iteration_budget": "Simulations run: 12" in output_text,
+            "search_has_no_side_effects": "Live combat untouched: True" in output_text,
+            "transposition_table": "Transposition table kept: True" in output_text and "Statistics reused: True" in output_text,
+            "time_budget": "Time budget respected: True" in output_text,
+            "parallel_rollouts": "Parallel rollouts merged: True" in output_text and "Worker pool shut down: True" in output_text,
+            "action_chosen": "MCTS action chosen: True" in output_text,
+            "no_errors": "ERROR" not in output_text and "Traceback" not in output_text
+        }
+        
+        self._print_analysis("MCTS AI", analysis)
+        self.test_results["mcts_ai"] = {"output": output_text, "analysis": analysis}
+    
+    def test_llm_npc(self):
+        """Test LLM NPC decisions against the local mock backend: batching, caching and fallbacks."""
+        print("\n" + "="*60)
+        print("TESTING LLM NPC DECISIONS")
+        print("="*60)
+        
+        output = StringIO()
+        with redirect_stdout(output), redirect_stderr(output):
+            try:
+                import random
+                import llm_npc
+                from combat_engine import load_characters_from_dict
+                from mock_llm_server import start_mock_server
+                server = start_mock_server(latency=0.02)
+                slow_server = start_mock_server(latency=1.0)
+                with open('game_state_test.json', 'r') as f:
+                    game_state = json.load(f)
+                config = {"endpoint": server.url, "batch_window": 0.05}
+                for npc_data in game_state["npcs"]:
+                    npc_data.update(ai_type="llm", ai_config=config)
+                players, npcs = load_characters_from_dict(game_state)
+                engine = CombatEngine(players, npcs)
+                random.seed(5)
+                engine.begin_combat()
+                service = llm_npc.get_service({**llm_npc.DEFAULT_CONFIG, **config})
+                
+                action = npcs[0].decide_action(None, engine.roster)
+                print(f"LLM action chosen: {action is not None and action['type'] in ('attack', 'cast_spell')}")
+                requests = service.batcher.requests
+                npcs[0].decide_action(None, engine.roster)
+                print(f"Repeated situation served from cache: {service.cache.hits == 1 and service.batcher.requests == requests}")
+                
+                decisions = [service.build_request(npc, engine, {**llm_npc.DEFAULT_CONFIG, **config}) for npc in npcs * 2]
+                futures = [service.batcher.submit(decision) for _, decision in decisions]
+                answers = [future.result(timeout=5) for future in futures]
+                print(f"Decisions answered: {all(isinstance(answer, int) for answer in answers)}")
+                print(f"Decisions combined into one request: {service.batcher.requests == requests + 1}")
+                
+                fallbacks = service.fallbacks
+                npcs[1].ai_config = {"endpoint": slow_server.url, "deadline": 0.05}
+                action = npcs[1].decide_action(None, engine.roster)
+                slow_service = llm_npc.get_service({**llm_npc.DEFAULT_CONFIG, **npcs[1].ai_config})
+                print(f"Deadline fallback to aggressive AI: {slow_service.fallbacks == 1 and action is not None and action['type'] == 'attack'}")
+                
+                npcs[1].ai_config = {"endpoint": "http://127.0.0.1:9/v1/chat/completions"}
+                action = npcs[1].decide_action(None, engine.roster)
+                print(f"Backend failure fallback: {action is not None and action['type'] == 'attack'}")
+                print(f"Stats reported: {service.stats()['decisions'] == 2 and server.stats()['decisions'] >= 6}")
+                
+                llm_npc.close_services()
+                server.shutdown()
+                slow_server.shutdown()
+                
+            except Exception as e:
+                print(f"ERROR: {e}")
+        
+        output_text = output.getvalue()
+        
+        analysis = {
+            "action_chosen": "LLM action chosen: True" in output_text,
+            "decision_cache": "Repeated situation served from cache: True" in output_text,
+            "request_batching": "Decisions answered: True" in output_text and "Decisions combined into one request: True" in output_text,
+            "deadline_fallback": "Deadline fallback to aggressive AI: True" in output_text,
+            "backend_failure_fallback": "Backend failure fallback: True" in output_text,
+            "statistics": "Stats reported: True" in output_text,
+            "no_errors": "ERROR" not in output_text and "Traceback" not in output_text
+        }
+        
+        self._print_analysis("LLM NPC Decisions", analysis)
+        self.test_results["llm_npc"] = {"output": output_text, "analysis": analysis}
+    
+    def test_decision_cache(self):
+        """Test the shared decision cache: abstract situation keys, reuse across encounters and LRU bounds."""
+        print("\n" + "="*60)
+        print("TESTING DECISION CACHE")
+        print("="*60)
+        
+        import combat_engine
+        output = StringIO()
+        with redirect_stdout(output), redirect_stderr(output):
+            try:
+                from combat_engine import load_characters_from_dict
+                with open('game_state_test.json', 'r') as f:
+                    game_state = json.load(f)
+                for npc_data in game_state["npcs"]:
+                    npc_data["ai_type"] = "tactical"
+                
+                def encounter():
+                    players, npcs = load_characters_from_dict(game_state)
+                    return CombatEngine(players, npcs), npcs
+                
+                cache = combat_engine.enable_decision_cache(max_entries=64, hp_buckets=4)
+                first, first_npcs = encounter()
+                second, second_npcs = encounter()
+                action = first_npcs[0].decide_action(None, first.roster)
+                print(f"First decision computed: {cache.misses == 1 and cache.hits == 0}")
+                
+                reused = second_npcs[0].decide_action(None, second.roster)
+                print(f"Reused in another encounter: {cache.hits == 1 and reused['target'] in list(second.roster)}")
+                print(f"Same decision: {first.describe_action(action) == second.describe_action(reused)}")
+                
+                target = second.players[0]
+                target.take_damage(1)
+                second_npcs[0].decide_action(None, second.roster)
+                print(f"Small HP change still hits: {cache.hits == 2}")
+                target.take_damage(target.current_hp // 2)
+                second_npcs[0].decide_action(None, second.roster)
+                print(f"New HP bucket misses: {cache.misses == 2}")
+                
+                for npc in second_npcs:
+                    npc.decide_action(None, second.roster)
+                print(f"Hit rate reported: {0 < cache.stats()['hit_rate'] < 1}")
+                
+                small = combat_engine.enable_decision_cache(max_entries=2, ai_types=combat_engine.UTILITY_AI_TYPES)
+                for npc in first_npcs:
+                    npc.decide_action(None, first.roster)
+                print(f"Cache bounded: {len(small) == 2 and small.evicted == len(first_npcs) - 2}")
+                
+                combat_engine.disable_decision_cache()
+                first_npcs[0].decide_action(None, first.roster)
+                print(f"Disabled cache untouched: {small.hits + small.misses == len(first_npcs)}")
+                
+            except Exception as e:
+                print(f"ERROR: {e}")
+            finally:
+                combat_engine.disable_decision_cache()
+        
+        output_text = output.getvalue()
+        
+        analysis = {
+            "first_decision_computed": "First decision computed: True" in output_text,
+            "shared_across_encounters": "Reused in another encounter: True" in output_text and "Same decision: True" in output_text,
+            "hp_buckets": "Small HP change still hits: True" in output_text and "New HP bucket misses: True" in output_text,
+            "hit_rate": "Hit rate reported: True" in output_text,
+            "bounded": "Cache bounded: True" in output_text,
+            "disable": "Disabled cache untouched: True" in output_text,
+            "no_errors": "ERROR" not in output_text and "Traceback" not in output_text
+        }
+        
+        self._print_analysis("Decision Cache", analysis)
+        self.test_results["decision_cache"] = {"output": output_text, "analysis": analysis}
+    
+    def test_horde_stacks(self):
+        """Test NPC stacks: one initiative slot, batched attacks, per-member area damage and save/restore."""
+        print("\n" + "="*60)
+        print("TESTING HORDE STACKS")
+        print("="*60)
+        
+        output = StringIO()
+        with redirect_stdout(output), redirect_stderr(output):
+            try:
+                import random
+                from combat_engine import load_characters_from_dict
+                from horde import NPCStack
+                with open('game_state_test.json', 'r') as f:
+                    game_state = json.load(f)
+                goblin = next(npc for npc in game_state["npcs"] if npc["name"] == "Goblin Scout")
+                game_state["npcs"] = [dict(goblin, name="Goblin Horde", count=30)]
+                players, npcs = load_characters_from_dict(game_state)
+                engine = CombatEngine(players, npcs)
+                random.seed(3)
+                engine.begin_combat()
+                horde = npcs[0]
+                print(f"Stack loaded: {isinstance(horde, NPCStack) and len(horde.member_hp) == 30 and horde.current_hp == 30 * goblin['hp']}")
+                print(f"One initiative slot: {len(engine.initiative_order) == len(players) + 1}")
+                
+                target = players[0]
+                weapon = horde.capabilities.best_weapon
+                before = target.current_hp
+                engine.attack(horde, target, weapon)
+                print(f"Volley damage dealt: {target.current_hp < before}")
+                
+                horde.take_damage(5)
+                print(f"Single hit lands on one member: {horde.member_hp[0] == goblin['hp'] - 5 and horde.member_hp[1] == goblin['hp']}")
+                horde.take_damage(100)
+                print(f"Stack shrinks: {len(horde.member_hp) == 29}")
+                
+                snapshot = engine.snapshot()
+                restored = CombatEngine.from_dict(engine.to_dict())
+                print(f"Stack saved and loaded: {restored.npcs[0].member_hp == horde.member_hp and restored.state_hash() == engine.state_hash()}")
+                
+                failed = horde.take_save_damage("dexterity", 30, 2 * goblin["hp"])
+                print(f"Area damage applied to every member: {failed and not horde.is_alive()}")
+                engine.check_target_status(horde)
+                print(f"Defeated stack leaves initiative: {horde not in engine.initiative_order}")
+                
+                engine.restore(snapshot)
+                print(f"Snapshot restores members: {len(horde.member_hp) == 29 and horde.is_alive()}")
+                
+            except Exception as e:
+                print(f"ERROR: {e}")
+        
+        output_text = output.getvalue()
+        
+        analysis = {
+            "stack_loaded": "Stack loaded: True" in output_text,
+            "one_initiative_slot": "One initiative slot: True" in output_text,
+            "batched_attack": "Volley damage dealt: True" in output_text,
+            "member_hp": "Single hit lands on one member: True" in output_text and "Stack shrinks: True" in output_text,
+            "area_damage": "Area damage applied to every member: True" in output_text,
+            "defeat": "Defeated stack leaves initiative: True" in output_text,
+            "save_and_restore": "Stack saved and loaded: True" in output_text and "Snapshot restores members: True" in output_text,
+            "no_errors": "ERROR" not in output_text and "Traceback" not in output_text
+        }
+        
+        self._print_analysis("Horde Stacks", analysis)
+        self.test_results["horde_stacks"] = {"output": output_text, "analysis": analysis}
+
+    def test_battle_grid(self):
+        """Test grid positions: the spatial hash, real reach checks, moving and NPCs closing in."""
+        print("\n" + "="*60)
+        print("TESTING BATTLE GRID")
+        print("="*60)
+
+        output = StringIO()
+        with redirect_stdout(output), redirect_stderr(output):
+            try:
+                import random
+                from battle_grid import SpatialHash
+                from combat_engine import load_characters_from_dict
+
+                grid = SpatialHash(cell_squares=4)
+                for i in range(100):
+                    grid.insert(i, (i % 10 * 3, i // 10 * 3))
+                expected = sorted(i for i in range(100) if max(abs(i % 10 * 3 - 13), abs(i // 10 * 3 - 13)) <= 4)
+                print(f"Neighbourhood query: {sorted(grid.within((13, 13), 20)) == expected}")
+                print(f"Nearest query: {grid.nearest((13, 13)) == 44 and grid.nearest((13, 13), lambda i: i % 2) == 45}")
+                grid.move(44, (100, 100))
+                print(f"Incremental move: {44 not in grid.within((13, 13), 20) and grid.at((100, 100)) == [44]}")
+
+                with open('game_state_test.json', 'r') as f:
+                    game_state = json.load(f)
+                game_state["players"] = [dict(game_state["players"][0], position=[0, 0])]
+                goblin = next(npc for npc in game_state["npcs"] if npc["name"] == "Goblin Scout")
+                game_state["npcs"] = [dict(goblin, position=[6, 0])]
+                players, npcs = load_characters_from_dict(game_state)
+                engine = CombatEngine(players, npcs)
+                player, npc = players[0], npcs[0]
+                melee = next(w for w in player.inventory if w["type"] == "melee")
+                print(f"Out of reach: {not player.is_within_melee_range(npc) and not player.is_adjacent(npc) and player.distance_to(npc) == 30}")
+                print(f"Nearest enemy: {engine.nearest_enemy(player) is npc}")
+
+                before = npc.current_hp
+                random.seed(1)
+                engine.attack(player, npc, melee)
+                print(f"Melee blocked by distance: {npc.current_hp == before}")
+
+                snapshot = engine.snapshot()
+                action = npc.decide_action(None, engine.roster)
+                print(f"NPC closes in: {action is not None and action['type'] == 'move'}")
+                engine.handle_npc_turn(npc, action)
+                print(f"Moved next to target: {npc.is_adjacent(player) and engine.grid.at(npc.position) == [npc]}")
+                print(f"Now in reach: {engine.enemies_in_reach(player, melee) == [npc]}")
+
+                restored = CombatEngine.from_dict(engine.to_dict())
+                print(f"Positions saved and loaded: {restored.npcs[0].position == npc.position and restored.state_hash() == engine.state_hash()}")
+                engine.restore(snapshot)
+                print(f"Snapshot restores positions: {npc.position == (6, 0) and engine.grid.at((6, 0)) == [npc]}")
+
+            except Exception as e:
+                print(f"ERROR: {e}")
+
+        output_text = output.getvalue()
+
+        analysis = {
+            "spatial_queries": "Neighbourhood query: True" in output_text and "Nearest query: True" in output_text,
+            "incremental_move": "Incremental move: True" in output_text,
+            "reach_checks": "Out of reach: True" in output_text and "Melee blocked by distance: True" in output_text,
+            "nearest_enemy": "Nearest enemy: True" in output_text,
+            "npc_movement": "NPC closes in: True" in output_text and "Moved next to target: True" in output_text and "Now in reach: True" in output_text,
+            "save_and_restore": "Positions saved and loaded: True" in output_text and "Snapshot restores positions: True" in output_text,
+            "no_errors": "ERROR" not in output_text and "Traceback" not in output_text
+        }
+
+        self._print_analysis("Battle Grid", analysis)
+        self.test_results["battle_grid"] = {"output": output_text, "analysis": analysis}
+
+    def test_area_templates(self):
+        """Test AoE templates: shapes resolved on the grid, friendly fire, placement and cached masks."""
+        print("\n" + "="*60)
+        print("TESTING AREA TEMPLATES")
+        print("="*60)
+
+        output = StringIO()
+        with redirect_stdout(output), redirect_stderr(output):
+            try:
+                import random
+                from area_templates import area_mask
+                from combat_engine import load_characters_from_dict
+
+                with open('game_state_test.json', 'r') as f:
+                    game_state = json.load(f)
+                caster = next(pc for pc in game_state["players"] if pc["name"] == "Zaryn the Enchanter")
+                friend = next(pc for pc in game_state["players"] if pc["name"] != caster["name"])
+                goblin = next(npc for npc in game_state["npcs"] if npc["name"] == "Goblin Scout")
+                witch = next(npc for npc in game_state["npcs"] if npc["name"] == "Goblin Witch")
+                game_state["players"] = [dict(caster, position=[0, 0]), dict(friend, position=[11, 1])]
+                game_state["npcs"] = [dict(goblin, name=f"Goblin {i}", position=square)
+                                      for i, square in enumerate([[10, 0], [11, 0], [10, 1], [30, 30]])]
+                players, npcs = load_characters_from_dict(game_state)
+                engine = CombatEngine(players, npcs)
+                zaryn = players[0]
+                sleep = next(s for s in zaryn.spells if s["name"] == "Sleep")
+
+                caught = engine.area_targets(zaryn, sleep, (10, 0))
+                print(f"Sphere gathers only the cluster: {[c.name for c in caught if c in npcs] == ['Goblin 0', 'Goblin 1', 'Goblin 2']}")
+                print(f"Friendly fire: {players[1] in caught and zaryn not in caught}")
+                sheltered = dict(sleep, area={"shape": "sphere", "size": 20, "friendly_fire": False})
+                print(f"Friendly fire can be turned off: {players[1] not in engine.area_targets(zaryn, sheltered, (10, 0))}")
+
+                thunderclap = next(s for s in zaryn.spells if s["name"] == "Thunderclap")
+                zaryn.move_to((9, 0))
+                around = engine.area_targets(zaryn, thunderclap, zaryn.position)
+                print(f"Self-centred burst spares the caster: {zaryn not in around and npcs[0] in around and npcs[1] not in around}")
+                zaryn.move_to((0, 0))
+
+                cone = {"name": "Cone", "type": "damage", "targeting": "aoe", "area": {"shape": "cone", "size": 15}}
+                east = engine.place_area(zaryn, dict(cone, area={"shape": "cone", "size": 60}))
+                print(f"Cone aimed at the goblins: {east is not None and east['facing'] == 0}")
+                print(f"Out-of-range cluster ignored: {engine.place_area(zaryn, cone) is None}")
+
+                hits = area_mask.cache_info().hits
+                for _ in range(10):
+                    engine.area_targets(zaryn, sleep, (10, 0))
+                print(f"Template mask cached: {area_mask.cache_info().hits >= hits + 10}")
+
+                random.seed(5)
+                fireball = dict(thunderclap, name="Fireball", damage="8d6", area={"shape": "sphere", "size": 20})
+                placement = engine.place_area(zaryn, fireball)
+                before = [c.current_hp for c in players + npcs]
+                engine.cast_spell(zaryn, fireball)
+                burned = [c.name for c, hp in zip(players + npcs, before) if c.current_hp < hp]
+                print(f"Cast on the grid: {placement['origin'] in ((10, 0), (11, 0), (10, 1)) and sorted(burned) == sorted([players[1].name, 'Goblin 0', 'Goblin 1', 'Goblin 2'])}")
+
+                game_state["players"] = [caster]
+                game_state["npcs"] = [dict(witch), dict(goblin)]
+                players, npcs = load_characters_from_dict(game_state)
+                engine = CombatEngine(players, npcs)
+                burning_hands = next(s for s in npcs[0].spells if s["name"] == "Burning Hands")
+                print(f"Off the map NPC areas hit its enemies: {engine.aoe_targets(npcs[0], burning_hands) == players}")
+
+            except Exception as e:
+                print(f"ERROR: {e}")
+
+        output_text = output.getvalue()
+
+        analysis = {
+            "shape_resolution": "Sphere gathers only the cluster: True" in output_text and "Self-centred burst spares the caster: True" in output_text,
+            "friendly_fire": "Friendly fire: True" in output_text and "Friendly fire can be turned off: True" in output_text,
+            "placement": "Cone aimed at the goblins: True" in output_text and "Out-of-range cluster ignored: True" in output_text,
+            "cached_masks": "Template mask cached: True" in output_text,
+            "cast_on_grid": "Cast on the grid: True" in output_text,
+            "off_map_targets": "Off the map NPC areas hit its enemies: True" in output_text,
+            "no_errors": "ERROR" not in output_text and "Traceback" not in output_text
+        }
+
+        self._print_analysis("Area Templates", analysis)
+        self.test_results["area_templates"] = {"output": output_text, "analysis": analysis}
+
+    def test_line_of_sight(self):
+        """Test the battle map: cached line of sight, cover, field of view and their use in combat."""
+        print("\n" + "="*60)
+        print("TESTING LINE OF SIGHT")
+        print("="*60)
+
+        output = StringIO()
+        with redirect_stdout(output), redirect_stderr(output):
+            try:
+                import random
+                from combat_engine import load_characters_from_dict
+                from tactical_ai import TacticalPlanner
+                from visibility import BattleMap
+
+                battle_map = BattleMap(20, 20, {**{(5, y): "wall" for y in range(10)}, (12, 15): "half"})
+                print(f"Wall blocks sight: {not battle_map.line_of_sight((0, 2), (10, 2)) and not battle_map.line_of_sight((10, 2), (0, 2))}")
+                print(f"Cover behind a low wall: {battle_map.cover((0, 15), (15, 15)) == 2 and battle_map.cover((0, 16), (0, 19)) == 0}")
+                hits = battle_map.sight_cache.hits
+                for _ in range(5):
+                    battle_map.line_of_sight((0, 2), (10, 2))
+                print(f"Sight cached: {battle_map.sight_cache.hits == hits + 5}")
+                battle_map.set_obstacle((12, 15), "wall")
+                print(f"Obstacle change invalidates: {not battle_map.line_of_sight((0, 15), (15, 15))}")
+                battle_map.set_obstacle((12, 15), "half")
+                view = battle_map.field_of_view((2, 2), 6)
+                print(f"Field of view: {(2, 8) in view and (5, 2) in view and (8, 2) not in view and (6, 2) not in view}")
+
+                with open('game_state_test.json', 'r') as f:
+                    game_state = json.load(f)
+                bow = {"name": "Longbow", "type": "ranged", "damage": "1d8", "mod": "dexterity"}
+                game_state["players"] = [dict(game_state["players"][0], position=[0, 2], inventory=[bow])]
+                goblin = next(npc for npc in game_state["npcs"] if npc["name"] == "Goblin Scout")
+                game_state["npcs"] = [dict(goblin, name="Hidden Goblin", position=[7, 2], ai_type="tactical"),
+                                      dict(goblin, name="Sheltered Goblin", position=[15, 15])]
+                players, npcs = load_characters_from_dict(game_state)
+                engine = CombatEngine(players, npcs, battle_map=battle_map)
+                archer, hidden, sheltered = players[0], npcs[0], npcs[1]
+
+                random.seed(2)
+                before = hidden.current_hp
+                engine.attack(archer, hidden, bow)
+                print(f"No attack through walls: {hidden.current_hp == before and not engine.can_target(archer, hidden, bow)}")
+                archer.move_to((0, 15))
+                print(f"Cover raises AC: {engine.effective_ac(archer, sheltered) == sheltered.ac + 2 and engine.can_target(archer, sheltered, bow)}")
+                archer.move_to((0, 2))
+                attacks = [a for a in TacticalPlanner(hidden, engine.roster).legal_actions() if a["type"] == "attack"]
+                print(f"AI only targets what it sees: {attacks == []}")
+
+                restored = CombatEngine.from_dict(engine.to_dict())
+                print(f"Map saved and loaded: {restored.battle_map.obstacles == battle_map.obstacles}")
+
+            except Exception as e:
+                print(f"ERROR: {e}")
+
+        output_text = output.getvalue()
+
+        analysis = {
+            "line_of_sight": "Wall blocks sight: True" in output_text,
+            "cover": "Cover behind a low wall: True" in output_text and "Cover raises AC: True" in output_text,
+            "sight_cache": "Sight cached: True" in output_text and "Obstacle change invalidates: True" in output_text,
+            "field_of_view": "Field of view: True" in output_text,
+            "combat_uses_sight": "No attack through walls: True" in output_text and "AI only targets what it sees: True" in output_text,
+            "save_and_restore": "Map saved and loaded: True" in output_text,
+            "no_errors": "ERROR" not in output_text and "Traceback" not in output_text
+        }
+
+        self._print_analysis("Line Of Sight", analysis)
+        self.test_results["line_of_sight"] = {"output": output_text, "analysis": analysis}
+
+    def test_pathfinding(self):
+        """Test A* movement: walls, difficult terrain, occupied squares, the movement budget and path reuse."""
+        print("\n" + "="*60)
+        print("TESTING PATHFINDING")
+        print("="*60)
+
+        output = StringIO()
+        with redirect_stdout(output), redirect_stderr(output):
+            try:
+                from combat_engine import load_characters_from_dict
+                from pathfinding import find_path
+                from visibility import BattleMap
+
+                path, cost, reached = find_path((0, 0), (6, 0), lambda square: None if square[0] == 3 and square[1] < 5 else 5)
+                print(f"Path around a wall: {reached and (3, 5) in path and path[-1] == (6, 0) and cost == 50}")
+                path, cost, reached = find_path((0, 0), (4, 0), lambda square: 10 if square[0] in (1, 2, 3) else 5)
+                print(f"Difficult terrain costs double: {reached and cost == 35}")
+                path, cost, reached = find_path((0, 0), (5, 0), lambda square: None if square == (5, 0) or max(map(abs, square)) > 8 else 5)
+                print(f"Unreachable goal gets closest: {not reached and path[-1] in ((4, -1), (4, 0), (4, 1))}")
+
+                walls = {(4, y): "wall" for y in range(0, 8)}
+                battle_map = BattleMap(12, 12, {**walls, (2, 9): "difficult"})
+                with open('game_state_test.json', 'r') as f:
+                    game_state = json.load(f)
+                fighter = dict(game_state["players"][0], position=[1, 1])
+                goblin = next(npc for npc in game_state["npcs"] if npc["name"] == "Goblin Scout")
+                game_state["players"] = [fighter, dict(game_state["players"][1], position=[3, 8])]
+                game_state["npcs"] = [dict(goblin, name="Goblin A", position=[7, 1]),
+                                      dict(goblin, name="Goblin B", position=[5, 9])]
+                players, npcs = load_characters_from_dict(game_state)
+                engine = CombatEngine(players, npcs, battle_map=battle_map)
+                hero, friend = players
+
+                path, cost, reached = engine.find_path(hero, (7, 1))
+                print(f"Engine path ends next to the target: {reached and max(abs(path[-1][0] - 7), abs(path[-1][1] - 1)) == 1}")
+                print(f"Walls and enemies avoided: {not any(square in walls or square == (5, 9) for square in path)}")
+                hits = engine.path_cache.hits
+                engine.find_path(hero, (7, 1))
+                print(f"Path reused while nothing moves: {engine.path_cache.hits == hits + 1}")
+
+                moved = engine.move_character(hero, (7, 1))
+                print(f"Movement budget respected: {0 < moved <= hero.movement and engine.grid.at(hero.position) == [hero]}")
+                print(f"Cache forgets after a move: {engine.find_path(friend, (7, 1)) is not None and engine.path_cache.misses >= 2}")
+
+                hero.movement = 0
+                start = hero.position
+                print(f"Restrained creatures stay put: {engine.move_character(hero, (7, 1)) == 0 and hero.position == start}")
+
+                action = npcs[0].decide_action(None, engine.roster)
+                engine.handle_npc_turn(npcs[0], action)
+                print(f"NPC walks around the wall: {action['type'] == 'move' and npcs[0].position != (7, 1) and npcs[0].position not in walls}")
+
+            except Exception as e:
+                print(f"ERROR: {e}")
+
+        output_text = output.getvalue()
+
+        analysis = {
+            "a_star": "Path around a wall: True" in output_text and "Difficult terrain costs double: True" in output_text,
+            "unreachable": "Unreachable goal gets closest: True" in output_text,
+            "engine_paths": "Engine path ends next to the target: True" in output_text and "Walls and enemies avoided: True" in output_text,
+            "path_cache": "Path reused while nothing moves: True" in output_text and "Cache forgets after a move: True" in output_text,
+            "movement_budget": "Movement budget respected: True" in output_text and "Restrained creatures stay put: True" in output_text,
+            "npc_movement": "NPC walks around the wall: True" in output_text,
+            "no_errors": "ERROR" not in output_text and "Traceback" not in output_text
+        }
+
+        self._print_analysis("Pathfinding", analysis)
+        self.test_results["pathfinding"] = {"output": output_text, "analysis": analysis}
+
+    def test_flow_fields(self):
+        """Test shared flow fields: one search per target group, incremental updates and horde movement."""
+        print("\n" + "="*60)
+        print("TESTING FLOW FIELDS")
+        print("="*60)
+
+        output = StringIO()
+        with redirect_stdout(output), redirect_stderr(output):
+            try:
+                from combat_engine import load_characters_from_dict
+                from pathfinding import FlowField
+                from visibility import BattleMap
+
+                def terrain(square):
+                    return None if square[0] == 5 and square[1] < 8 else 5
+
+                def goals_around(squares):
+                    return {(x + dx, y + dy) for x, y in squares for dx in (-1, 0, 1) for dy in (-1, 0, 1)}
+
+                field = FlowField(terrain, (0, 0, 19, 19))
+                field.update(goals_around([(9, 2)]), [(9, 2)])
+                steps = field.walk((1, 2), 1000)
+                print(f"Field leads around the wall: {steps[-1][0] in goals_around([(9, 2)]) and any(y >= 8 for (x, y), _ in steps)}")
+                print(f"Walk cost matches the distance: {steps[-1][1] == field.distance[(1, 2)]}")
+
+                # A second target arrives, then steps aside: only its side of the field is searched again
+                field.update(goals_around([(9, 2), (15, 15)]), [(9, 2), (15, 15)])
+                field.update(goals_around([(9, 2), (16, 15)]), [(9, 2), (16, 15)])
+                rebuilt = FlowField(terrain, (0, 0, 19, 19))
+                rebuilt.update(goals_around([(9, 2), (16, 15)]), [(9, 2), (16, 15)])
+                print(f"Incremental update matches a rebuild: {field.distance == rebuilt.distance}")
+                print(f"Incremental update searches less: {field.settled < rebuilt.settled}")
+
+                with open('game_state_test.json', 'r') as f:
+                    game_state = json.load(f)
+                goblin = next(npc for npc in game_state["npcs"] if npc["name"] == "Goblin Scout")
+                game_state["players"] = [dict(game_state["players"][0], position=[10, 2])]
+                game_state["npcs"] = [dict(goblin, name=f"Goblin {i}", position=[i % 6, 12 + i // 6]) for i in range(30)]
+                players, npcs = load_characters_from_dict(game_state)
+                engine = CombatEngine(players, npcs, battle_map=BattleMap(20, 20, {(x, 8): "wall" for x in range(2, 20)}))
+
+                shared = engine.flow_field("party")
+                actions = [npc.decide_action(None, engine.roster) for npc in npcs]
+                print(f"NPCs approach by the flow field: {all(action['type'] == 'move' and action.get('approach') for action in actions)}")
+                for npc, action in zip(npcs, actions):
+                    engine.handle_npc_turn(npc, action)
+                print(f"One field for the whole horde: {engine.flow_field('party') is shared and shared.settled > 0}")
+                squares = [npc.position for npc in npcs]
+                print(f"Horde moved without stacking: {len(set(squares)) == len(squares) and sum(y < 12 for x, y in squares) > 10}")
+                print(f"Horde kept out of walls: {not any(y == 8 and x >= 2 for x, y in squares)}")
+
+                description = engine.describe_action(actions[0])
+                print(f"Approach survives describe/resolve: {engine.resolve_action(npcs[0], description).get('approach') is True}")
+
+            except Exception as e:
+                print(f"ERROR: {e}")
+
+        output_text = output.getvalue()
+
+        analysis = {
+            "field_paths": "Field leads around the wall: True" in output_text and "Walk cost matches the distance: True" in output_text,
+            "incremental": "Incremental update matches a rebuild: True" in output_text and "Incremental update searches less: True" in output_text,
+            "npc_approach": "NPCs approach by the flow field: True" in output_text and "Approach survives describe/resolve: True" in output_text,
+            "shared_field": "One field for the whole horde: True" in output_text,
+            "horde_movement": "Horde moved without stacking: True" in output_text and "Horde kept out of walls: True" in output_text,
+            "no_errors": "ERROR" not in output_text and "Traceback" not in output_text
+        }
+
+        self._print_analysis("Flow Fields", analysis)
+        self.test_results["flow_fields"] = {"output": output_text, "analysis": analysis}
+
+    def test_spell_handlers(self):
+        """Test spells compiled to handlers at load time and dispatched by cast_spell."""
+        print("\n" + "="*60)
+        print("TESTING SPELL HANDLERS")
+        print("="*60)
+
+        output = StringIO()
+        with redirect_stdout(output), redirect_stderr(output):
+            try:
+                import copy
+                from combat_engine import load_characters_from_dict
+                from spell_handlers import AttackSpell, SpellDefinitionError, compile_spell
+
+                with open('game_state_test.json', 'r') as f:
+                    game_state = json.load(f)
+                players, npcs = load_characters_from_dict(copy.deepcopy(game_state))
+                zaryn, emolas = players[0], players[1]
+                witch = next(npc for npc in npcs if npc.name == "Goblin Witch")
+                spells = {spell["name"]: spell for character in players + npcs for spell in character.spells}
+                kinds = {spell["name"]: type(character.spell_handler(spell)).__name__
+                         for character in players + npcs for spell in character.spells}
+                print(f"Spells compiled by kind: {kinds['Magic Missile'] == 'AttackSpell' and kinds['Burning Hands'] == 'SaveDamageSpell' and kinds['Cure Wounds'] == 'HealingSpell' and kinds['Hold Person'] == 'ConditionSpell' and kinds['Hex'] == 'EffectSpell'}")
+                handler = witch.spell_handler(spells["Burning Hands"])
+                print(f"Handlers compiled once: {witch.spell_handler(spells['Burning Hands']) is handler and handler.save == 'dexterity' and handler.dc == 13}")
+
+                broken = copy.deepcopy(game_state)
+                broken["npcs"][-1]["spells"][0]["damage"] = "3d4+oops"
+                try:
+                    load_characters_from_dict(broken)
+                    print("Bad dice rejected at load: False")
+                except SpellDefinitionError as error:
+                    print(f"Bad dice rejected at load: {'Goblin Witch' in str(error) and 'Magic Missile' in str(error)}")
+                for bad in ({"name": "Odd", "type": "teleport", "targeting": "single"},
+                            {"name": "Odd", "type": "utility", "targeting": "single", "save": "wisdom", "effect": {"modifier": "charmed"}},
+                            {"name": "Odd", "type": "debuff", "targeting": "single", "effect": {"modifier": "disadvantage"}},
+                            {"name": "Odd", "type": "damage", "targeting": "aoe", "damage": "1d6", "area": {"shape": "blob"}}):
+                    try:
+                        compile_spell(bad)
+                        print(f"Malformed spell rejected: False ({bad})")
+                    except SpellDefinitionError:
+                        pass
+                print("Malformed spells checked")
+
+                engine = CombatEngine(players, npcs)
+                goblin = next(npc for npc in npcs if npc.name == "Goblin Scout")
+                engine.cast_spell(zaryn, spells["Sleep"], [goblin])
+                print(f"Null save means no save: {goblin.has_effect('unconscious')}")
+                witch.current_hp = 1
+                engine.cast_spell(witch, spells["Cure Wounds"])
+                print(f"Healing dispatched: {witch.current_hp > 1}")
+                engine.cast_spell(emolas, spells["Curse of Misfortune"], [goblin])
+                print(f"Debuff dispatched: {goblin.has_effect('Curse of Misfortune')}")
+                custom = {"name": "Frost Ray", "type": "damage", "targeting": "single", "damage": "2d8"}
+                engine.cast_spell(zaryn, custom, [goblin])
+                print(f"Ad hoc spell compiled on first cast: {isinstance(zaryn.spell_handler(custom), AttackSpell)}")
+
+            except Exception as e:
+                print(f"ERROR: {e}")
+
+        output_text = output.getvalue()
+
+        analysis = {
+            "compiled_by_kind": "Spells compiled by kind: True" in output_text,
+            "compiled_once": "Handlers compiled once: True" in output_text,
+            "load_time_errors": "Bad dice rejected at load: True" in output_text and "Malformed spell rejected: False" not in output_text and "Malformed spells checked" in output_text,
+            "dispatch": "Null save means no save: True" in output_text and "Healing dispatched: True" in output_text and "Debuff dispatched: True" in output_text,
+            "ad_hoc_spells": "Ad hoc spell compiled on first cast: True" in output_text,
+            "no_errors": "ERROR" not in output_text and "Traceback" not in output_text
+        }
+
+        self._print_analysis("Spell Handlers", analysis)
+        self.test_results["spell_handlers"] = {"output": output_text, "analysis": analysis}
+
+    def test_batched_aoe(self):
+        """Test area spells resolving a crowd in one batch: saves, damage, conditions and defeats."""
+        print("\n" + "="*60)
+        print("TESTING BATCHED AOE")
+        print("="*60)
+
+        output = StringIO()
+        with redirect_stdout(output), redirect_stderr(output):
+            try:
+                import random
+                import spell_handlers
+                from combat_engine import load_characters_from_dict, quiet_mode
+                from spell_handlers import BATCH_TARGETS, roll_saves
+
+                with open('game_state_test.json', 'r') as f:
+                    game_state = json.load(f)
+                goblin = next(npc for npc in game_state["npcs"] if npc["name"] == "Goblin Scout")
+
+                def crowd(hp):
+                    state = {"players": game_state["players"][:1],
+                             "npcs": [dict(goblin, name=f"Goblin {i}", hp=hp) for i in range(20)]}
+                    players, npcs = load_characters_from_dict(state)
+                    engine = CombatEngine(players, npcs)
+                    engine.initiative_order = players + npcs
+                    return engine, players[0], npcs
+
+                engine, caster, goblins = crowd(40)
+                random.seed(7)
+                batch = roll_saves(goblins, "dexterity", 13)
+                random.seed(7)
+                with quiet_mode():
+                    single = [g.saving_throw(g, "dexterity", 13) for g in goblins]
+                print(f"Batched saves match single saves: {batch == single}")
+
+                fireball = {"name": "Fireball", "type": "damage", "targeting": "aoe", "damage": "8d6",
+                            "save": "dexterity", "dc": 13}
+                random.seed(11)
+                engine.cast_spell(caster, fireball, goblins)
+                batched_hp = [g.current_hp for g in goblins]
+                engine, caster, goblins = crowd(40)
+                threshold = spell_handlers.BATCH_TARGETS
+                spell_handlers.BATCH_TARGETS = 1000
+                try:
+                    random.seed(11)
+                    engine.cast_spell(caster, fireball, goblins)
+                finally:
+                    spell_handlers.BATCH_TARGETS = threshold
+                print(f"Batch matches one-by-one resolution: {batched_hp == [g.current_hp for g in goblins]}")
+                print(f"Half or full damage: {len(set(40 - hp for hp in batched_hp)) == 2}")
+
+                engine, caster, goblins = crowd(8)
+                events = []
+                engine.event_listeners.append(events.append)
+                thunder = dict(fireball, name="Thunderwave", damage="10", save="constitution",
+                               effect={"attribute": "position", "modifier": "prone", "duration": 1})
+                engine.cast_spell(caster, thunder, goblins)
+                prone = [g for g in goblins if g.has_effect("prone")]
+                print(f"Conditions only on failures: {0 < len(prone) < 20 and all(not g.is_alive() for g in prone)}")
+                print(f"Defeated leave initiative: {0 < len(engine.initiative_order) - 1 < 20 and engine.initiative_order == [caster] + [g for g in goblins if g.is_alive()]}")
+                print(f"One status event per creature: {sum(e['event'] == 'target_status' for e in events) == 20}")
+
+                def seven_and_eight(spell):
+                    """Outcomes for the first 7 goblins when the spell catches 7 (one by one) and 8 (batched)."""
+                    outcomes = []
+                    for caught in (BATCH_TARGETS - 1, BATCH_TARGETS):
+                        engine, caster, goblins = crowd(40)
+                        with quiet_mode():
+                            for g in goblins[::2]:
+                                g.apply_condition_with_effects("poisoned", 3)
+                        random.seed(21)
+                        engine.cast_spell(caster, spell, goblins[:caught])
+                        outcomes.append([(g.current_hp, g.has_effect("poisoned")) for g in goblins[:BATCH_TARGETS - 1]])
+                    return outcomes
+                cloud = {"name": "Stinking Cloud", "type": "condition", "targeting": "aoe", "save": "constitution", "dc": 12,
+                         "effect": {"modifier": "poisoned", "duration": 2}}
+                venom = dict(fireball, name="Venom Burst", damage="4d6", save="constitution", dc=12,
+                             effect={"modifier": "poisoned", "duration": 2})
+                seven, eight = seven_and_eight(cloud)
+                stripped = sum(1 for i, (_, poisoned) in enumerate(seven) if i % 2 == 0 and not poisoned)
+                print(f"Same resolution at 7 and 8 targets: {seven == eight and seven_and_eight(venom)[0] == seven_and_eight(venom)[1]}")
+                print(f"Successful saves strip the condition in batches: {stripped > 0}")
+
+                engine, caster, goblins = crowd(40)
+                with quiet_mode():
+                    goblins[0].apply_condition_with_effects("poisoned", 3)
+                dc = 11 + goblins[1].save_bonus("constitution")
+                poisoned_rate = sum(roll_saves([goblins[0]] * 2000, "constitution", dc)) / 2000
+                healthy_rate = sum(roll_saves([goblins[1]] * 2000, "constitution", dc)) / 2000
+                print(f"Batched saves use each creature's advantage state: {goblins[0].save_advantage() == 'disadvantage' and poisoned_rate < 0.35 < 0.4 < healthy_rate}")
+
+            except Exception as e:
+                print(f"ERROR: {e}")
+
+        output_text = output.getvalue()
+
+        analysis = {
+            "batched_saves": "Batched saves match single saves: True" in output_text,
+            "same_results": "Batch matches one-by-one resolution: True" in output_text and "Half or full damage: True" in output_text,
+            "batched_conditions": "Conditions only on failures: True" in output_text,
+            "same_rules_as_single_targets": all(f"{check}: True" in output_text for check in ("Same resolution at 7 and 8 targets", "Successful saves strip the condition in batches", "Batched saves use each creature's advantage state")),
+            "batched_status": "Defeated leave initiative: True" in output_text and "One status event per creature: True" in output_text,
+            "no_errors": "ERROR" not in output_text and "Traceback" not in output_text
+        }
+
+        self._print_analysis("Batched AoE", analysis)
+        self.test_results["batched_aoe"] = {"output": output_text, "analysis": analysis}
+
+    def test_streaming_loader(self):
+        """Test the streaming game_state loader: chunked parsing, schema errors with paths and flat memory."""
+        print("\n" + "="*60)
+        print("TESTING STREAMING LOADER")
+        print("="*60)
+
+        output = StringIO()
+        with redirect_stdout(output), redirect_stderr(output):
+            try:
+                import copy
+                import tracemalloc
+                from game_state_loader import GameStateError, load_characters_streaming, stream_characters
+
+                with open('game_state_test.json', 'r') as f:
+                    game_state = json.load(f)
+                players, npcs = load_characters_streaming('game_state_test.json', chunk_size=16)
+                expected_players, expected_npcs = load_characters_from_json('game_state_test.json')
+                print(f"Streamed roster matches json.load: {[c.name for c in players + npcs] == [c.name for c in expected_players + expected_npcs]}")
+                print(f"Spells compiled while streaming: {players[0].spell_handler(players[0].spells[0]).spell is players[0].spells[0]}")
+
+                def stream_error(state, chunk_size=64):
+                    with open('test_streaming_state.json', 'w') as f:
+                        f.write(state if isinstance(state, str) else json.dumps(state))
+                    streamed = []
+                    try:
+                        for section, character in stream_characters('test_streaming_state.json', chunk_size):
+                            streamed.append(character.name)
+                    except GameStateError as error:
+                        return error.path, streamed
+                    return None, streamed
+
+                broken = copy.deepcopy(game_state)
+                broken["npcs"][3]["spells"] = [{"name": "Fizzle", "type": "damage", "targeting": "single", "damage": "2d"}]
+                path, streamed = stream_error(broken)
+                print(f"Bad spell path: {path == 'npcs[3].spells[0]' and len(streamed) == len(game_state['players']) + 3}")
+                broken = copy.deepcopy(game_state)
+                del broken["players"][1]["hp"]
+                broken["npcs"][0]["ac"] = True
+                print(f"Missing field path: {stream_error(broken)[0] == 'players[1].hp'}")
+                broken["players"][1]["hp"] = 10
+                print(f"Wrong type path: {stream_error(broken)[0] == 'npcs[0].ac'}")
+                text = json.dumps({"meta": {"seed": 3}, "players": game_state["players"], "npcs": game_state["npcs"]})
+                print(f"Other keys skipped: {stream_error(text)[0] is None}")
+                cut = text[:text.index('"Goblin Scout"') + 40]
+                path, streamed = stream_error(cut)
+                scout = [npc["name"] for npc in game_state["npcs"]].index("Goblin Scout")
+                print(f"Truncated file path: {path == f'npcs[{scout}]' and len(streamed) == len(game_state['players']) + scout}")
+
+                goblin = next(npc for npc in game_state["npcs"] if npc["name"] == "Goblin Scout")
+                world = {"players": game_state["players"], "npcs": [dict(goblin, name=f"Goblin {i}") for i in range(3000)]}
+                with open('test_streaming_state.json', 'w') as f:
+                    json.dump(world, f)
+                tracemalloc.start()
+                count = sum(1 for _ in stream_characters('test_streaming_state.json'))
+                streaming_peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.reset_peak()
+                with open('test_streaming_state.json', 'r') as f:
+                    parsed = json.load(f)
+                json_peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                del parsed
+                print(f"Memory stays flat: {count == 3000 + len(game_state['players']) and streaming_peak * 10 < json_peak}")
+
+            except Exception as e:
+                print(f"ERROR: {e}")
+
+        output_text = output.getvalue()
+
+        analysis = {
+            "streamed_roster": "Streamed roster matches json.load: True" in output_text and "Spells compiled while streaming: True" in output_text,
+            "error_paths": all(f"{check}: True" in output_text for check in ("Bad spell path", "Missing field path", "Wrong type path", "Truncated file path")),
+            "other_keys_skipped": "Other keys skipped: True" in output_text,
+            "flat_memory": "Memory stays flat: True" in output_text,
+            "no_errors": "ERROR" not in output_text and "Traceback" not in output_text
+        }
+
+        self._print_analysis("Streaming Loader", analysis)
+        self.test_results["streaming_loader"] = {"output": output_text, "analysis": analysis}
+
+        if os.path.exists('test_streaming_state.json'):
+            os.remove('test_streaming_state.json')
+
+    def test_monster_templates(self):
+        """Test monster templates: shared spells and inventory, per-instance state, memory and spawn speed."""
+        print("\n" + "="*60)
+        print("TESTING MONSTER TEMPLATES")
+        print("="*60)
+
+        output = StringIO()
+        with redirect_stdout(output), redirect_stderr(output):
+            try:
+                import tracemalloc
+                from combat_engine import load_characters_from_dict, npc_class_for
+                from game_state_loader import GameStateError, load_characters_streaming
+                from monster_templates import load_templates
+
+                with open('game_state_test.json', 'r') as f:
+                    game_state = json.load(f)
+                caster = next(npc for npc in game_state["npcs"] if npc.get("spells") and "count" not in npc)
+                template = {key: value for key, value in caster.items() if key != "name"}
+                world = {
+                    "players": game_state["players"],
+                    "templates": {"Caster": template},
+                    "npcs": [{"template": "Caster", "name": f"Caster {i}", "position": [i, 0]} for i in range(300)],
+                }
+                players, npcs = load_characters_from_dict(world)
+                first, second = npcs[0], npcs[1]
+                print(f"Spells and inventory shared: {first.spells is second.spells and first.inventory is second.inventory and first.template == 'Caster'}")
+                print(f"Spells compiled once: {first.spell_handler(first.spells[0]) is second.spell_handler(second.spells[0])}")
+
+                first.take_damage(3)
+                first.position = (40, 40)
+                first.apply_condition_with_effects("poisoned", 2)
+                print(f"Instance state independent: {second.current_hp == second.hp and first.current_hp == first.hp - 3 and second.position == (1, 0) and not second.conditions and bool(first.conditions)}")
+
+                engine = CombatEngine(players, npcs[:4])
+                print(f"Templated NPCs fight: {engine.npcs[2] is npcs[2] and engine.grid.at((2, 0)) is not None}")
+
+                full = {"players": [], "npcs": [dict(caster, name=f"Caster {i}", position=[i, 0]) for i in range(300)]}
+                templated = {"players": [], "templates": world["templates"], "npcs": world["npcs"]}
+                for state in (full, templated):
+                    tracemalloc.start()
+                    roster = load_characters_from_dict(json.loads(json.dumps(state)))
+                    state["memory"] = tracemalloc.get_traced_memory()[0]
+                    tracemalloc.stop()
+                    del roster
+                print(f"Templates cut memory: {templated['memory'] * 2 < full['memory']}")
+
+                templates = load_templates({"Caster": template})
+                start = time.perf_counter()
+                for i in range(2000):
+                    templates["Caster"].spawn(name=f"Caster {i}", position=(i, 1))
+                spawn_time = time.perf_counter() - start
+                start = time.perf_counter()
+                for i in range(2000):
+                    npc_class_for(caster)(**dict(caster, name=f"Caster {i}")).compile_spells()
+                build_time = time.perf_counter() - start
+                print(f"Spawning is cheap: {spawn_time * 3 < build_time}")
+
+                tough = templates["Caster"].spawn(name="Tough Caster", hp=50, ac=18)
+                print(f"Full overrides: {tough.ac == 18 and tough.current_hp == 50 and tough.spells is templates['Caster'].prototype.spells}")
+
+                try:
+                    load_characters_from_dict({"players": [], "npcs": [{"template": "Dragon", "name": "Smaug"}]})
+                    print("Unknown template rejected: False")
+                except ValueError:
+                    print("Unknown template rejected: True")
+
+                with open('test_templates_state.json', 'w') as f:
+                    json.dump(dict(world, npcs=world["npcs"][:5] + [{"template": "Caster", "ac": "high"}]), f)
+                try:
+                    load_characters_streaming('test_templates_state.json')
+                    print("Streamed instance validated: False")
+                except GameStateError as error:
+                    print(f"Streamed instance validated: {error.path == 'npcs[5].ac'}")
+
+            except Exception as e:
+                print(f"ERROR: {e}")
+
+        output_text = output.getvalue()
+
+        analysis = {
+            "shared_data": "Spells and inventory shared: True" in output_text and "Spells compiled once: True" in output_text,
+            "independent_state": "Instance state independent: True" in output_text and "Templated NPCs fight: True" in output_text,
+            "memory_cut": "Templates cut memory: True" in output_text,
+            "cheap_spawning": "Spawning is cheap: True" in output_text,
+            "overrides": "Full overrides: True" in output_text,
+            "validation": "Unknown template rejected: True" in output_text and "Streamed instance validated: True" in output_text,
+            "no_errors": "ERROR" not in output_text and "Traceback" not in output_text
+        }
+
+        self._print_analysis("Monster Templates", analysis)
+        self.test_results["monster_templates"] = {"output": output_text, "analysis": analysis}
+
+        if os.path.exists('test_templates_state.json'):
+            os.remove('test_templates_state.json')
+
+    def test_fast_loader(self):
+        """Test validated loading of game_state, character and conditions files through the fast path."""
+        print("\n" + "="*60)
+        print("TESTING FAST LOADER")
+        print("="*60)
+
+        output = StringIO()
+        with redirect_stdout(output), redirect_stderr(output):
+            try:
+                import copy
+                from combat_engine import CONDITIONS_DICT, load_characters_from_dict, load_conditions
+                from game_state_loader import GameStateError, load_character_file, load_conditions_file, load_game_state
+
+                with open('game_state_test.json', 'r') as f:
+                    game_state = json.load(f)
+                players, npcs = load_characters_from_json('game_state_test.json')
+                expected_players, expected_npcs = load_characters_from_dict(copy.deepcopy(game_state))
+                print(f"Validated roster matches: {[c.to_dict() for c in players + npcs] == [c.to_dict() for c in expected_players + expected_npcs]}")
+
+                world = copy.deepcopy(game_state)
+                world["npcs"] = [dict(npc, name=f"{npc['name']} {i}") for i in range(50) for npc in game_state["npcs"]]
+                with open('test_fast_state.json', 'w') as f:
+                    json.dump(world, f)
+                players, npcs = load_game_state('test_fast_state.json')
+                casters = [npc for npc in npcs if npc.spells]
+                first, last = casters[0], [npc for npc in casters if npc.name.startswith(casters[0].name.rsplit(" ", 1)[0])][-1]
+                print(f"Spells compiled once: {first.spells[0] is last.spells[0] and first.spell_handler(first.spells[0]) is last.spell_handler(last.spells[0])}")
+
+                def load_error(loader, data):
+                    with open('test_fast_state.json', 'w') as f:
+                        f.write(data if isinstance(data, str) else json.dumps(data))
+                    try:
+                        loader('test_fast_state.json')
+                    except GameStateError as error:
+                        return error.path
+                    return None
+
+                broken = copy.deepcopy(game_state)
+                caster = next(index for index, npc in enumerate(broken["npcs"]) if npc.get("spells"))
+                broken["npcs"][caster]["spells"][0] = {"name": "Odd Charm", "type": "utility", "targeting": "single", "effect": None}
+                print(f"Bad spell caught at load: {load_error(load_characters_from_json, broken) == f'npcs[{caster}].spells[0]'}")
+                broken = copy.deepcopy(game_state)
+                broken["players"][0]["hp"] = True
+                print(f"Wrong type caught at load: {load_error(load_game_state, broken) == 'players[0].hp'}")
+                print(f"Broken JSON caught: {load_error(load_game_state, json.dumps(game_state)[:-20]) == '$'}")
+
+                jarvis = load_character_file('players/character_Jarvis.json')
+                print(f"Character file loaded: {jarvis.name == 'Jarvis' and jarvis.spell_handler(jarvis.spells[0]).spell is jarvis.spells[0]}")
+                with open('players/character_Jarvis.json', 'r') as f:
+                    character = json.load(f)
+                character["inventory"][1]["damage"] = 4
+                print(f"Bad character file caught: {load_error(load_character_file, character) == '$.inventory[1].damage'}")
+
+                conditions = load_conditions_file('conditions/consolidated_conditions.json')
+                print(f"Conditions file validated: {set(conditions) == set(CONDITIONS_DICT)}")
+                broken = copy.deepcopy(conditions)
+                broken["prone"]["interaction_effects"]["critical_hit"] = "maybe"
+                print(f"Bad condition caught: {load_error(load_conditions_file, broken) == 'prone.interaction_effects.critical_hit'}")
+                broken = copy.deepcopy(conditions)
+                broken["poisoned"]["removal"] = {"removable_by": ["saving_throw"], "saving_throw": {"attribute": "luck", "dc": 12}}
+                print(f"Bad removal save caught: {load_error(load_conditions_file, broken) == 'poisoned.removal.saving_throw.attribute'}")
+                print(f"Engine validates its conditions: {load_error(load_conditions, broken) == 'poisoned.removal.saving_throw.attribute'}")
+
+            except Exception as e:
+                print(f"ERROR: {e}")
+
+        output_text = output.getvalue()
+
+        analysis = {
+            "validated_roster": "Validated roster matches: True" in output_text and "Spells compiled once: True" in output_text,
+            "game_state_errors": all(f"{check}: True" in output_text for check in ("Bad spell caught at load", "Wrong type caught at load", "Broken JSON caught")),
+            "character_files": "Character file loaded: True" in output_text and "Bad character file caught: True" in output_text,
+            "conditions_files": all(f"{check}: True" in output_text for check in ("Conditions file validated", "Bad condition caught", "Bad removal save caught")),
+            "engine_conditions_validated": "Engine validates its conditions: True" in output_text,
+            "no_errors": "ERROR" not in output_text and "Traceback" not in output_text
+        }
+
+        self._print_analysis("Fast Loader", analysis)
+        self.test_results["fast_loader"] = {"output": output_text, "analysis": analysis}
+
+        if os.path.exists('test_fast_state.json'):
+            os.remove('test_fast_state.json')
+
+    def test_character_repository(self):
+        """Test the SQLite character repository: import, indexed queries, bulk saves, pooling and encounters."""
+        print("\n" + "="*60)
+        print("TESTING CHARACTER REPOSITORY")
+        print("="*60)
+
+        output = StringIO()
+        with redirect_stdout(output), redirect_stderr(output):
+            try:
+                import glob
+                import tempfile
+                import threading
+                from character_repository import CharacterRepository
+                from game_state_loader import GameStateError
+
+                with tempfile.TemporaryDirectory() as directory:
+                    repository = CharacterRepository(os.path.join(directory, "characters.db"), pool_size=3)
+                    imported, encounters = repository.import_files()
+                    scenarios = glob.glob("game_state*.json")
+                    print(f"JSON files imported: {encounters == len(scenarios) and repository.get('Jarvis')['class_type'] == 'wizard' and imported == repository.count()}")
+                    players, npcs = repository.load_encounter("game_state_test")
+                    expected_players, expected_npcs = load_characters_from_json('game_state_test.json')
+                    print(f"Encounter round trip: {[c.name for c in players + npcs] == [c.name for c in expected_players + expected_npcs]}")
+
+                    with open('game_state_test.json', 'r') as f:
+                        goblin = next(npc for npc in json.load(f)["npcs"] if npc["name"] == "Goblin Scout")
+                    horde = [dict(goblin, name=f"Goblin {i}", level=1 + i % 5, tags=["forest"] if i % 2 else []) for i in range(2000)]
+                    print(f"Bulk insert: {repository.save_characters(horde, tags=['goblinoid']) == 2000 and repository.count(tags=['goblinoid']) == 2000}")
+                    found = repository.find(tags=["goblinoid", "forest"], min_level=4)
+                    print(f"Tag and level query: {len(found) == 400 and all(entry['level'] >= 4 and 'forest' in entry['tags'] for entry in found)}")
+                    plans = repository.explain(class_type="wizard", level=3) + repository.explain(tags=["forest"])
+                    print(f"Queries use indexes: {any('characters_by_class' in plan for plan in plans) and any('character_tags' in plan and 'PRIMARY KEY' in plan for plan in plans)}")
+                    built = repository.load_characters(tags=["forest"], level=2)
+                    print(f"Characters built: {len(built) == 200 and built[0].name == 'Goblin 1' and built[0].inventory == goblin['inventory']}")
+
+                    try:
+                        repository.save_characters(horde[:5] + [dict(goblin, name="Broken", hp="lots")])
+                        print("Invalid entry rejected: False")
+                    except GameStateError as error:
+                        print(f"Invalid entry rejected: {error.path == 'npcs[5].hp' and repository.get('Goblin 0')['name'] == 'Goblin 0'}")
+
+                    repository.save_characters([dict(goblin, name="Jarvis", tags=["impostor"])], role="npc")
+                    kept = repository.get("Jarvis", role="player")["class_type"] == "wizard" and repository.get("Jarvis", role="npc")["hp"] == goblin["hp"]
+                    print(f"Player and NPC names kept apart: {kept and repository.count(names=['Jarvis']) == 2 and repository.tags_of('Jarvis', role='player') == []}")
+                    print(f"NPC namesake deleted alone: {repository.delete('Jarvis', role='npc') and repository.count(names=['Jarvis']) == 1}")
+
+                    state = repository.build_encounter(party={"names": ["Jarvis"]}, enemies={"tags": ["forest"], "max_level": 2, "limit": 3}, name="ambush")
+                    players, npcs = repository.load_encounter("ambush")
+                    engine = CombatEngine(players, npcs)
+                    print(f"Encounter built by query: {[c.name for c in npcs] == ['Goblin 1', 'Goblin 5', 'Goblin 11'] and players[0].name == 'Jarvis' and 'ambush' in repository.encounters()}")
+
+                    counts = []
+                    def reader():
+                        for _ in range(20):
+                            counts.append(repository.count(class_type=goblin["class_type"]))
+                    threads = [threading.Thread(target=reader) for _ in range(6)]
+                    for thread in threads:
+                        thread.start()
+                    for thread in threads:
+                        thread.join()
+                    print(f"Connections pooled: {len(set(counts)) == 1 and len(counts) == 120 and repository.pool.created <= 3}")
+
+                    files = os.path.join(directory, "players")
+                    os.makedirs(files)
+                    for entry in horde:
+                        with open(os.path.join(files, f"character_{entry['name'].replace(' ', '_')}.json"), 'w') as f:
+                            json.dump(entry, f)
+                    start = time.perf_counter()
+                    scanned = []
+                    for path in glob.glob(os.path.join(files, "character_*.json")):
+                        with open(path, 'r') as f:
+                            entry = json.load(f)
+                        if entry["level"] == 3 and "forest" in entry["tags"]:
+                            scanned.append(entry)
+                    scan_time = time.perf_counter() - start
+                    start = time.perf_counter()
+                    queried = repository.find(level=3, tags=["forest"])
+                    query_time = time.perf_counter() - start
+                    print(f"Query beats directory scan: {len(queried) == len(scanned) == 200 and query_time * 5 < scan_time}")
+                    repository.close()
+
+            except Exception as e:
+                print(f"ERROR: {e}")
+
+        output_text = output.getvalue()
+
+        analysis = {
+            "json_import": "JSON files imported: True" in output_text and "Encounter round trip: True" in output_text,
+            "indexed_queries": all(f"{check}: True" in output_text for check in ("Bulk insert", "Tag and level query", "Queries use indexes", "Characters built")),
+            "validation": "Invalid entry rejected: True" in output_text,
+            "names_per_role": "Player and NPC names kept apart: True" in output_text and "NPC namesake deleted alone: True" in output_text,
+            "encounters": "Encounter built by query: True" in output_text,
+            "pooling": "Connections pooled: True" in output_text,
+            "faster_than_files": "Query beats directory scan: True" in output_text,
+            "no_errors": "ERROR" not in output_text and "Traceback" not in output_text
+        }
+
+        self._print_analysis("Character Repository", analysis)
+        self.test_results["character_repository"] = {"output": output_text, "analysis": analysis}
+
+    def test_roster_store(self):
+        """Test the memory-mapped columnar roster store: export, zero-copy columns, predicates and rebuilding NPCs."""
+        print("\n" + "="*60)
+        print("TESTING ROSTER STORE")
+        print("="*60)
+
+        output = StringIO()
+        with redirect_stdout(output), redirect_stderr(output):
+            try:
+                import tempfile
+                import numpy as np
+                from roster_store import RosterStore, export_game_state, write_roster_store
+
+                with open('game_state_test.json', 'r') as f:
+                    game_state = json.load(f)
+                with tempfile.TemporaryDirectory() as directory:
+                    export_game_state('game_state_test.json', os.path.join(directory, "small"))
+                    store = RosterStore(os.path.join(directory, "small"))
+                    _, npcs = load_characters_from_json('game_state_test.json')
+                    rebuilt = store.characters(range(len(store)))
+                    print(f"NPCs rebuilt from rows: {[c.to_dict() for c in rebuilt] == [c.to_dict() for c in npcs]}")
+
+                    world = dict(game_state, npcs=[dict(npc, name=f"{npc['name']} {i}", ac=npc["ac"] + i % 4, position=[i % 50, i // 50])
+                                                   for i in range(3000) for npc in game_state["npcs"][i % len(game_state["npcs"]):][:1]])
+                    with open(os.path.join(directory, "world.json"), 'w') as f:
+                        json.dump(world, f)
+                    start = time.perf_counter()
+                    _, world_npcs = load_characters_from_json(os.path.join(directory, "world.json"))
+                    expected = {}
+                    for npc in world_npcs:
+                        expected[npc.ac] = expected.get(npc.ac, 0) + 1
+                    json_time = time.perf_counter() - start
+                    print(f"Exported rows: {export_game_state(os.path.join(directory, 'world.json'), os.path.join(directory, 'world')) == 3000}")
+
+                    start = time.perf_counter()
+                    store = RosterStore(os.path.join(directory, "world"))
+                    counts = store.value_counts("ac")
+                    store_time = time.perf_counter() - start
+                    print(f"AC distribution matches: {counts == expected}")
+                    print(f"Columns memory-mapped: {isinstance(store.column('ac'), np.memmap) and isinstance(store.column('class_type'), np.memmap)}")
+                    print(f"Aggregate without loading characters: {store_time * 10 < json_time}")
+
+                    rows = store.where(class_type="barbarian", ac=lambda ac: ac >= 15, x=range(10, 20))
+                    matching = [i for i, npc in enumerate(world_npcs) if npc.class_type == "barbarian" and npc.ac >= 15 and 10 <= npc.position[0] < 20]
+                    print(f"Predicate filtering: {list(rows) == matching and len(rows) > 0}")
+                    print(f"Unknown string matches nothing: {len(store.where(class_type='lich')) == 0}")
+                    dcs = store.spell_dcs(rows)
+                    expected_dcs = sorted(spell["dc"] for i in matching for spell in world["npcs"][i].get("spells") or () if spell.get("save"))
+                    print(f"Spell DCs of selected rows: {sorted(dcs.tolist()) == expected_dcs}")
+                    selected = store.characters(rows[:5])
+                    print(f"Selected rows rebuilt: {[c.name for c in selected] == [world_npcs[i].name for i in matching[:5]] and selected[0].position == world_npcs[matching[0]].position}")
+
+                    unarmed = [{key: value for key, value in npc.items() if key != "damage"} for npc in game_state["npcs"][:2]]
+                    write_roster_store(os.path.join(directory, "unarmed"), unarmed, validate=False)
+                    store = RosterStore(os.path.join(directory, "unarmed"))
+                    print(f"Missing strings read back as None: {store.entry(0)['damage'] is None and list(store.where(damage=None)) == [0, 1]}")
+
+                    witch = next(npc for npc in game_state["npcs"] if npc["name"] == "Goblin Witch")
+                    templated = {"templates": {"Witch": {k: v for k, v in witch.items() if k != "name"}}, "players": game_state["players"],
+                                 "npcs": [{"template": "Witch", "name": "Witch 1", "position": [1, 2]},
+                                          {"template": "Witch", "name": "Witch 2", "hp": 3}] + game_state["npcs"][:1]}
+                    with open(os.path.join(directory, "templated.json"), 'w') as f:
+                        json.dump(templated, f)
+                    rows = export_game_state(os.path.join(directory, "templated.json"), os.path.join(directory, "templated"))
+                    store = RosterStore(os.path.join(directory, "templated"))
+                    _, expected = load_characters_from_json(os.path.join(directory, "templated.json"))
+                    rebuilt = store.characters(range(len(store)))
+                    same = all((c.name, c.hp, c.ac, c.position, c.spells, c.inventory) == (e.name, e.hp, e.ac, e.position, list(e.spells), list(e.inventory))
+                               for c, e in zip(rebuilt, expected))
+                    print(f"Templated game_state exported: {rows == 3 and same and store.value_counts('spec')[store.decode('spec', [0])[0]] == 2}")
+
+            except Exception as e:
+                print(f"ERROR: {e}")
+
+        output_text = output.getvalue()
+
+        analysis = {
+            "round_trip": "NPCs rebuilt from rows: True" in output_text and "Selected rows rebuilt: True" in output_text,
+            "aggregates": all(f"{check}: True" in output_text for check in ("Exported rows", "AC distribution matches", "Aggregate without loading characters")),
+            "zero_copy": "Columns memory-mapped: True" in output_text,
+            "missing_strings": "Missing strings read back as None: True" in output_text,
+            "templated_export": "Templated game_state exported: True" in output_text,
+            "predicates": all(f"{check}: True" in output_text for check in ("Predicate filtering", "Unknown string matches nothing", "Spell DCs of selected rows")),
+            "no_errors": "ERROR" not in output_text and "Traceback" not in output_text
+        }
+
+        self._print_analysis("Roster Store", analysis)
+        self.test_results["roster_store"] = {"output": output_text, "analysis": analysis}
+
+    def test_batch_generation(self):
+        """Test concurrent batch character generation against the mock LLM server: order, retries, limits and throughput."""
+        print("\n" + "="*60)
+        print("TESTING BATCH CHARACTER GENERATION")
+        print("="*60)
+
+        output = StringIO()
+        with redirect_stdout(output), redirect_stderr(output):
+            try:
+                from character_generator import generate_batch
+                from mock_llm_server import start_mock_server
+
+                pairs = [(f"Adventurer {i}", "a brave elven wizard skilled in fire magic") for i in range(24)]
+                server = start_mock_server(latency=0.1)
+                start = time.perf_counter()
+                sequential, _ = generate_batch(pairs[:4], "spec", endpoint=server.url, concurrency=1, rate=0)
+                sequential_rate = 4 / (time.perf_counter() - start)
+                results, stats = generate_batch(pairs, "spec", endpoint=server.url, concurrency=6, rate=0)
+                print(f"Results in order: {[r['name'] for r in results] == [name for name, _ in pairs]}")
+                print(f"Characters generated: {all(r['character'] and r['character']['name'] == r['name'] for r in results)}")
+                print(f"Lore sheets generated: {all(r['lore'] and r['name'] in r['lore'] for r in results) and stats['completed'] == 24}")
+                print(f"Concurrency limited: {server.stats()['peak_concurrency'] <= 6}")
+                print(f"Requests overlap: {server.stats()['peak_concurrency'] >= 4}")
+                print(f"Faster than sequential: {stats['characters_per_second'] > 3 * sequential_rate}")
+                print(f"Sequential results match: {[r['character'] for r in sequential] == [r['character'] for r in results[:4]]}")
+
+                start = time.perf_counter()
+                _, limited = generate_batch(pairs[:6], "spec", endpoint=server.url, concurrency=6, rate=20, burst=2)
+                print(f"Rate limited: {time.perf_counter() - start >= (limited['requests'] - 2) / 20}")
+                server.shutdown()
+
+                flaky = start_mock_server(latency=0.02, fail_every=5)
+                results, stats = generate_batch(pairs[:10], "spec", endpoint=flaky.url, concurrency=4, rate=0, backoff=0.01)
+                print(f"Retries recover refused requests: {stats['completed'] == 10 and stats['retries'] == flaky.stats()['failures'] > 0}")
+                results, stats = generate_batch(pairs[:2], "spec", endpoint=flaky.url, concurrency=4, rate=0, retries=0)
+                print(f"Failures reported without retries: {stats['failures'] > 0 and any(r['errors'] and '503' in r['errors'][0] for r in results)}")
+                flaky.shutdown()
+
+                start = time.perf_counter()
+                results, stats = generate_batch(pairs[:1], "spec", endpoint="http://127.0.0.1:9/v1/chat/completions",
+                                                retries=2, backoff=0.01)
+                print(f"Unreachable backend gives up: {stats['failures'] == 2 and stats['requests'] == 6 and results[0]['character'] is None}")
+                try:
+                    generate_batch(pairs[:1], "spec", concurency=2)
+                    print("Unknown setting rejected: False")
+                except ValueError:
+                    print("Unknown setting rejected: True")
+
+            except Exception as e:
+                print(f"ERROR: {e}")
+
+        output_text = output.getvalue()
+
+        analysis = {
+            "ordered_results": all(f"{check}: True" in output_text for check in ("Results in order", "Characters generated", "Lore sheets generated", "Sequential results match")),
+            "limits": all(f"{check}: True" in output_text for check in ("Concurrency limited", "Rate limited", "Unknown setting rejected")),
+            "throughput": "Requests overlap: True" in output_text and "Faster than sequential: True" in output_text,
+            "retries": all(f"{check}: True" in output_text for check in ("Retries recover refused requests", "Failures reported without retries", "Unreachable backend gives up")),
+            "no_errors": "ERROR" not in output_text and "Traceback" not in output_text
+        }
+
+        self._print_analysis("Batch Generation", analysis)
+        self.test_results["batch_generation"] = {"output": output_text, "analysis": analysis}
+
     def _run_with_mock_inputs(self, engine, inputs):
         """Run combat with mock inputs."""
         original_input = input
@@ -464,6 +2237,30 @@ class IntegrationTester:
         self.test_condition_application_and_removal()
         self.test_advantage_disadvantage_system()
         self.test_combat_end_conditions()
+        self.test_combat_server_sessions()
+        self.test_snapshot_and_restore()
+        self.test_deterministic_replay()
+        self.test_save_and_load()
+        self.test_triage_queues()
+        self.test_capability_index()
+        self.test_tactical_ai()
+        self.test_mcts_ai()
+        self.test_llm_npc()
+        self.test_decision_cache()
+        self.test_horde_stacks()
+        self.test_battle_grid()
+        self.test_area_templates()
+        self.test_line_of_sight()
+        self.test_pathfinding()
+        self.test_flow_fields()
+        self.test_spell_handlers()
+        self.test_batched_aoe()
+        self.test_streaming_loader()
+        self.test_monster_templates()
+        self.test_fast_loader()
+        self.test_character_repository()
+        self.test_roster_store()
+        self.test_batch_generation()
         
         # Generate reports
         print("\n" + "="*60)
@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+"""
+LLM-driven NPC decisions (ai_type "llm"), following documentation/LLM_NPC_actions.md.
+
+On its turn an LLM NPC sends the model its status, its allies' and enemies' status, the
+recent battle log and a numbered list of legal options (the tactical AI's move list), and
+the model answers with an option number that the engine resolves like any other action.
+
+Requests do not go out one by one. A batcher running an asyncio loop on a background
+thread collects the pending decisions of every NPC and every encounter in the process
+for `batch_window` seconds (or until `max_batch` are waiting) and sends them as one chat
+completions request, with up to `max_in_flight` requests outstanding. When an LLM NPC
+asks, the other LLM NPCs still due to act this round are asked too (prefetching), so
+one round of a fight typically costs one request.
+
+Answers are cached under a normalized state signature - names, HP in `hp_buckets` steps,
+active effects and the options - with a TTL and LRU eviction, so recurring situations
+skip the model entirely. If no answer arrives within `deadline` seconds, the model
+fails, or it picks something illegal, the NPC falls back to the aggressive AI.
+
+Per-NPC settings through ai_config (defaults in DEFAULT_CONFIG), for example:
+    {"ai_type": "llm", "ai_config": {"endpoint": "http://127.0.0.1:8790/v1/chat/completions", "deadline": 1.0}}
+
+Benchmark against the local mock backend (mock_llm_server.py), no network needed:
+    python3 llm_npc.py --encounters 16 --latency 0.05
+"""
+
+import argparse
+import asyncio
+import atexit
+import concurrent.futures
+import http.client
+import itertools
+import json
+import os
+import threading
+import time
+import weakref
+from collections import deque
+from urllib.parse import urlsplit
+
+from combat_engine import (
+    HOSTILE,
+    PARTY,
+    CombatEngine,
+    DecisionCache,
+    faction_of,
+    load_characters_from_dict,
+    log_message,
+    quiet_mode,
+)
+from tactical_ai import TacticalPlanner
+
+DEFAULT_CONFIG = {
+    "endpoint": os.environ.get("LLM_NPC_ENDPOINT", "http://127.0.0.1:8790/v1/chat/completions"),
+    "model": "llama-3.3-70b",
+    "api_key": None,  # None = LLM_NPC_API_KEY from the environment
+    "temperature": 0.2,
+    "deadline": 2.0,  # Seconds an NPC waits for its answer before falling back
+    "request_timeout": 10.0,  # Seconds before a batch request is abandoned
+    "max_batch": 16,  # Decisions per request
+    "batch_window": 0.01,  # Seconds the batcher waits for more decisions to join a request
+    "max_in_flight": 4,  # Concurrent requests to the backend
+    "cache_size": 4096,  # Cached decisions (least recently used are evicted first)
+    "cache_ttl": 300.0,  # Seconds a cached decision stays valid
+    "hp_buckets": 10,  # HP is rounded to tenths of max HP in the state signature
+    "prefetch": True,  # Ask for the other LLM NPCs due this round at the same time
+    "log_events": 8,  # Recent battle log entries sent with each decision
+}
+
+# Settings that belong to the shared batcher and cache rather than to a single NPC
+_SERVICE_SETTINGS = ("endpoint", "model", "api_key", "temperature", "request_timeout", "max_batch",
+                     "batch_window", "max_in_flight", "cache_size", "cache_ttl")
+
+SYSTEM_PROMPT = (
+    "You decide the turns of non-player characters in a turn-based fantasy combat. "
+    "The user message is JSON with a list of decisions; each has an id, the acting character, "
+    "its status, the status of its allies and enemies, the recent battle log and numbered options. "
+    "Answer with JSON only, in the form {\"decisions\": [{\"id\": <id>, \"option\": <option index>}]}, "
+    "one entry per decision, choosing what that character would do to help its side win."
+)
+
+_services = {}
+_services_lock = threading.Lock()
+_battle_logs = weakref.WeakKeyDictionary()  # Engine -> recent action events
+
+
+class DecisionBatcher:
+    """
+    Combines decision requests submitted from any thread into batched chat completions
+    requests, sent from an asyncio loop on a daemon thread. submit() returns a
+    concurrent.futures.Future resolving to the model's answer for that decision.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        url = urlsplit(config["endpoint"])
+        self.host, self.port, self.path = url.hostname, url.port, url.path or "/"
+        self.https = url.scheme == "https"
+        self.api_key = config["api_key"] or os.environ.get("LLM_NPC_API_KEY")
+        self.requests = 0
+        self.batched_decisions = 0
+        self.failed_requests = 0
+        self._connections = threading.local()  # One keep-alive connection per executor thread
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=config["max_in_flight"],
+                                                               thread_name_prefix="llm-npc-http")
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True, name="llm-npc-batcher")
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self.loop).result()
+
+    async def _start(self):
+        self._queue = asyncio.Queue()
+        self._in_flight = asyncio.Semaphore(self.config["max_in_flight"])
+        self._sends = set()
+        self._task = self.loop.create_task(self._collect())
+
+    def submit(self, decision):
+        future = concurrent.futures.Future()
+        self.loop.call_soon_threadsafe(self._queue.put_nowait, (decision, future))
+        return future
+
+    async def _collect(self):
+        while True:
+            batch = [await self._queue.get()]
+            closes_at = self.loop.time() + self.config["batch_window"]
+            while len(batch) < self.config["max_batch"]:
+                remaining = closes_at - self.loop.time()
+                try:
+                    if remaining <= 0 or not self._queue.empty():
+                        batch.append(self._queue.get_nowait())
+                    else:
+                        batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+            await self._in_flight.acquire()
+            send = self.loop.create_task(self._send(batch))
+            self._sends.add(send)
+            send.add_done_callback(self._sends.discard)
+
+    async def _send(self, batch):
+        try:
+            payload = {
+                "model": self.config["model"],
+                "temperature": self.config["temperature"],
+                "messages": [
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": json.dumps({"decisions": [decision for decision, _ in batch]})},
+                ],
+            }
+            self.requests += 1
+            self.batched_decisions += len(batch)
+            reply = await self.loop.run_in_executor(self._executor, self._post, payload)
+            answers = parse_decisions(reply)
+            for decision, future in batch:
+                future.set_result(answers.get(str(decision["id"])))
+        except asyncio.CancelledError:
+            self._fail(batch, RuntimeError("LLM decision service closed"))
+            raise
+        except Exception as error:
+            self.failed_requests += 1
+            self._fail(batch, error)
+        finally:
+            self._in_flight.release()
+
+    @staticmethod
+    def _fail(batch, error):
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    def _post(self, payload):
+        """Blocking POST on this thread's keep-alive connection, reconnecting once if it went stale."""
+        body = json.dumps(payload).encode()
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        for attempt in range(2):
+            connection = getattr(self._connections, "connection", None)
+            if connection is None:
+                connection_class = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+                connection = connection_class(self.host, self.port, timeout=self.config["request_timeout"])
+                self._connections.connection = connection
+            try:
+                connection.request("POST", self.path, body, headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                self._connections.connection = None
+                if attempt:
+                    raise
+                continue
+            if response.status != 200:
+                raise RuntimeError(f"LLM backend returned HTTP {response.status}: {data[:200]!r}")
+            return json.loads(data)
+
+    async def _stop(self):
+        tasks = [self._task, *self._sends]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self._stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=1)
+        self._executor.shutdown(wait=False)
+
+
+def parse_decisions(reply):
+    """Map decision id -> chosen option index from a chat completions reply."""
+    content = reply["choices"][0]["message"]["content"].strip()
+    if content.startswith("```"):  # Models like to wrap JSON in a code fence
+        content = content.strip("`").removeprefix("json").strip()
+    answers = {}
+    for entry in json.loads(content).get("decisions", []):
+        if isinstance(entry, dict) and isinstance(entry.get("option"), int):
+            answers[str(entry.get("id"))] = entry["option"]
+    return answers
+
+
+def _record_battle_log(log, event):
+    if event["event"] in ("action", "target_status"):
+        log.append(event)
+
+
+def battle_log(engine, size):
+    """Recent action events of an engine, collected by a listener attached on first use."""
+    log = _battle_logs.get(engine)
+    if log is None:
+        log = _battle_logs[engine] = deque(maxlen=max(size, 1))
+        engine.event_listeners.append(lambda event: _record_battle_log(log, event))
+    return list(log)[-size:] if size else []
+
+
+def character_status(character):
+    return {
+        "name": character.name,
+        "hp": max(character.current_hp, 0),
+        "max_hp": character.hp,
+        "effects": sorted(name for name, effect in character.unified_effects.items() if effect.active),
+    }
+
+
+class LLMDecisionService:
+    """A batcher and a decision cache shared by every LLM NPC with the same backend settings."""
+
+    def __init__(self, config):
+        self.batcher = DecisionBatcher(config)
+        self.cache = DecisionCache(config["cache_size"], config["cache_ttl"])
+        self._pending = {}  # Signature -> future of a request already on its way
+        self._pending_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.decisions = 0
+        self.fallbacks = 0
+
+    def build_request(self, npc, engine, config):
+        """Prompt entry, options and normalized state signature for an NPC's decision."""
+        roster = engine.roster
+        options = [engine.describe_action(action) for action in TacticalPlanner(npc, roster).legal_actions()]
+        status = {
+            "self": character_status(npc),
+            "allies": [character_status(c) for c in roster.allies_of(npc) if c.is_alive()],
+            "enemies": [character_status(c) for c in roster.enemies_of(npc) if c.is_alive()],
+        }
+        buckets = config["hp_buckets"]
+
+        def normalized(entry):
+            return (entry["name"], round(entry["hp"] / max(entry["max_hp"], 1) * buckets), tuple(entry["effects"]))
+
+        signature = json.dumps([
+            normalized(status["self"]),
+            sorted(normalized(entry) for entry in status["allies"]),
+            sorted(normalized(entry) for entry in status["enemies"]),
+            options,
+        ], sort_keys=True)
+        decision = {
+            "id": next(self._ids),
+            "character": npc.name,
+            "class": npc.class_type,
+            "side": faction_of(npc),
+            "round": engine.round_number,
+            "status": status,
+            "battle_log": battle_log(engine, config["log_events"]),
+            "options": options,
+        }
+        return signature, decision
+
+    def request(self, signature, decision):
+        """Ask the model for a decision unless the same signature is already on its way."""
+        with self._pending_lock:
+            future = self._pending.get(signature)
+            if future is None:
+                future = self._pending[signature] = self.batcher.submit(decision)
+                future.add_done_callback(lambda done: self._store(signature, decision["options"], done))
+        return future
+
+    def _store(self, signature, options, future):
+        with self._pending_lock:
+            self._pending.pop(signature, None)
+        if future.exception() is None:
+            choice = future.result()
+            if isinstance(choice, int) and 0 <= choice < len(options):
+                self.cache.put(signature, options[choice])
+
+    def prefetch(self, npc, engine, config):
+        """Queue decisions for the other LLM NPCs still due to act this round."""
+        for character in engine.initiative_order[engine.turn_index:]:
+            if character is npc or getattr(character, "ai_type", None) != "llm" or not engine.can_act(character):
+                continue
+            if character.has_effect('stunned') or character.has_effect('incapacitated'):
+                continue
+            signature, decision = self.build_request(character, engine, config)
+            if decision["options"] and signature not in self.cache.entries:
+                self.request(signature, decision)
+
+    def decide(self, npc, engine, config):
+        """The NPC's action dict, or the aggressive AI's when the model cannot help in time."""
+        self.decisions += 1
+        signature, decision = self.build_request(npc, engine, config)
+        if not decision["options"]:
+            return npc._aggressive_ai_logic(engine.roster)
+
+        description = self.cache.get(signature)
+        source = "cached"
+        if description is None:
+            source = "model"
+            future = self.request(signature, decision)
+            if config["prefetch"]:
+                self.prefetch(npc, engine, config)
+            try:
+                choice = future.result(timeout=config["deadline"])
+            except concurrent.futures.TimeoutError:
+                return self._fall_back(npc, engine, f"no answer within {config['deadline']}s")
+            except Exception as error:
+                return self._fall_back(npc, engine, f"backend error: {error}")
+            if not isinstance(choice, int) or not 0 <= choice < len(decision["options"]):
+                return self._fall_back(npc, engine, f"invalid option {choice!r}")
+            description = decision["options"][choice]
+
+        try:
+            action = engine.resolve_action(npc, description)
+        except ValueError as error:
+            return self._fall_back(npc, engine, str(error))
+        log_message(f"{npc.name} (LLM, {source}) decides to {description['type']}: {description}.")
+        return action
+
+    def _fall_back(self, npc, engine, reason):
+        self.fallbacks += 1
+        log_message(f"{npc.name} (LLM) falls back to the aggressive AI: {reason}.")
+        return npc._aggressive_ai_logic(engine.roster)
+
+    def stats(self):
+        return {
+            "decisions": self.decisions,
+            "requests": self.batcher.requests,
+            "batched_decisions": self.batcher.batched_decisions,
+            "failed_requests": self.batcher.failed_requests,
+            "fallbacks": self.fallbacks,
+            "cache_hits": self.cache.hits,
+            "cache_misses": self.cache.misses,
+            "cache_size": len(self.cache),
+        }
+
+    def close(self):
+        self.batcher.close()
+
+
+def get_service(config):
+    """The shared service for these backend settings, started on first use."""
+    key = tuple(config[name] for name in _SERVICE_SETTINGS)
+    with _services_lock:
+        service = _services.get(key)
+        if service is None:
+            service = _services[key] = LLMDecisionService(config)
+        return service
+
+
+def close_services():
+    """Stop every batcher thread (tests and benchmarks; services restart on demand)."""
+    with _services_lock:
+        for service in _services.values():
+            service.close()
+        _services.clear()
+
+
+atexit.register(close_services)
+
+
+def decide_llm_action(npc, all_characters):
+    """Ask the model through the shared batcher; without an engine, fall back to the aggressive AI."""
+    engine = getattr(all_characters, "engine", None)
+    if engine is None:
+        return npc._aggressive_ai_logic(all_characters)
+    config = {**DEFAULT_CONFIG, **npc.ai_config}
+    return get_service(config).decide(npc, engine, config)
+
+
+# --- Offline benchmark ---
+
+def _benchmark_player_action(engine, player):
+    """Benchmark players hit the weakest enemy with their best weapon."""
+    target = engine.roster.best(HOSTILE if faction_of(player) == PARTY else PARTY, "weakest")
+    weapon = player.capabilities.best_weapon
+    if target is None or weapon is None:
+        return {"type": "pass"}
+    return {"type": "attack", "target": target, "weapon": weapon}
+
+
+def _run_encounter(game_state, ai_config, max_rounds, latencies):
+    players, npcs = load_characters_from_dict(game_state)
+    for npc in npcs:
+        npc.ai_type = "llm"
+        npc.ai_config = dict(ai_config)
+    engine = CombatEngine(players, npcs)
+    engine.max_rounds = max_rounds
+    engine.player_controller = _benchmark_player_action
+    engine.begin_combat()
+    while True:
+        character = engine.next_turn()
+        if character is None:
+            return engine.winning_side()
+        started = time.perf_counter()
+        engine.take_turn(character)
+        if character in npcs:
+            latencies.append(time.perf_counter() - started)
+
+
+def benchmark(game_state, encounters, ai_config, max_rounds=10):
+    """Play `encounters` fights on parallel threads; returns throughput and latency figures."""
+    latencies = []
+    started = time.perf_counter()
+    with quiet_mode(), concurrent.futures.ThreadPoolExecutor(max_workers=encounters) as pool:
+        winners = list(pool.map(lambda _: _run_encounter(game_state, ai_config, max_rounds, latencies),
+                                range(encounters)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    service = get_service({**DEFAULT_CONFIG, **ai_config})
+    stats = service.stats()
+    return {
+        "encounters": encounters,
+        "seconds": elapsed,
+        "npc_turns_per_second": len(latencies) / elapsed if elapsed else 0.0,
+        "latency_p50_ms": latencies[len(latencies) // 2] * 1000 if latencies else 0.0,
+        "latency_p95_ms": latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0.0,
+        "decisions_per_request": stats["batched_decisions"] / max(stats["requests"], 1),
+        "winners": {winner: winners.count(winner) for winner in set(winners)},
+        **stats,
+    }
+
+
+def main():
+    # Run through the importable module: combat_engine imports llm_npc, and a second copy
+    # running as __main__ would have its own services and statistics
+    from llm_npc import benchmark, close_services
+    from mock_llm_server import start_mock_server
+    parser = argparse.ArgumentParser(description="Benchmark LLM NPC decisions against the local mock backend.")
+    parser.add_argument("--game-state", default="game_state_test.json")
+    parser.add_argument("--encounters", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock backend seconds per request")
+    parser.add_argument("--per-item-latency", type=float, default=0.002, help="Mock backend seconds per decision")
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_CONFIG["max_batch"])
+    parser.add_argument("--deadline", type=float, default=DEFAULT_CONFIG["deadline"])
+    parser.add_argument("--max-rounds", type=int, default=10)
+    parser.add_argument("--no-cache", action="store_true", help="Expire cached decisions immediately")
+    parser.add_argument("--no-prefetch", action="store_true", help="Only ask for the NPC whose turn it is")
+    args = parser.parse_args()
+
+    with open(args.game_state, 'r') as file:
+        game_state = json.load(file)
+    server = start_mock_server(latency=args.latency, per_item_latency=args.per_item_latency)
+    ai_config = {"endpoint": server.url, "max_batch": args.max_batch, "deadline": args.deadline,
+                 "cache_ttl": 0.0 if args.no_cache else DEFAULT_CONFIG["cache_ttl"], "prefetch": not args.no_prefetch}
+    try:
+        results = benchmark(game_state, args.encounters, ai_config, args.max_rounds)
+    finally:
+        close_services()
+        server.shutdown()
+    for key, value in results.items():
+        print(f"{key:>22}: {value:.2f}" if isinstance(value, float) else f"{key:>22}: {value}")
+
+
+if __name__ == "__main__":
+    main()
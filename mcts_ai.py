@@ -0,0 +1,295 @@
+"""
+Monte Carlo tree search NPC policy (ai_type "mcts").
+
+The search runs on a private copy of the combat (CombatEngine.from_dict of the live
+engine's to_dict), so simulated turns never touch the real characters, event listeners
+or dice stream. Tree nodes are the acting NPC's own decision points. Each iteration:
+
+  1. restores the copy to the root snapshot,
+  2. walks down the tree picking actions by UCB1, biased towards the tactical AI's
+     favourites, and lets everyone else play their usual AI (players attack the weakest
+     enemy) until the NPC's next turn,
+  3. adds the first unseen state as a new node,
+  4. plays a headless rollout for up to `rollout_rounds` rounds and scores the result
+     from the NPC's side (1 = its side won, 0 = it lost, HP balance in between).
+
+Nodes are stored in a transposition table keyed by CombatEngine.state_hash (without the
+dice state), so identical positions reached through different dice share statistics, and
+the table is kept between decisions of the same NPC.
+
+Budget, per NPC through ai_config (more compute makes a stronger boss):
+    {"iterations": 64, "time_budget": None, "workers": 0, "rollout_rounds": 10, "exploration": 0.7}
+With workers > 0 the iterations are split across a process pool (root parallelisation):
+each worker rebuilds the combat from the serialized state, searches with its own seed,
+and the root statistics are merged. Threads would not help here: the engine and d20
+share the global `random` module and the GIL serialises the simulation anyway.
+"""
+
+import atexit
+import json
+import math
+import random
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+
+from combat_engine import (
+    HOSTILE,
+    PARTY,
+    CombatEngine,
+    faction_of,
+    log_message,
+    quiet_mode,
+)
+from tactical_ai import TacticalPlanner
+
+DEFAULT_CONFIG = {
+    "iterations": 64,  # Simulations per decision (None = limited by time_budget only)
+    "time_budget": None,  # Seconds per decision (None = limited by iterations only)
+    "workers": 0,  # Processes for parallel rollouts (0 = search in this process)
+    "rollout_rounds": 10,  # How far past the tree a rollout plays before it is scored
+    "exploration": 0.7,  # UCB1 exploration constant (values are win rates between 0 and 1)
+    "prior_weight": 1.0,  # Weight of the tactical AI's opinion, fading as actions are visited
+    "max_nodes": 20000,  # Transposition table size before it is cleared
+}
+
+# AI types that must not run inside simulations (they would search or call out recursively);
+# the tactical AI plays their turns instead
+_SIMULATED_AS_TACTICAL = ("mcts", "llm")
+
+_tables = weakref.WeakKeyDictionary()  # Real NPC -> transposition table kept between decisions
+_pool = None
+_pool_workers = 0
+
+
+class SearchNode:
+    """Statistics for one decision point of the searching NPC."""
+    __slots__ = ("actions", "priors", "visits", "action_visits", "action_values")
+
+    def __init__(self, actions, priors):
+        self.actions = actions  # Action key -> action description, best prior first
+        self.priors = priors  # Action key -> tactical expected value scaled to 0..1
+        self.visits = 0
+        self.action_visits = dict.fromkeys(actions, 0)
+        self.action_values = dict.fromkeys(actions, 0.0)
+
+    def select(self, exploration, prior_weight):
+        """
+        UCB1 with a progressive bias: try every action once (most promising first), then
+        balance mean value, uncertainty and the tactical prior, which fades with visits.
+        """
+        best_key, best_score = None, -math.inf
+        log_visits = math.log(self.visits + 1)
+        for key, visits in self.action_visits.items():
+            if visits == 0:
+                return key
+            score = (self.action_values[key] / visits + exploration * math.sqrt(log_visits / visits)
+                     + prior_weight * self.priors[key] / (visits + 1))
+            if score > best_score:
+                best_key, best_score = key, score
+        return best_key
+
+    def update(self, key, value):
+        self.visits += 1
+        self.action_visits[key] += 1
+        self.action_values[key] += value
+
+
+class CombatSearch:
+    """Runs MCTS iterations for one NPC on a private copy of the combat state."""
+
+    def __init__(self, state, actor_index, config, table=None):
+        self.config = config
+        self.engine = CombatEngine.from_dict(state, restore_rng=False)
+        combatants = self.engine.players + self.engine.npcs
+        self.actor = combatants[actor_index]
+        for npc in self.engine.npcs:
+            if npc.ai_type in _SIMULATED_AS_TACTICAL:
+                npc.ai_type = "tactical"
+        self.engine.player_controller = self.rollout_player_action
+        limit = self.engine.round_number + config["rollout_rounds"]
+        self.engine.max_rounds = min(limit, self.engine.max_rounds) if self.engine.max_rounds else limit
+        self.side = faction_of(self.actor)
+        self.table = table if table is not None else {}
+        self.root_snapshot = self.engine.snapshot()
+        self.root = self.node_for_current_state()
+
+    @staticmethod
+    def rollout_player_action(engine, player):
+        """Players in simulations hit the weakest enemy with their best weapon."""
+        weapon = player.capabilities.best_weapon
+        target = engine.roster.best(HOSTILE if faction_of(player) == PARTY else PARTY, "weakest")
+        if weapon is None or target is None:
+            return {"type": "pass"}
+        return {"type": "attack", "target": target, "weapon": weapon}
+
+    def node_for_current_state(self):
+        key = self.engine.state_hash(include_rng=False)
+        node = self.table.get(key)
+        if node is None:
+            planner = TacticalPlanner(self.actor, self.engine.roster)
+            scored = []
+            for action in planner.legal_actions():
+                description = self.engine.describe_action(action)
+                scored.append((planner.score(action), json.dumps(description, sort_keys=True), description))
+            if not scored:
+                scored.append((0.0, json.dumps({"type": "pass"}), {"type": "pass"}))
+            scored.sort(key=lambda entry: -entry[0])
+            top = max(scored[0][0], 1e-9)
+            node = self.table[key] = SearchNode(
+                {key: description for _, key, description in scored},
+                {key: max(score, 0.0) / top for score, key, _ in scored})
+        return node
+
+    def play_until_actor_decides(self):
+        """Plays other characters' turns; True when the NPC is due to choose again."""
+        while True:
+            character = self.engine.next_turn()
+            if character is None:
+                return False
+            if character is self.actor and self.engine.can_act(character):
+                return True
+            self.engine.take_turn(character)
+
+    def evaluate(self):
+        """Score the simulated position from the searching NPC's side, between 0 and 1."""
+        hp = {PARTY: [0, 0], HOSTILE: [0, 0]}
+        for character in self.engine.roster:
+            totals = hp[faction_of(character)]
+            totals[0] += max(character.current_hp, 0)
+            totals[1] += character.hp
+        own, other = hp[self.side], hp[HOSTILE if self.side == PARTY else PARTY]
+        if other[0] <= 0:
+            return 1.0
+        if own[0] <= 0:
+            return 0.0
+        balance = own[0] / max(own[1], 1) - other[0] / max(other[1], 1)
+        return 0.5 + 0.5 * balance
+
+    def iterate(self, seed):
+        self.engine.restore(self.root_snapshot)
+        node, path = self.root, []
+        while True:
+            key = node.select(self.config["exploration"], self.config["prior_weight"])
+            if node is self.root:
+                # Common random numbers: the n-th try of every root action sees the same dice,
+                # so actions are compared under identical luck. Seeded after restore, which
+                # rewinds the dice to the live game's state.
+                random.seed(seed * 1000003 + node.action_visits[key])
+            path.append((node, key))
+            action = self.engine.resolve_action(self.actor, node.actions[key])
+            self.engine.take_turn(self.actor, action if action is not None else {"type": "pass"})
+            if not self.play_until_actor_decides():
+                break
+            state_key = self.engine.state_hash(include_rng=False)
+            child = self.table.get(state_key)
+            if child is None:
+                self.node_for_current_state()  # Expand, then roll out from here
+                self.engine.take_turn(self.actor)
+                while True:
+                    character = self.engine.next_turn()
+                    if character is None:
+                        break
+                    self.engine.take_turn(character)
+                break
+            node = child
+        value = self.evaluate()
+        for visited, key in path:
+            visited.update(key, value)
+
+    def run(self, iterations, time_budget, seed):
+        """Search until either budget runs out; returns the root's {key: [visits, value]}."""
+        deadline = time.monotonic() + time_budget if time_budget else None
+        done = 0
+        while (iterations is None or done < iterations) and (deadline is None or time.monotonic() < deadline):
+            self.iterate(seed)
+            done += 1
+            if iterations is None and deadline is None:
+                break
+        self.engine.restore(self.root_snapshot)
+        return {key: [self.root.action_visits[key], self.root.action_values[key]] for key in self.root.actions}
+
+
+def _search_worker(state, actor_index, config, iterations, time_budget, seed):
+    """Process pool entry point: search a rebuilt copy of the combat and return root statistics."""
+    with quiet_mode():
+        return CombatSearch(state, actor_index, config).run(iterations, time_budget, seed)
+
+
+def _get_pool(workers):
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != workers:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool = ProcessPoolExecutor(max_workers=workers)
+        _pool_workers = workers
+    return _pool
+
+
+def close_pool():
+    """Shut down the search worker processes (tests and benchmarks; the pool restarts on demand)."""
+    global _pool, _pool_workers
+    if _pool is not None:
+        _pool.shutdown()
+        _pool, _pool_workers = None, 0
+
+
+atexit.register(close_pool)
+
+
+def search(engine, actor, config=None):
+    """
+    Run MCTS for `actor` on the live engine's current state and return the root statistics
+    as {action key: [visits, total value]} along with the action descriptions.
+    The engine, its characters and the global dice stream are left untouched.
+    """
+    config = {**DEFAULT_CONFIG, **(config or {})}
+    combatants = engine.players + engine.npcs
+    actor_index = next(i for i, character in enumerate(combatants) if character is actor)
+    state = engine.to_dict()
+    iterations, time_budget, workers = config["iterations"], config["time_budget"], config["workers"]
+
+    saved_rng = random.getstate()
+    seed = random.getrandbits(32)  # Derived from the live dice stream, so decisions are reproducible
+    try:
+        with quiet_mode():
+            if workers and workers > 0:
+                share = None if iterations is None else max(1, math.ceil(iterations / workers))
+                futures = [_get_pool(workers).submit(_search_worker, state, actor_index, config,
+                                                     share, time_budget, seed + worker)
+                           for worker in range(workers)]
+                stats = {}
+                for future in futures:
+                    for key, (visits, value) in future.result().items():
+                        merged = stats.setdefault(key, [0, 0.0])
+                        merged[0] += visits
+                        merged[1] += value
+                descriptions = {key: json.loads(key) for key in stats}
+            else:
+                table = _tables.get(actor)
+                if table is None or len(table) > config["max_nodes"]:
+                    table = _tables[actor] = {}
+                searcher = CombatSearch(state, actor_index, config, table)
+                stats = searcher.run(iterations, time_budget, seed)
+                descriptions = searcher.root.actions
+    finally:
+        random.setstate(saved_rng)
+    return stats, descriptions
+
+
+def decide_mcts_action(npc, all_characters):
+    """Choose the most visited root action; without an engine to simulate, fall back to the tactical AI."""
+    engine = getattr(all_characters, "engine", None)
+    if engine is None:
+        from tactical_ai import decide_tactical_action
+        return decide_tactical_action(npc, all_characters)
+
+    stats, descriptions = search(engine, npc, npc.ai_config)
+    if not stats:
+        return None
+    key = max(stats, key=lambda k: (stats[k][0], stats[k][1]))
+    visits, value = stats[key]
+    action = engine.resolve_action(npc, descriptions[key])
+    log_message(f"{npc.name} (MCTS) decides to {descriptions[key]['type']} "
+                f"after {sum(v for v, _ in stats.values())} simulations (win rate {value / max(visits, 1):.2f}).")
+    return action
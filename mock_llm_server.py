@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for an OpenAI-style chat completions API.
+
+Serves POST /v1/chat/completions on localhost so LLM-driven features can be developed,
+tested and benchmarked offline. Replies are deterministic:
+  - NPC decision batches (a user message holding {"decisions": [...]}, see llm_npc.py)
+    are answered with one choice per decision: the attack on the most wounded enemy,
+    otherwise the first option.
+  - Character generation requests (see character_generator.py) get a game_state
+    {"players": [...]} JSON character named as asked, and lore sheet requests a short
+    lore text mentioning the name.
+  - Anything else gets a short canned text reply.
+
+GET /stats returns {"requests": n, "decisions": n, "failures": n, "peak_concurrency": n}.
+The simulated model latency is `latency` seconds per request plus `per_item_latency`
+per decision in it, so batching pays off the way it does against a real backend. With
+`fail_every` n, every n-th request is refused with HTTP 503 (and Retry-After: 0), to
+exercise clients' retries.
+
+Usage:
+    python3 mock_llm_server.py --port 8790 --latency 0.05
+"""
+
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8790
+
+
+def choose_option(decision):
+    """The mock's policy: attack the enemy with the lowest HP fraction, else take the first option."""
+    options = decision.get("options") or []
+    enemies = {enemy["name"]: enemy["hp"] / max(enemy["max_hp"], 1)
+               for enemy in (decision.get("status") or {}).get("enemies", [])}
+    attacks = [(enemies[option["target"]], index) for index, option in enumerate(options)
+               if option.get("type") == "attack" and option.get("target") in enemies]
+    return min(attacks)[1] if attacks else 0
+
+
+def generated_character(name):
+    """The mock's character for a generation request: a level 1 wizard, valid game_state data."""
+    return {
+        "name": name, "hp": 8, "ac": 12, "strength": 8, "dexterity": 14, "constitution": 12,
+        "intelligence": 16, "wisdom": 12, "charisma": 10, "class_type": "wizard", "damage": "1d6",
+        "inventory": [{"name": "Quarterstaff", "type": "melee", "damage": "1d6", "mod": "strength"}],
+        "spells": [{"name": "Fire Bolt", "type": "damage", "damage": "1d10", "healing": None, "effect": None,
+                    "save": None, "dc": None, "targeting": "single"}],
+        "conditions": {},
+    }
+
+
+def completion(content, model):
+    return {
+        "id": f"mock-{time.monotonic_ns()}",
+        "object": "chat.completion",
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+    }
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, so clients can reuse connections
+
+    def do_GET(self):
+        if self.path != "/stats":
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        self.send_json(200, self.server.stats())
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self.send_json(400, {"error": "Request body is not JSON."})
+            return
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+
+        messages = request.get("messages", [])
+        prompt = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+        system = next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+        try:
+            decisions = json.loads(prompt).get("decisions")
+        except (json.JSONDecodeError, AttributeError):
+            decisions = None
+        named = re.search(r"named '(.*?)'", prompt)
+        name = named.group(1) if named else "Nameless"
+
+        if isinstance(decisions, list):
+            content = json.dumps({"decisions": [{"id": d.get("id"), "option": choose_option(d)} for d in decisions]})
+            items = len(decisions)
+        elif "generating D&D 5e characters" in system:
+            content = f"```json\n{json.dumps({'players': [generated_character(name)]})}\n```"
+            items = 1
+        elif "lore sheets" in system:
+            content = f"{name} grew up far from home and never speaks of why.\n- Curious\n- Stubborn"
+            items = 1
+        else:
+            content = "The mock model has nothing to add."
+            items = 1
+        if not self.server.record(items):
+            self.send_json(503, {"error": "The mock backend is overloaded, try again."}, {"Retry-After": "0"})
+            return
+        try:
+            time.sleep(self.server.latency + self.server.per_item_latency * items)
+        finally:
+            self.server.finish()
+        self.send_json(200, completion(content, request.get("model", "mock")))
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # One line per request would drown out benchmark output
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, latency=0.0, per_item_latency=0.0, fail_every=0):
+        super().__init__((host, port), MockLLMHandler)
+        self.latency = latency
+        self.per_item_latency = per_item_latency
+        self.fail_every = fail_every
+        self.requests = 0
+        self.decisions = 0
+        self.failures = 0
+        self.in_flight = 0
+        self.peak_concurrency = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def record(self, items):
+        """Count a request; False if it is one to refuse (see fail_every), else it is now in flight."""
+        with self._lock:
+            self.requests += 1
+            if self.fail_every and self.requests % self.fail_every == 0:
+                self.failures += 1
+                return False
+            self.decisions += items
+            self.in_flight += 1
+            self.peak_concurrency = max(self.peak_concurrency, self.in_flight)
+            return True
+
+    def finish(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def stats(self):
+        with self._lock:
+            return {"requests": self.requests, "decisions": self.decisions, "failures": self.failures,
+                    "peak_concurrency": self.peak_concurrency}
+
+
+def start_mock_server(host=DEFAULT_HOST, port=0, latency=0.0, per_item_latency=0.0, fail_every=0):
+    """Start a mock server on a background thread (port 0 picks a free port) and return it."""
+    server = MockLLMServer(host, port, latency, per_item_latency, fail_every)
+    threading.Thread(target=server.serve_forever, daemon=True, name="mock-llm-server").start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a deterministic mock chat completions API.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every request")
+    parser.add_argument("--per-item-latency", type=float, default=0.0, help="Seconds added per decision in a batch")
+    parser.add_argument("--fail-every", type=int, default=0, help="Refuse every n-th request with HTTP 503")
+    args = parser.parse_args()
+
+    server = MockLLMServer(args.host, args.port, args.latency, args.per_item_latency, args.fail_every)
+    print(f"Mock LLM backend listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Monster templates: one shared stat block for the many identical NPCs of a generated world.
+
+A game_state may define templates by name; an NPC entry naming one only lists what is its
+own, usually a name and a position, and takes everything else from the template:
+
+    "templates": {"Goblin": {"hp": 7, "ac": 15, ..., "spells": [...], "inventory": [...]}},
+    "npcs": [{"template": "Goblin", "name": "Goblin 1", "position": [3, 4]}, ...]
+
+Each template builds its creature once, spells compiled, and an instance is a clone of it
+(Character.clone): it shares the spell list, inventory and spell handlers and owns only its
+HP, stats, conditions and position, so spawning costs a dictionary copy rather than a
+constructor call and a thousand goblins hold one copy of their spells between them.
+Identical spell and item definitions are also interned across templates, and each distinct
+spell is compiled once.
+
+Shared spells and items are read-only. An instance that overrides anything other than
+INSTANCE_FIELDS (or the HP of a stack) is built in full from the template data instead.
+"""
+
+from battle_grid import as_position
+from combat_engine import npc_class_for
+from spell_handlers import SpellDefinitionError, compile_spell
+
+# Fields an instance may set on its clone of the template's creature
+INSTANCE_FIELDS = ("name", "description", "position", "hp", "is_enemy", "ai_type", "ai_config")
+
+
+class SpecInterner:
+    """Keeps one shared copy of each distinct spell or item definition, and of each spell's handler."""
+
+    def __init__(self):
+        self.specs = {}  # repr -> the shared definition
+        self.handlers = {}  # id(shared spell) -> its compiled handler
+
+    def intern(self, spec):
+        # repr tells JSON values apart (1, 1.0 and True differ) at half the cost of json.dumps;
+        # the same definition with its keys in another order is merely kept twice
+        return self.specs.setdefault(repr(spec), spec)
+
+    def intern_all(self, specs):
+        return tuple(self.intern(spec) for spec in specs or ())
+
+    def compile(self, spell):
+        """The handler of a spell's shared copy (handler.spell), compiled on first sight."""
+        spell = self.intern(spell)
+        handler = self.handlers.get(id(spell))
+        if handler is None:
+            handler = self.handlers[id(spell)] = compile_spell(spell)
+        return handler
+
+
+class MonsterTemplate:
+    """A named stat block and the prototype creature its instances are cloned from."""
+
+    def __init__(self, name, data, interner=None):
+        interner = interner or SpecInterner()
+        self.name = name
+        self.data = dict(data)
+        self.data.setdefault("name", name)
+        self.data["spells"] = interner.intern_all(data.get("spells"))
+        self.data["inventory"] = interner.intern_all(data.get("inventory"))
+        try:
+            self.handlers = [interner.compile(spell) for spell in self.data["spells"]]
+        except SpellDefinitionError as error:
+            raise SpellDefinitionError(f"{name}: {error}") from None
+        self.prototype = npc_class_for(self.data)(**self.data)
+        self.prototype.compile_spells(self.handlers)
+        self.prototype.template = name
+
+    def spawn(self, **fields):
+        """A new creature from the template, with `fields` overriding the template's data."""
+        if any(field not in INSTANCE_FIELDS for field in fields) or (self.prototype.is_stack and "hp" in fields):
+            data = dict(self.data, **fields)
+            character = npc_class_for(data)(**data)
+            character.compile_spells(None if "spells" in fields else self.handlers)
+            character.template = self.name
+            return character
+
+        character = self.prototype.clone()
+        for field, value in fields.items():
+            if field == "hp":
+                character.hp = character.current_hp = character.stats["hp"] = value
+            elif field == "position":
+                character.position = as_position(value)
+            elif field == "ai_config":
+                character.ai_config = value or {}
+            else:
+                setattr(character, field, value)
+        return character
+
+
+def load_templates(templates, interner=None):
+    """{name: MonsterTemplate} for the "templates" object of a game_state."""
+    interner = interner or SpecInterner()
+    return {name: MonsterTemplate(name, data, interner) for name, data in templates.items()}
+
+
+def spawn_from(templates, data):
+    """Build the NPC of a game_state entry that names a template."""
+    fields = dict(data)
+    name = fields.pop("template")
+    template = templates.get(name)
+    if template is None:
+        raise ValueError(f"Unknown monster template {name!r} for NPC {data.get('name', '?')}.")
+    return template.spawn(**fields)
@@ -0,0 +1,209 @@
+"""
+A* movement over the battle grid.
+
+Squares are the 5-ft squares of Character.position; a step goes to any of the eight
+neighbouring squares and costs what the battle map says it costs to enter (5 ft on open
+ground, 10 ft on difficult terrain, impassable walls), or 5 ft everywhere without a map.
+Creatures may pass through their allies' squares but not their enemies', and never end
+their move on an occupied square.
+
+The heuristic is the open-ground distance (Chebyshev distance in feet), which never
+overestimates because no step is cheaper than 5 ft. A search that cannot reach its goal,
+or gives up after max_nodes expansions, returns the path to the closest square it found,
+so blocked creatures still get as near as they can.
+
+CombatEngine.find_path memoizes the results per (map version, occupancy version, side,
+start, goal): while nothing on the map has moved, asking again - the AI planning a move and
+the engine then making it, or MCTS replaying the same position - costs a dictionary lookup.
+
+Crowds use a FlowField instead: one Dijkstra search outwards from every square next to a
+target group gives each square its distance to the nearest of them, and any creature then
+heads for the group by stepping to its cheapest neighbour - O(1) per step, however many
+creatures share the field. When the targets move, only the squares whose shortest route ran
+through a changed square are searched again.
+"""
+
+import heapq
+import math
+
+from battle_grid import SQUARE_FEET
+
+MAX_NODES = 20000  # Squares expanded before a search settles for the closest square found
+NEIGHBOURS = ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1))
+
+
+def chebyshev(a, b):
+    return max(abs(a[0] - b[0]), abs(a[1] - b[1]))
+
+
+def find_path(start, goal, step_cost, goal_radius=0, max_nodes=MAX_NODES):
+    """
+    A* from start towards goal. step_cost(square) returns the feet it takes to enter a square
+    or None if it cannot be entered. The search succeeds on any square within goal_radius
+    squares of goal (1 to end next to an occupied goal). Returns (squares after start, total
+    cost, reached); if the goal cannot be reached, the path leads to the closest square found.
+    """
+    if chebyshev(start, goal) <= goal_radius:
+        return [], 0, True
+
+    def heuristic(square):
+        return max(chebyshev(square, goal) - goal_radius, 0) * SQUARE_FEET
+
+    came_from = {start: None}
+    cost_so_far = {start: 0}
+    closest, closest_h = start, heuristic(start)
+    frontier = [(closest_h, closest_h, 0, 0, start)]  # (f, h, tie breaker, cost, square)
+    counter = 0
+    expanded = 0
+    reached = None
+    while frontier and expanded < max_nodes:
+        _, h, _, cost, square = heapq.heappop(frontier)
+        if cost > cost_so_far[square]:
+            continue  # Superseded by a cheaper way to the same square
+        if h == 0:
+            reached = square
+            break
+        expanded += 1
+        for dx, dy in NEIGHBOURS:
+            neighbour = (square[0] + dx, square[1] + dy)
+            step = step_cost(neighbour)
+            if step is None:
+                continue
+            new_cost = cost + step
+            if new_cost < cost_so_far.get(neighbour, new_cost + 1):
+                cost_so_far[neighbour] = new_cost
+                came_from[neighbour] = square
+                neighbour_h = heuristic(neighbour)
+                if neighbour_h < closest_h:
+                    closest, closest_h = neighbour, neighbour_h
+                counter += 1
+                heapq.heappush(frontier, (new_cost + neighbour_h, neighbour_h, counter, new_cost, neighbour))
+
+    end = reached if reached is not None else closest
+    path = []
+    square = end
+    while square != start:
+        path.append(square)
+        square = came_from[square]
+    path.reverse()
+    return path, cost_so_far[end], reached is not None
+
+
+class FlowField:
+    """
+    Distances in feet from every square within bounds to the nearest goal square. step_cost
+    gives the terrain cost of entering a square (None: impassable); squares in `blocked`
+    (the targets' own squares) cannot be entered either. Updated in place by update().
+    """
+
+    def __init__(self, step_cost, bounds):
+        self.terrain_cost = step_cost
+        self.bounds = bounds  # (low x, low y, high x, high y), inclusive
+        self.goals = set()
+        self.blocked = set()
+        self.distance = {}  # square -> feet to the nearest goal
+        self.parent = {}  # square -> next square on its shortest route (None on goals)
+        self.settled = 0  # Squares searched by the last update, for stats and tests
+
+    def in_bounds(self, square):
+        low_x, low_y, high_x, high_y = self.bounds
+        return low_x <= square[0] <= high_x and low_y <= square[1] <= high_y
+
+    def step_cost(self, square):
+        if square in self.blocked or not self.in_bounds(square):
+            return None
+        return self.terrain_cost(square)
+
+    def update(self, goals, blocked=()):
+        """
+        Move the field to a new set of goal and blocked squares. Squares whose route ran
+        through a goal that went away or a square that changed blocking are forgotten and
+        searched again from their still-valid neighbours; everything else is kept.
+        """
+        blocked = set(blocked)
+        changed = self.blocked ^ blocked
+        self.blocked = blocked
+        goals = {goal for goal in goals if self.step_cost(goal) is not None}
+        stale = [square for square in (self.goals - goals) | changed if square in self.distance]
+        self.goals = goals
+
+        # Forget the shortest-route subtrees hanging off the stale squares
+        distance, parent = self.distance, self.parent
+        forgotten = []
+        while stale:
+            square = stale.pop()
+            if square not in distance:
+                continue
+            del distance[square]
+            del parent[square]
+            forgotten.append(square)
+            for dx, dy in NEIGHBOURS:
+                neighbour = (square[0] + dx, square[1] + dy)
+                if parent.get(neighbour) == square:
+                    stale.append(neighbour)
+
+        frontier = []
+        for square in forgotten + list(changed):
+            for dx, dy in NEIGHBOURS:
+                neighbour = (square[0] + dx, square[1] + dy)
+                if neighbour in distance:
+                    frontier.append((distance[neighbour], neighbour))
+        for goal in goals:
+            if distance.get(goal) != 0:
+                distance[goal] = 0
+                parent[goal] = None
+                frontier.append((0, goal))
+        heapq.heapify(frontier)
+        self._search(frontier)
+
+    def _search(self, frontier):
+        distance, parent = self.distance, self.parent
+        settled = 0
+        while frontier:
+            feet, square = heapq.heappop(frontier)
+            if feet > distance.get(square, math.inf):
+                continue
+            step = self.step_cost(square)
+            if step is None:
+                continue
+            settled += 1
+            # Whoever stands next to this square can reach a goal through it
+            for dx, dy in NEIGHBOURS:
+                neighbour = (square[0] + dx, square[1] + dy)
+                if self.step_cost(neighbour) is None:
+                    continue
+                new_feet = feet + step
+                if new_feet < distance.get(neighbour, math.inf):
+                    distance[neighbour] = new_feet
+                    parent[neighbour] = square
+                    heapq.heappush(frontier, (new_feet, neighbour))
+        self.settled = settled
+
+    def next_step(self, square):
+        """The neighbour to step to from a square towards the goals, or None (arrived or cut off)."""
+        if not self.distance.get(square):
+            return None
+        best, best_feet = None, math.inf
+        for dx, dy in NEIGHBOURS:
+            neighbour = (square[0] + dx, square[1] + dy)
+            feet = self.distance.get(neighbour)
+            if feet is None:
+                continue
+            feet += self.step_cost(neighbour)
+            if feet < best_feet:
+                best, best_feet = neighbour, feet
+        return best
+
+    def walk(self, start, budget):
+        """Follow the field from start for up to `budget` feet: [(square, feet spent so far), ...]."""
+        steps = []
+        square, spent = start, 0
+        while True:
+            square = self.next_step(square)
+            if square is None:
+                break
+            spent += self.step_cost(square)
+            if spent > budget:
+                break
+            steps.append((square, spent))
+        return steps
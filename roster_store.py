@@ -0,0 +1,263 @@
+"""
+Memory-mapped columnar store of NPCs for world-scale analytics.
+
+Answering "how is AC distributed across every NPC?" from game_state JSON means parsing and
+building a million characters. write_roster_store instead exports NPC entries once into a
+directory of column files, one .npy per column:
+  - numeric stats (hp, ac, abilities, speed, level, count, position) as fixed-width arrays,
+  - strings (name, class_type, damage, ai_type) dictionary-encoded: an int32 code per row
+    plus a <column>.values.npy array of the distinct strings (a missing value is stored as
+    "" and read back as None),
+  - everything else of an entry (spells, inventory, conditions, ...) as a dictionary-encoded
+    JSON "spec" column, so identical stat blocks are stored once,
+  - a flattened spell table (spell.row, spell.dc, spell.name, spell.type) with one row per
+    spell a character knows.
+
+RosterStore opens the directory with every column memory-mapped, so reads are zero-copy and
+only the pages a question touches are loaded:
+
+    store = RosterStore("world_store")
+    store.value_counts("ac")                                    # {10: 4120, 11: 9711, ...}
+    rows = store.where(class_type="wizard", ac=lambda ac: ac >= 15)
+    store.spell_dcs(rows).mean()
+    npcs = store.characters(rows[:10])                          # NonPlayerCharacter objects
+
+(.npz archives cannot be memory-mapped, which is why each column is its own .npy file.)
+"""
+
+import json
+import os
+from array import array
+
+import numpy as np
+
+from combat_engine import npc_class_for
+from game_state_loader import build_templates, expand_instance, iter_entries, validate_entry
+from monster_templates import SpecInterner
+
+NUMERIC_COLUMNS = {  # Column -> (entry field, default, dtype)
+    "hp": ("hp", None, "i4"), "ac": ("ac", None, "i4"),
+    "strength": ("strength", None, "i2"), "dexterity": ("dexterity", None, "i2"),
+    "constitution": ("constitution", None, "i2"), "intelligence": ("intelligence", None, "i2"),
+    "wisdom": ("wisdom", None, "i2"), "charisma": ("charisma", None, "i2"),
+    "speed": ("speed", 30, "i2"), "level": ("level", 1, "i2"), "count": ("count", 1, "i4"),
+    "is_enemy": ("is_enemy", True, "i1"),
+}
+STRING_COLUMNS = {"name": None, "class_type": None, "damage": None, "ai_type": "aggressive"}  # Column -> default
+NO_STRING = ""  # Stored for a missing (None) string value
+POSITION_COLUMNS = ("x", "y")
+NO_POSITION = -2 ** 31  # x and y of NPCs off the battle map
+NO_DC = -1  # spell.dc of spells without a saving throw
+SPELL_STRING_COLUMNS = ("spell.name", "spell.type")
+# Entry fields kept in the spec column; "count" is kept there too, to tell stacks apart
+COLUMN_FIELDS = set(NUMERIC_COLUMNS) - {"count"} | set(STRING_COLUMNS) | {"position"}
+MANIFEST = "manifest.json"
+ARRAY_TYPECODES = {"i1": "b", "i2": "h", "i4": "i"}
+
+
+class _Dictionary:
+    """Dictionary encoding of one string column while it is being written."""
+
+    def __init__(self):
+        self.codes = array("i")
+        self.index = {}
+
+    def add(self, value):
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.index)
+        self.codes.append(code)
+
+    def values(self):
+        return np.array(list(self.index) or [""], dtype=str)
+
+
+def _save(directory, name, values, dtype=None):
+    if dtype is not None:
+        values = np.frombuffer(values, dtype=dtype)
+    np.save(os.path.join(directory, f"{name}.npy"), values, allow_pickle=False)
+
+
+def write_roster_store(directory, entries, validate=True, templates=None):
+    """
+    Write NPC entries (game_state "npcs" dicts, from any iterable) as a columnar store in
+    `directory`, one row per entry in order. Entries are validated against the game_state
+    schema first unless validate=False. An entry naming a monster template (see
+    monster_templates) is expanded to the full entry from `templates`, {name: MonsterTemplate}.
+    Returns the number of rows written.
+    """
+    os.makedirs(directory, exist_ok=True)
+    numeric = {column: array(ARRAY_TYPECODES[dtype]) for column, (_, _, dtype) in NUMERIC_COLUMNS.items()}
+    positions = {column: array("i") for column in POSITION_COLUMNS}
+    strings = {column: _Dictionary() for column in STRING_COLUMNS}
+    specs = _Dictionary()
+    spell_rows, spell_dcs = array("i"), array("i")
+    spell_strings = {column: _Dictionary() for column in SPELL_STRING_COLUMNS}
+    interner = SpecInterner()
+
+    rows = 0
+    for entry in entries:
+        if "template" in entry:
+            entry = expand_instance(entry, f"npcs[{rows}]", templates or {}, interner)
+        elif validate:
+            validate_entry(entry, f"npcs[{rows}]", "npcs", interner=interner)
+        for column, (field, default, _) in NUMERIC_COLUMNS.items():
+            numeric[column].append(int(entry.get(field, default)))
+        position = entry.get("position") or (NO_POSITION, NO_POSITION)
+        positions["x"].append(position[0])
+        positions["y"].append(position[1])
+        for column, default in STRING_COLUMNS.items():
+            value = entry.get(column, default)
+            strings[column].add(NO_STRING if value is None else value)
+        specs.add(json.dumps({field: value for field, value in entry.items() if field not in COLUMN_FIELDS},
+                             sort_keys=True))
+        for spell in entry.get("spells") or ():
+            spell_rows.append(rows)
+            has_save = spell.get("save") not in (None, "", "none") and type(spell.get("dc")) is int
+            spell_dcs.append(spell["dc"] if has_save else NO_DC)
+            spell_strings["spell.name"].add(spell["name"])
+            spell_strings["spell.type"].add(spell["type"])
+        rows += 1
+
+    for column, values in numeric.items():
+        _save(directory, column, values, NUMERIC_COLUMNS[column][2])
+    for column, values in positions.items():
+        _save(directory, column, values, "i4")
+    for column, dictionary in list(strings.items()) + [("spec", specs)] + list(spell_strings.items()):
+        _save(directory, column, dictionary.codes, "i4")
+        _save(directory, f"{column}.values", dictionary.values())
+    _save(directory, "spell.row", spell_rows, "i4")
+    _save(directory, "spell.dc", spell_dcs, "i4")
+    with open(os.path.join(directory, MANIFEST), "w") as file:
+        json.dump({"rows": rows, "spells": len(spell_rows), "numeric": list(NUMERIC_COLUMNS) + list(POSITION_COLUMNS),
+                   "strings": list(STRING_COLUMNS) + ["spec"] + list(SPELL_STRING_COLUMNS)}, file)
+    return rows
+
+
+def export_game_state(file_path, directory):
+    """
+    Stream the NPCs of a game_state file (see game_state_loader.iter_entries) into a columnar
+    store, template instances expanded (the templates must come before the NPCs using them).
+    """
+    templates = {}
+    interner = SpecInterner()
+
+    def npcs(file):
+        for section, path, entry in iter_entries(file):
+            if section == "templates":
+                templates.update(build_templates(entry, path, interner))
+            elif section == "npcs":
+                yield entry
+
+    with open(file_path, "r") as file:
+        return write_roster_store(directory, npcs(file), templates=templates)
+
+
+class RosterStore:
+    """A columnar store written by write_roster_store, every column memory-mapped (mmap=False loads them)."""
+
+    def __init__(self, directory, mmap=True):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST), "r") as file:
+            manifest = json.load(file)
+        self.rows = manifest["rows"]
+        self.numeric = manifest["numeric"]
+        self.strings = manifest["strings"]
+        mode = "r" if mmap else None
+        self.columns = {}
+        self.values = {}
+        for column in self.numeric + self.strings + ["spell.row", "spell.dc"]:
+            self.columns[column] = np.load(os.path.join(directory, f"{column}.npy"), mmap_mode=mode)
+        for column in self.strings:
+            self.values[column] = np.load(os.path.join(directory, f"{column}.values.npy"), mmap_mode=mode)
+        self._specs = {}  # spec code -> decoded spec, shared by every character built from it
+        self._interner = SpecInterner()
+
+    def __len__(self):
+        return self.rows
+
+    def column(self, name):
+        """A column as stored: numbers, or the codes of a string column (zero-copy with mmap)."""
+        return self.columns[name]
+
+    def code_of(self, column, value):
+        """The code of a string in a dictionary-encoded column, or -1 if no row has it."""
+        if value is None:
+            value = NO_STRING
+        found = np.flatnonzero(self.values[column] == value)
+        return int(found[0]) if len(found) else -1
+
+    def decode(self, column, rows=None):
+        """The strings of a dictionary-encoded column, for the given rows (all rows by default)."""
+        codes = self.columns[column] if rows is None else self.columns[column][rows]
+        return self.values[column][codes]
+
+    def mask(self, **predicates):
+        """
+        Boolean row mask for predicates on columns: a value (equality; strings are matched by
+        their code), a list, tuple, set or range of values (any of them) or a function of the
+        column array returning a mask, e.g. ac=lambda ac: ac >= 15.
+        """
+        selected = np.ones(self.rows, dtype=bool)
+        for column, predicate in predicates.items():
+            data = self.columns[column]
+            if callable(predicate):
+                selected &= predicate(data)
+            elif isinstance(predicate, (list, tuple, set, range)):
+                if column in self.values:
+                    predicate = [self.code_of(column, value) for value in predicate]
+                selected &= np.isin(data, list(predicate))
+            else:
+                selected &= data == (self.code_of(column, predicate) if column in self.values else predicate)
+        return selected
+
+    def where(self, **predicates):
+        """Indices of the rows matching every predicate (see mask)."""
+        return np.flatnonzero(self.mask(**predicates))
+
+    def value_counts(self, column, rows=None):
+        """{value: number of rows} of a column, over the given rows (all by default)."""
+        data = self.columns[column] if rows is None else self.columns[column][rows]
+        codes, counts = np.unique(data, return_counts=True)
+        if column in self.values:
+            return {str(self.values[column][code]): int(count) for code, count in zip(codes, counts)}
+        return {int(code): int(count) for code, count in zip(codes, counts)}
+
+    def spell_dcs(self, rows=None):
+        """DCs of the saving-throw spells known by the given rows (all rows by default)."""
+        dcs = self.columns["spell.dc"]
+        if rows is not None:
+            dcs = dcs[np.isin(self.columns["spell.row"], rows)]
+        return dcs[dcs != NO_DC]
+
+    def entry(self, row):
+        """The game_state entry of one row."""
+        row = int(row)
+        code = int(self.columns["spec"][row])
+        spec = self._specs.get(code)
+        if spec is None:
+            spec = self._specs[code] = json.loads(str(self.values["spec"][code]))
+            spec["spells"] = [self._interner.intern(spell) for spell in spec.get("spells") or ()]
+        entry = dict(spec)
+        for column, (field, default, _) in NUMERIC_COLUMNS.items():
+            value = int(self.columns[column][row])
+            if field == "is_enemy":
+                value = bool(value)
+            if field not in spec and (field in COLUMN_FIELDS or value != default):
+                entry[field] = value
+        for column in STRING_COLUMNS:
+            entry[column] = str(self.values[column][self.columns[column][row]]) or None
+        x = int(self.columns["x"][row])
+        if x != NO_POSITION:
+            entry["position"] = [x, int(self.columns["y"][row])]
+        return entry
+
+    def characters(self, rows):
+        """NonPlayerCharacter (or NPCStack) objects for the given rows; identical stat blocks share their spells."""
+        characters = []
+        for row in rows:
+            entry = self.entry(row)
+            character = npc_class_for(entry)(**entry)
+            character.compile_spells([self._interner.compile(spell) for spell in entry["spells"]])
+            characters.append(character)
+        return characters
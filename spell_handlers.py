@@ -0,0 +1,345 @@
+"""
+Spells compiled to handler objects.
+
+A spell dict is compiled once, by Character.compile_spells() (at load time for characters
+from load_characters_from_dict and character_from_dict), into the handler for its
+kind of resolution:
+  - AttackSpell: damage on a spell attack roll (Fire Bolt),
+  - SaveDamageSpell: save-for-half damage, optionally with a condition on a failure (Fireball),
+  - HealingSpell,
+  - ConditionSpell: a condition, with an optional save to resist it ("condition" and
+    "utility" spells such as Hold Person),
+  - ConditionRemovalSpell: removes one or all conditions (Lesser/Greater Restoration),
+  - EffectSpell: a buff or debuff on an attribute (Bless, Bane).
+
+Handlers hold the parsed damage/healing dice, the save ability and DC and the condition's
+CONDITIONS_DICT entry, so CombatEngine.cast_spell only picks the targets and dispatches.
+Malformed definitions - unknown types, unparseable dice, a save without a DC - raise
+SpellDefinitionError when compiled instead of failing mid-combat.
+
+Area spells that catch BATCH_TARGETS or more creatures resolve in one batch: saving throws
+are rolled without per-creature logging (roll_saves), damage is applied in bulk, conditions go
+to the failures through apply_condition_batch, and the log gets one summary line per step
+instead of several lines per creature - per-creature logging, not dice, is what made a
+fireball into a crowd slow. The batch follows the rules of the one-by-one path exactly: each
+creature rolls with its own save_advantage(), a save against a condition strips any instance
+of it the creature already has, and creatures roll in target order, so the same dice resolve
+a spell the same way whether it catches 7 creatures or 8.
+
+A "save" that is null, empty or "none" means no saving throw. Effects naming a condition that is not in
+CONDITIONS_DICT (descriptive utility effects such as Light's "bright") compile, and have no
+mechanical effect when cast.
+"""
+
+import d20
+
+from area_templates import area_of
+from combat_engine import CONDITIONS_DICT, log_message, quiet_mode, roll_with_advantage_disadvantage
+from horde import roll_d20_batch
+
+SPELL_TYPES = ("damage", "healing", "condition", "utility", "buff", "debuff")
+TARGETINGS = ("self", "single", "aoe")
+SAVES = ("strength", "dexterity", "constitution", "intelligence", "wisdom", "charisma")
+REMOVAL_MODES = ("remove_one", "remove_all")
+BATCH_TARGETS = 8  # Creatures caught by an area spell from which it resolves in one batch
+
+
+class SpellDefinitionError(ValueError):
+    """A spell definition that cannot be cast: raised when the spell is compiled."""
+
+
+def _parse_dice(spell, key):
+    try:
+        return d20.parse(str(spell[key]))
+    except d20.RollError as error:
+        raise SpellDefinitionError(f"{spell['name']}: cannot parse {key} dice {spell[key]!r} ({error}).") from None
+
+
+def roll_saves(targets, save, dc, condition=None):
+    """
+    Every target's saving throw, unlogged: a list of successes, in target order. Each target
+    rolls with its own save_advantage(), as Character.saving_throw does, and a success against
+    `condition` removes any instance of it the target already has.
+    """
+    advantages = [target.save_advantage() for target in targets]
+    if all(advantage == "normal" for advantage in advantages):
+        faces = roll_d20_batch(len(targets))
+    else:
+        faces = [roll_d20_batch(1, advantage)[0] for advantage in advantages]
+    saved = [face + target.save_bonus(save) >= dc for face, target in zip(faces, targets)]
+    if condition is not None:
+        with quiet_mode():
+            for target, success in zip(targets, saved):
+                if success:
+                    target.remove_condition_on_save(condition)
+    return saved
+
+
+def resists_condition(target, save, dc, condition, rolls=1):
+    """
+    True if the target makes one of `rolls` saving throws against a condition, rolled in turn
+    (a condition spell gets the spell's save and then the condition's own one, see
+    apply_condition_with_effects).
+    """
+    return any(roll_saves([target], save, dc, condition)[0] for _ in range(rolls))
+
+
+def apply_condition_batch(targets, condition, duration, save=None, dc=None):
+    """
+    Apply a condition to many creatures at once. With a save, each creature first gets the
+    condition's own saving throw (as apply_condition_with_effects makes for a spell with a
+    save); the per-creature bookkeeping is not logged. Returns the creatures now affected.
+    """
+    if save:
+        targets = [target for target in targets if not resists_condition(target, save, dc, condition)]
+    with quiet_mode():
+        for target in targets:
+            target.apply_condition_with_effects(condition, duration)
+    return targets
+
+
+def _names(creatures):
+    return ", ".join(creature.name for creature in creatures)
+
+
+def spell_save(spell):
+    """The spell's saving throw ability, or None for no save (missing, null, "" or "none")."""
+    save = spell.get('save')
+    if not save or str(save).lower() == "none":
+        return None
+    return save
+
+
+def _effect(spell, *keys):
+    effect = spell.get('effect')
+    if not isinstance(effect, dict) or any(key not in effect for key in keys):
+        raise SpellDefinitionError(f"{spell['name']}: a {spell['type']} spell needs an effect with {' and '.join(keys)}.")
+    return effect
+
+
+class SpellHandler:
+    """Resolution of one spell; subclasses implement resolve() for their kind of spell."""
+
+    def __init__(self, spell):
+        self.spell = spell
+        self.name = spell['name']
+        self.targeting = spell['targeting']
+        self.beneficial = spell['type'] in ('healing', 'buff')  # Single-target default: allies, not enemies
+        self.area = area_of(spell) if self.targeting == "aoe" else None
+        self.save = spell_save(spell)
+        self.dc = spell.get('dc')
+        if self.save is not None:
+            if self.save not in SAVES:
+                raise SpellDefinitionError(f"{self.name}: unknown saving throw {self.save!r} (expected one of {', '.join(SAVES)}).")
+            if not isinstance(self.dc, int):
+                raise SpellDefinitionError(f"{self.name}: a {self.save} save needs an integer dc, got {self.dc!r}.")
+
+    def resolve(self, engine, actor, targets, spell_mod, adv_disadv):
+        raise NotImplementedError
+
+    def _apply_condition(self, actor, target):
+        log_message(f"[bold yellow]Applying {self.condition} to {target.name} for {self.duration} round(s).[/bold yellow]")
+        # Spells with a save pass themselves on, as before, for the condition's own saving throw
+        target.apply_condition_with_effects(self.condition, self.duration, self.spell if self.save else None)
+        log_message(f"[bold yellow]{actor.name} successfully cast {self.name} on {target.name}![/bold yellow]")
+
+
+class AttackSpell(SpellHandler):
+    """Damage on a spell attack roll against each target's AC (one roll for all of them)."""
+
+    def __init__(self, spell):
+        super().__init__(spell)
+        self.damage = _parse_dice(spell, 'damage')
+
+    def resolve(self, engine, actor, targets, spell_mod, adv_disadv):
+        attack_roll = roll_with_advantage_disadvantage(spell_mod, adv_disadv)
+        for target in targets:
+            target_ac = engine.effective_ac(actor, target)
+            log_message(f"{actor.name} rolls a {attack_roll.result} ({adv_disadv}) to hit {target.name}'s AC of {target_ac} with the {self.name} spell.")
+            if attack_roll.total >= target_ac:
+                damage_roll = d20.roll(self.damage)
+                log_message(f"The spell hits! {actor.name} rolls a {self.spell['damage']} for a total damage of {damage_roll.total}.")
+                log_message(f"{target.name} takes {damage_roll.total} damage.")
+                target.take_damage(damage_roll.total)
+            else:
+                log_message(f"{target.name} dodges {self.name}!")
+            engine.check_target_status(target)
+
+
+class SaveDamageSpell(SpellHandler):
+    """One damage roll, halved for targets that make their save; a condition may follow a failure."""
+
+    def __init__(self, spell):
+        super().__init__(spell)
+        self.damage = _parse_dice(spell, 'damage')
+        effect = spell.get('effect') or {}
+        self.condition = effect.get('modifier')
+        self.duration = effect.get('duration', 1)
+        if CONDITIONS_DICT.get(self.condition) is None:
+            self.condition = None  # Descriptive effects such as a damage type carry no condition
+
+    def resolve(self, engine, actor, targets, spell_mod, adv_disadv):
+        damage_roll = d20.roll(self.damage)
+        log_message(f"{actor.name} rolls {self.spell['damage']} for a total of damage of {damage_roll}!")
+        if len(targets) >= BATCH_TARGETS:
+            self._resolve_batch(engine, targets, damage_roll.total)
+            return
+        for target in targets:
+            if target.take_save_damage(self.save, self.dc, damage_roll.total) and self.condition is not None:
+                self._apply_condition(actor, target)
+            engine.check_target_status(target)
+
+    def _resolve_batch(self, engine, targets, damage):
+        # In target order, each creature's damage save then (on a failure) its condition save,
+        # like the one-by-one path; stacks roll their members' saves in one batch
+        half = damage // 2
+        singles = failures = 0
+        affected = []
+        for target in targets:
+            if target.is_stack:
+                failed = target.take_save_damage(self.save, self.dc, damage)
+            else:
+                failed = not roll_saves([target], self.save, self.dc)[0]
+                target.take_damage(damage if failed else half)
+                singles += 1
+                failures += failed
+            if failed and self.condition is not None \
+                    and not resists_condition(target, self.save, self.dc, self.condition):
+                affected.append(target)
+        log_message(f"{singles - failures} of {singles} creatures succeed on the {self.save} saving throw "
+                    f"(half damage: {half}), {failures} take full damage: {damage}.")
+        if self.condition is not None:
+            apply_condition_batch(affected, self.condition, self.duration)
+            if affected:
+                log_message(f"[bold yellow]{self.name} leaves {_names(affected)} {self.condition} for {self.duration} round(s).[/bold yellow]")
+        engine.check_targets_status(targets)
+
+
+class HealingSpell(SpellHandler):
+    def __init__(self, spell):
+        super().__init__(spell)
+        self.healing = _parse_dice(spell, 'healing')
+
+    def resolve(self, engine, actor, targets, spell_mod, adv_disadv):
+        healing_roll = d20.roll(self.healing)
+        log_message(f"{actor.name} rolls {healing_roll.result} for healing.")
+        for target in targets:
+            target.heal(healing_roll.total)
+            log_message(f"{target.name} is healed for {healing_roll.total} HP and now has {target.current_hp} HP.")
+
+
+class ConditionSpell(SpellHandler):
+    """A condition from CONDITIONS_DICT on every target that fails its save (if the spell has one)."""
+
+    def __init__(self, spell):
+        super().__init__(spell)
+        effect = _effect(spell, 'modifier')
+        self.condition = effect['modifier']
+        self.duration = effect.get('duration', 1)
+        self.condition_data = CONDITIONS_DICT.get(self.condition)
+
+    def resolve(self, engine, actor, targets, spell_mod, adv_disadv):
+        log_message(f"[bold magenta]Processing {self.spell['type']} spell: {self.name} applies {self.condition}[/bold magenta]")
+        if self.condition_data is None:
+            log_message(f"{self.name}: {self.condition} is not a known condition, the spell has no effect.")
+            return
+        if len(targets) >= BATCH_TARGETS:
+            failed = targets
+            if self.save:
+                # The spell's save, then the condition's own save (as _apply_condition makes), creature by creature
+                failed = [target for target in targets if not resists_condition(target, self.save, self.dc, self.condition, 2)]
+                log_message(f"{len(targets) - len(failed)} of {len(targets)} creatures succeed on the {self.save} saving throw "
+                            f"(DC {self.dc}) and avoid {self.condition}.")
+            affected = apply_condition_batch(failed, self.condition, self.duration)
+            if affected:
+                log_message(f"[bold yellow]{self.name} leaves {_names(affected)} {self.condition} for {self.duration} round(s).[/bold yellow]")
+            return
+        for target in targets:
+            log_message(f"Attempting to apply {self.condition} to {target.name}...")
+            if self.save:
+                log_message(f"{target.name} must make a {self.save} saving throw (DC {self.dc}) to resist {self.condition}.")
+                if target.saving_throw(target, self.save, self.dc, self.condition):
+                    log_message(f"[bold green]{target.name} succeeds on the saving throw and avoids {self.condition}![/bold green]")
+                    continue
+                log_message(f"[bold red]{target.name} fails the saving throw and is affected by {self.condition}.[/bold red]")
+            self._apply_condition(actor, target)
+
+
+class ConditionRemovalSpell(SpellHandler):
+    """Removes the first ("remove_one") or every ("remove_all") effect on each target."""
+
+    def __init__(self, spell):
+        super().__init__(spell)
+        self.mode = _effect(spell, 'modifier')['modifier']
+        if self.mode not in REMOVAL_MODES:
+            raise SpellDefinitionError(f"{self.name}: unknown condition removal {self.mode!r} (expected one of {', '.join(REMOVAL_MODES)}).")
+
+    def resolve(self, engine, actor, targets, spell_mod, adv_disadv):
+        log_message(f"[bold magenta]Processing condition removal spell: {self.name} ({self.mode})[/bold magenta]")
+        for target in targets:
+            removed = list(target.unified_effects)
+            if self.mode == 'remove_one':
+                removed = removed[:1]
+            for effect_name in removed:
+                target.unified_effects[effect_name].remove(target)
+                del target.unified_effects[effect_name]
+            if not removed:
+                log_message(f"{target.name} has no conditions to remove.")
+                continue
+            target.mark_changed()
+            if self.mode == 'remove_one':
+                log_message(f"[bold yellow]{actor.name} cast {self.name} on {target.name}, removing {removed[0]}.[/bold yellow]")
+            else:
+                log_message(f"[bold yellow]{actor.name} cast {self.name} on {target.name}, removing all conditions: {removed}[/bold yellow]")
+
+
+class EffectSpell(SpellHandler):
+    """A buff or debuff modifying one attribute of every target for a number of rounds."""
+
+    def __init__(self, spell):
+        super().__init__(spell)
+        effect = _effect(spell, 'attribute', 'modifier')
+        self.effect_type = spell['type']
+        self.attribute = effect['attribute']
+        self.modifier = effect['modifier']
+        self.duration = effect.get('duration', 1)
+
+    def resolve(self, engine, actor, targets, spell_mod, adv_disadv):
+        log_message(f"[bold magenta]Processing {self.effect_type} spell: {self.name} modifies {self.attribute} by {self.modifier}[/bold magenta]")
+        for target in targets:
+            target.apply_effect(self.name, self.attribute, self.modifier, self.duration, effect_type=self.effect_type)
+            if self.effect_type == "buff":
+                log_message(f"[bold yellow]{actor.name} cast buff {self.name} on {target.name}: {self.attribute} is modified by {self.modifier} for {self.duration} round(s).[/bold yellow]")
+            else:
+                log_message(f"[bold yellow]{actor.name} cast {self.name} on {target.name} debuffing it with {self.modifier} for {self.duration} round(s).[/bold yellow]")
+            log_message(f"{target.name} is now affected by the {self.effect_type} for {self.duration} rounds.")
+
+
+def compile_spell(spell):
+    """The handler for a spell dict; raises SpellDefinitionError if it cannot be cast."""
+    if not isinstance(spell, dict) or not spell.get('name'):
+        raise SpellDefinitionError(f"A spell needs a name: {spell!r}.")
+    name = spell['name']
+    if spell.get('type') not in SPELL_TYPES:
+        raise SpellDefinitionError(f"{name}: unknown spell type {spell.get('type')!r} (expected one of {', '.join(SPELL_TYPES)}).")
+    if spell.get('targeting') not in TARGETINGS:
+        raise SpellDefinitionError(f"{name}: unknown targeting {spell.get('targeting')!r} (expected one of {', '.join(TARGETINGS)}).")
+    try:
+        # The same order of precedence as the spell's keys were always read in
+        if spell.get('damage'):
+            return SaveDamageSpell(spell) if spell_save(spell) else AttackSpell(spell)
+        if spell.get('healing'):
+            return HealingSpell(spell)
+        if spell['type'] == 'condition':
+            return ConditionSpell(spell)
+        if spell['type'] == 'utility':
+            if (spell.get('effect') or {}).get('attribute') == 'condition_removal':
+                return ConditionRemovalSpell(spell)
+            return ConditionSpell(spell)
+        if spell['type'] in ('buff', 'debuff'):
+            return EffectSpell(spell)
+    except SpellDefinitionError:
+        raise
+    except ValueError as error:
+        raise SpellDefinitionError(str(error)) from None  # e.g. an unknown area shape
+    raise SpellDefinitionError(f"{name}: a {spell['type']} spell needs {'damage' if spell['type'] == 'damage' else 'healing'} dice.")
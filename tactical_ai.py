@@ -0,0 +1,345 @@
+"""
+Expected-value tactical AI (ai_type "tactical").
+
+Every legal action - each damaging weapon against each enemy, each spell against each
+target it can take, heals, buffs, debuffs and condition removal - is scored analytically
+in expected hit points: exact to-hit and saving throw probabilities from the d20 face
+distribution (with advantage/disadvantage and natural 1/20 rules), exact damage
+distributions from the dice expressions, and the chance each attack finishes its target.
+The rules mirror CombatEngine.attack, cast_spell and Character.saving_throw, so the AI
+plays the game the engine actually implements.
+
+Scores are cached per (actor, target, action). Each entry carries the state_version of
+the actor and every target, so any HP, stat or effect change invalidates it.
+"""
+
+import weakref
+from functools import lru_cache
+
+from combat_engine import (
+    CONDITIONS_DICT,
+    DICE_TERM,
+    HARMFUL_EFFECT_TYPES,
+    expected_dice_value,
+    log_message,
+)
+from spell_handlers import spell_save
+
+KILL_WEIGHT = 2.0  # Turns of the victim's damage output that a kill is worth
+VALUED_ROUNDS = 3  # Longer effects are valued as if they lasted this many rounds
+MAX_CACHED_SCORES = 4096  # Per actor; the cache is cleared when it grows past this
+
+_score_caches = weakref.WeakKeyDictionary()
+
+
+# --- Probabilities ---
+
+@lru_cache(maxsize=None)
+def d20_face_probabilities(adv_disadv="normal"):
+    """Probability of each natural d20 result 1..20 (index 0 is face 1)."""
+    if adv_disadv == "advantage":
+        return tuple((face * face - (face - 1) ** 2) / 400 for face in range(1, 21))
+    if adv_disadv == "disadvantage":
+        return tuple(((21 - face) ** 2 - (20 - face) ** 2) / 400 for face in range(1, 21))
+    return (1 / 20,) * 20
+
+
+@lru_cache(maxsize=None)
+def weapon_hit_probabilities(attack_mod, ac, adv_disadv="normal"):
+    """(P(normal hit), P(critical hit)) for a weapon attack: natural 20 crits, natural 1 misses."""
+    faces = d20_face_probabilities(adv_disadv)
+    hit = sum(p for face, p in enumerate(faces, 1) if 1 < face < 20 and face + attack_mod >= ac)
+    return hit, faces[19]
+
+
+@lru_cache(maxsize=None)
+def check_success_probability(modifier, dc, adv_disadv="normal"):
+    """P(d20 + modifier >= dc) with no natural 1/20 rules (spell attacks and saving throws)."""
+    faces = d20_face_probabilities(adv_disadv)
+    return sum(p for face, p in enumerate(faces, 1) if face + modifier >= dc)
+
+
+def save_success_probability(target, save, dc):
+    """Chance the target makes a saving throw, using the same modifier as Character.saving_throw."""
+    return check_success_probability(target.save_bonus(save), dc, target.save_advantage())
+
+
+@lru_cache(maxsize=1024)
+def damage_distribution(expression, multiplier=1, bonus=0):
+    """
+    Exact distribution of multiplier * (dice expression) + bonus as a tuple of
+    (value, probability) pairs, or None if the expression cannot be parsed.
+    """
+    if expected_dice_value(expression) is None:
+        return None
+    distribution = {0: 1.0}
+    position = 0
+    while position < len(expression):
+        match = DICE_TERM.match(expression, position)
+        sign = -1 if match.group(1) == "-" else 1
+        if match.group(3):
+            sides = int(match.group(3))
+            for _ in range(int(match.group(2) or 1)):
+                rolled = {}
+                for value, p in distribution.items():
+                    for face in range(1, sides + 1):
+                        total = value + sign * face
+                        rolled[total] = rolled.get(total, 0.0) + p / sides
+                distribution = rolled
+        else:
+            distribution = {value + sign * int(match.group(4)): p for value, p in distribution.items()}
+        position = match.end()
+    return tuple(sorted((value * multiplier + bonus, p) for value, p in distribution.items()))
+
+
+def expected_damage_and_kill(distribution, hp):
+    """Expected damage capped at the target's HP, and the probability it drops to 0."""
+    expected = kill = 0.0
+    for value, p in distribution:
+        expected += p * min(max(value, 0), hp)
+        if value >= hp:
+            kill += p
+    return expected, kill
+
+
+# --- Heuristic values of effects ---
+
+def threat(character):
+    """Rough damage per turn a character deals, used to value kills and disabling conditions."""
+    weapon = character.capabilities.best_weapon
+    if weapon is None:
+        return 1.0
+    return 0.6 * (character.capabilities.weapon_damage[id(weapon)] + max(character.str_mod, character.dex_mod, 0))
+
+
+def condition_value(condition_name, target, duration):
+    """Expected HP saved by imposing a condition on the target for `duration` rounds."""
+    rounds = min(duration or 1, VALUED_ROUNDS)
+    condition = CONDITIONS_DICT.get(condition_name)
+    if condition is None:
+        return 0.5 * rounds
+    self_effects = condition["self_effects"]
+    value = 0.0
+    if self_effects.get("actions") == "none":
+        value += threat(target) * rounds  # Loses its turns
+    elif self_effects.get("attack_roll") == "disadvantage":
+        value += 0.25 * threat(target) * rounds
+    if condition["interaction_effects"].get("attack_roll_against") == "advantage":
+        value += 0.5 * rounds
+    if condition_name in target.unified_effects:
+        value *= 0.25  # Only extends what is already there
+    return value
+
+
+def modifier_value(attribute, modifier, character, duration):
+    """Value of a buff/debuff modifier for the character receiving it (positive = helps them)."""
+    rounds = min(duration or 1, VALUED_ROUNDS)
+    if attribute == "adv_disadv":
+        sign = {"advantage": 1, "disadvantage": -1}.get(modifier, 0)
+        return sign * 0.25 * threat(character) * rounds
+    if not isinstance(modifier, (int, float)):
+        return 0.5 * rounds
+    if attribute == "ac":
+        return modifier * 0.5 * rounds
+    if attribute == "hp":
+        return modifier * 0.5
+    return modifier * 0.25 * rounds
+
+
+# --- Scoring ---
+
+class TacticalPlanner:
+    """Enumerates and scores an NPC's legal actions against the current battlefield."""
+
+    def __init__(self, actor, all_characters):
+        self.actor = actor
+        self.allies = [actor] + [ally for ally in actor.get_allies(all_characters) if ally.is_alive()]
+        self.enemies = [enemy for enemy in actor.get_enemies(all_characters) if enemy.is_alive()]
+        self.engine = getattr(all_characters, "engine", None)
+        battle_map = getattr(self.engine, "battle_map", None)
+        self.terrain = battle_map.version if battle_map is not None else None  # Cover changes with the obstacles
+        self.ally_ids = {id(ally) for ally in self.allies}
+        cache = _score_caches.get(actor)
+        if cache is None or len(cache) > MAX_CACHED_SCORES:
+            cache = _score_caches[actor] = {}
+        self.cache = cache
+
+    def legal_actions(self):
+        for weapon in self.actor.capabilities.damaging_weapons:
+            for enemy in self.enemies:
+                if self.can_target(enemy, weapon):
+                    yield {"type": "attack", "target": enemy, "weapon": weapon}
+        for spell in self.actor.spells or ():
+            targeting = spell.get("targeting")
+            if targeting == "self":
+                yield {"type": "cast_spell", "spell": spell, "target": [self.actor]}
+            elif targeting == "aoe":
+                action = self.area_action(spell)
+                if action is not None:
+                    yield action
+            elif targeting == "single":
+                beneficial = spell.get("type") in ("healing", "buff") or \
+                    (spell.get("effect") or {}).get("attribute") == "condition_removal"
+                for target in (self.allies if beneficial else self.enemies):
+                    if self.engine is None or self.engine.has_line_of_sight(self.actor, target):
+                        yield {"type": "cast_spell", "spell": spell, "target": [target]}
+
+    def can_target(self, target, weapon):
+        if self.engine is not None:
+            return self.engine.can_target(self.actor, target, weapon)
+        return self.actor.is_in_range(target, weapon)
+
+    def armor_class(self, target):
+        """The target's AC against the actor, with cover from the battle map."""
+        return self.engine.effective_ac(self.actor, target) if self.engine is not None else target.ac
+
+    def area_action(self, spell):
+        """
+        An area spell as CombatEngine.cast_spell will resolve it: everyone in the best placement
+        of its template on the battle map (friendly fire included), otherwise all enemies.
+        """
+        if self.actor.position is None or self.engine is None:
+            return {"type": "cast_spell", "spell": spell, "target": list(self.enemies)} if self.enemies else None
+        area = self.engine.place_area(self.actor, spell)
+        if area is None:
+            return None
+        targets = self.engine.area_targets(self.actor, spell, area["origin"], area["facing"])
+        return {"type": "cast_spell", "spell": spell, "target": targets, "area": area}
+
+    def score(self, action):
+        """Expected value of an action in hit points, cached until anyone involved changes."""
+        targets = action["target"] if isinstance(action["target"], list) else [action["target"]]
+        item = action["weapon"] if action["type"] == "attack" else action["spell"]
+        key = (action["type"], id(item), self.actor.state_version, self.terrain,
+               tuple((id(target), target.state_version) for target in targets))
+        score = self.cache.get(key)
+        if score is None:
+            if action["type"] == "attack":
+                score = self.score_attack(action["weapon"], targets[0])
+            else:
+                score = self.score_spell(action["spell"], targets)
+            self.cache[key] = score
+        return score
+
+    def side(self, target):
+        """+1 for enemies of the actor, -1 for its allies (friendly fire counts against it)."""
+        return -1 if id(target) in self.ally_ids else 1
+
+    def harm_value(self, target, distribution):
+        expected, kill = expected_damage_and_kill(distribution, target.current_hp)
+        return self.side(target) * (expected + kill * KILL_WEIGHT * threat(target))
+
+    def attack_advantage(self, target):
+        """The advantage state CombatEngine.attack ends up rolling with."""
+        adv_disadv = None
+        for name, effect in target.unified_effects.items():
+            if effect.active and name in CONDITIONS_DICT:
+                against = CONDITIONS_DICT[name]["interaction_effects"]["attack_roll_against"]
+                if against in ("advantage", "disadvantage"):
+                    adv_disadv = against
+        for name, effect in self.actor.unified_effects.items():
+            if effect.active and name in CONDITIONS_DICT:
+                own = CONDITIONS_DICT[name]["self_effects"].get("attack_roll")
+                if own in ("advantage", "disadvantage"):
+                    adv_disadv = own
+        return adv_disadv or getattr(self.actor, "adv_disadv", "normal")
+
+    def score_attack(self, weapon, target):
+        actor = self.actor
+        if weapon.get("finesse"):
+            attack_mod = max(actor.calculate_modifier("strength"), actor.calculate_modifier("dexterity"))
+        else:
+            attack_mod = actor.calculate_modifier(weapon.get("mod", "strength"))
+        hit, crit = weapon_hit_probabilities(attack_mod, self.armor_class(target), self.attack_advantage(target))
+        auto_crit = actor.is_within_melee_range(target) and any(
+            effect.active and CONDITIONS_DICT.get(name, {}).get("interaction_effects", {}).get("critical_hit") == "yes"
+            for name, effect in target.unified_effects.items())
+        if auto_crit:
+            hit, crit = 0.0, 1.0  # The engine checks for automatic crits before natural 1s
+        normal = damage_distribution(weapon["damage"], 1, attack_mod)
+        critical = damage_distribution(weapon["damage"], 2, attack_mod)
+        return hit * self.harm_value(target, normal) + crit * self.harm_value(target, critical)
+
+    def score_spell(self, spell, targets):
+        spell_type = spell.get("type")
+        effect = spell.get("effect") or {}
+        duration = effect.get("duration", 1)
+        score = 0.0
+        save = spell_save(spell)  # None for a missing, null, "" or "none" save, as the engine reads it
+        if save is not None and not isinstance(spell.get("dc"), int):
+            return 0.0  # The engine cannot resolve a save without a DC
+
+        if spell.get("damage") and save is None:
+            distribution = damage_distribution(spell["damage"])
+            if distribution is None:
+                return 0.0
+            spell_mod = self.actor.calculate_modifier("spell")
+            adv_disadv = getattr(self.actor, "adv_disadv", "normal")
+            for target in targets:
+                hit = check_success_probability(spell_mod, self.armor_class(target), adv_disadv)
+                score += hit * self.harm_value(target, distribution)
+
+        elif spell.get("damage"):
+            full = damage_distribution(spell["damage"])
+            if full is None:
+                return 0.0
+            half = tuple((value // 2, p) for value, p in full)
+            for target in targets:
+                saved = save_success_probability(target, save, spell["dc"])
+                score += saved * self.harm_value(target, half) + (1 - saved) * self.harm_value(target, full)
+                if effect:
+                    score += (1 - saved) * self.side(target) * condition_value(effect.get("modifier"), target, duration)
+
+        elif spell.get("healing"):
+            healed = expected_dice_value(spell["healing"]) or 0.0
+            for target in targets:
+                missing = target.hp - target.current_hp
+                urgency = 2.0 - target.current_hp / target.hp if target.hp > 0 else 1.0
+                score -= self.side(target) * min(healed, missing) * urgency
+
+        elif spell_type == "utility" and effect.get("attribute") == "condition_removal":
+            for target in targets:
+                active = [(name, e) for name, e in target.unified_effects.items() if e.active]
+                if effect.get("modifier") == "remove_one":
+                    active = active[:1]  # The engine removes the first effect it finds
+                for name, removed in active:
+                    value = condition_value(name, target, removed.current_duration) \
+                        if removed.effect_type in HARMFUL_EFFECT_TYPES else \
+                        -sum(modifier_value(attribute, modifier, target, removed.current_duration)
+                             for attribute, modifier in removed.attributes.items())
+                    score -= self.side(target) * value
+
+        elif spell_type in ("condition", "utility") and effect:
+            for target in targets:
+                applied = 1.0 - save_success_probability(target, save, spell["dc"]) if save else 1.0
+                score += applied * self.side(target) * condition_value(effect.get("modifier"), target, duration)
+
+        elif spell_type in ("buff", "debuff") and effect:
+            for target in targets:
+                if spell["name"] in target.unified_effects:
+                    continue  # Does not stack
+                value = modifier_value(effect.get("attribute"), effect.get("modifier"), target, duration)
+                score -= self.side(target) * value
+
+        return score
+
+    def best_action(self):
+        best, best_score = None, 0.0
+        for action in self.legal_actions():
+            score = self.score(action)
+            if score > best_score:
+                best, best_score = action, score
+        return best, best_score
+
+
+def decide_tactical_action(npc, all_characters):
+    """Pick the legal action with the highest expected value, falling back to the aggressive AI."""
+    planner = TacticalPlanner(npc, all_characters)
+    action, score = planner.best_action()
+    if action is None:
+        return npc._aggressive_ai_logic(all_characters)
+    targets = action["target"] if isinstance(action["target"], list) else [action["target"]]
+    what = action["weapon"]["name"] if action["type"] == "attack" else action["spell"]["name"]
+    log_message(f"{npc.name} (Tactical) decides to use {what} on {', '.join(t.name for t in targets)} "
+                f"(expected value {score:.1f}).")
+    return action
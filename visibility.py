@@ -0,0 +1,161 @@
+"""
+Line of sight, cover and field of view on a grid battle map.
+
+A BattleMap is a width x height grid of 5-ft squares (the same squares as Character.position)
+with obstacles on some of them:
+  - "wall": blocks sight completely (total cover),
+  - "three_quarters": e.g. an arrow slit or a portcullis, +5 AC to creatures behind it,
+  - "half": e.g. a low wall or a barrel, +2 AC to creatures behind it,
+  - "difficult": rubble, undergrowth or shallow water; no cover, but costs double to cross.
+
+Walls and three-quarters cover cannot be walked through; half cover is difficult terrain.
+
+Sight between two squares follows the Bresenham line between their centres: a wall on any
+square strictly between them blocks it, otherwise the best cover on the way applies. Lines
+are walked from the lower square to the higher one, so sight and cover are symmetric.
+Results are memoized per pair of squares in a bounded LRU cache that is cleared whenever an
+obstacle changes; the walked offsets of each line are cached too, shared by every origin.
+
+    battle_map = BattleMap(20, 20, {(5, 5): "wall", (6, 9): "half"})
+    engine = CombatEngine(players, npcs, battle_map=battle_map)
+"""
+
+from functools import lru_cache
+
+from battle_grid import SQUARE_FEET
+from combat_engine import DecisionCache
+
+WALL = "wall"
+HALF_COVER = "half"
+THREE_QUARTERS_COVER = "three_quarters"
+DIFFICULT_TERRAIN = "difficult"
+COVER_AC = {HALF_COVER: 2, THREE_QUARTERS_COVER: 5, DIFFICULT_TERRAIN: 0}
+OBSTACLES = (WALL, HALF_COVER, THREE_QUARTERS_COVER, DIFFICULT_TERRAIN)
+# Feet it takes to enter a square holding the obstacle (None: impassable); open ground is one square
+MOVEMENT_COST = {WALL: None, THREE_QUARTERS_COVER: None, HALF_COVER: 2 * SQUARE_FEET, DIFFICULT_TERRAIN: 2 * SQUARE_FEET}
+
+
+@lru_cache(maxsize=16384)
+def line_offsets(dx, dy):
+    """The squares strictly between (0, 0) and (dx, dy) on their Bresenham line, as offsets."""
+    steps_x, steps_y = abs(dx), abs(dy)
+    sign_x, sign_y = (dx > 0) - (dx < 0), (dy > 0) - (dy < 0)
+    x = y = 0
+    error = steps_x - steps_y
+    squares = []
+    while (x, y) != (dx, dy):
+        doubled = 2 * error
+        if doubled > -steps_y:
+            error -= steps_y
+            x += sign_x
+        if doubled < steps_x:
+            error += steps_x
+            y += sign_y
+        squares.append((x, y))
+    return tuple(squares[:-1])
+
+
+class BattleMap:
+    """A grid of squares with sight-blocking, cover-granting and slowing obstacles."""
+
+    def __init__(self, width, height, obstacles=None, cache_size=65536):
+        self.width = width
+        self.height = height
+        self.obstacles = {}  # (x, y) -> one of OBSTACLES
+        self.version = 0  # Bumped on every obstacle change, for caches outside the map
+        self.sight_cache = DecisionCache(max_entries=cache_size)
+        for square, kind in (obstacles or {}).items():
+            self._place(tuple(square), kind)
+
+    def _place(self, square, kind):
+        if kind not in OBSTACLES:
+            raise ValueError(f"Unknown obstacle {kind!r} at {square} (expected one of {', '.join(OBSTACLES)}).")
+        self.obstacles[square] = kind
+
+    def set_obstacle(self, square, kind):
+        """Put an obstacle on a square (replacing any other) and forget every cached line of sight."""
+        self._place(tuple(square), kind)
+        self.invalidate()
+
+    def clear_obstacle(self, square):
+        if self.obstacles.pop(tuple(square), None) is not None:
+            self.invalidate()
+
+    def invalidate(self):
+        self.version += 1
+        self.sight_cache.clear()
+
+    def in_bounds(self, square):
+        return 0 <= square[0] < self.width and 0 <= square[1] < self.height
+
+    def sight(self, a, b):
+        """(visible, cover AC bonus) between two squares; cover is None without line of sight."""
+        if a > b:
+            a, b = b, a
+        key = (a, b)
+        result = self.sight_cache.get(key)
+        if result is None:
+            result = self._trace(a, b)
+            self.sight_cache.put(key, result)
+        return result
+
+    def _trace(self, a, b):
+        obstacles = self.obstacles
+        cover = 0
+        if obstacles:
+            for dx, dy in line_offsets(b[0] - a[0], b[1] - a[1]):
+                kind = obstacles.get((a[0] + dx, a[1] + dy))
+                if kind is None:
+                    continue
+                if kind == WALL:
+                    return (False, None)
+                cover = max(cover, COVER_AC[kind])
+        return (True, cover)
+
+    def movement_cost(self, square):
+        """Feet it takes to step onto a square, or None if it cannot be entered (walls, off the map)."""
+        if not (0 <= square[0] < self.width and 0 <= square[1] < self.height):
+            return None
+        kind = self.obstacles.get(square)
+        return SQUARE_FEET if kind is None else MOVEMENT_COST[kind]
+
+    def line_of_sight(self, a, b):
+        return self.sight(a, b)[0]
+
+    def cover(self, a, b):
+        """AC bonus from obstacles between two squares: 0, 2 or 5, or None for total cover."""
+        return self.sight(a, b)[1]
+
+    def field_of_view(self, origin, radius):
+        """
+        Every square within `radius` squares of origin that can be seen from it, in one sweep:
+        a Bresenham ray goes out to each square on the edge of the radius and marks the
+        squares it crosses until it meets a wall (the wall itself is seen).
+        """
+        x, y = origin
+        visible = {origin}
+        obstacles = self.obstacles
+        edge = [(dx, -radius) for dx in range(-radius, radius + 1)] + \
+               [(dx, radius) for dx in range(-radius, radius + 1)] + \
+               [(-radius, dy) for dy in range(-radius + 1, radius)] + \
+               [(radius, dy) for dy in range(-radius + 1, radius)]
+        for end in edge:
+            for dx, dy in line_offsets(*end) + (end,):
+                square = (x + dx, y + dy)
+                if not self.in_bounds(square):
+                    break
+                visible.add(square)
+                if obstacles.get(square) == WALL:
+                    break
+        return visible
+
+    def stats(self):
+        return {"obstacles": len(self.obstacles), "version": self.version, "sight_cache": self.sight_cache.stats()}
+
+    def to_dict(self):
+        return {"width": self.width, "height": self.height,
+                "obstacles": [[x, y, kind] for (x, y), kind in self.obstacles.items()]}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["width"], data["height"], {(x, y): kind for x, y, kind in data.get("obstacles", [])})